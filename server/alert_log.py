@@ -0,0 +1,184 @@
+"""
+Registro persistente de alertas (SQLite, solo se añade) y bandeja de salida de notificaciones.
+
+- `alerts`: cada AlertEvent emitido por un motor, con un `seq` creciente. Clientes
+  y notificadores retoman desde el último `seq` visto tras un reinicio sin
+  recalcular nada. La clave (tag, candle_time, title) evita duplicados si varios
+  workers comparten el fichero.
+- `outbox`: notificación pendiente por (clave, chat) hasta que se entrega; al
+  arrancar se reencolan las que quedaron sin enviar.
+
+Las inserciones se ejecutan al momento (el `seq` se conoce enseguida) y el commit
+se agrupa: uno por vuelta del event loop, aunque un cierre de vela dispare cientos.
+Las consultas de lectura se lanzan desde hilos (asyncio.to_thread) para no frenar
+el loop; la conexión es única, así que todo acceso pasa por un lock.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import settings
+
+log = logging.getLogger("alert_log")
+
+_ALERT_COLS = ("seq", "tag", "id", "ts", "candle_time", "symbol", "interval", "title",
+               "message", "severity", "price", "kind")
+
+
+class AlertLog:
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Compartida entre el event loop y los hilos de to_thread: siempre bajo self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS alerts (
+                seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                tag         TEXT    NOT NULL,
+                id          TEXT    NOT NULL,
+                ts          INTEGER NOT NULL,
+                candle_time INTEGER NOT NULL,
+                symbol      TEXT    NOT NULL,
+                interval    TEXT    NOT NULL,
+                title       TEXT    NOT NULL,
+                message     TEXT    NOT NULL,
+                severity    TEXT    NOT NULL,
+                price       REAL,
+                kind        TEXT    NOT NULL,
+                UNIQUE (tag, candle_time, title)
+            );
+            CREATE INDEX IF NOT EXISTS alerts_stream ON alerts (symbol, interval, seq);
+            CREATE TABLE IF NOT EXISTS outbox (
+                key          TEXT NOT NULL,
+                chat         TEXT NOT NULL,
+                text         TEXT NOT NULL,
+                created_at   REAL NOT NULL,
+                delivered_at REAL,
+                attempts     INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (key, chat)
+            );
+            """
+        )
+        self.db.commit()
+        self._commit_scheduled = False
+
+    # ---------- escritura ----------
+    def _schedule_commit(self):
+        if self._commit_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            with self.lock:
+                self.db.commit()
+            return
+        self._commit_scheduled = True
+        loop.call_soon(self._commit)
+
+    def _commit(self):
+        self._commit_scheduled = False
+        try:
+            with self.lock:
+                self.db.commit()
+        except sqlite3.Error as e:
+            log.warning(f"Alert log commit failed: {e}")
+
+    def append(self, tag: str, event: Dict[str, Any], candle_time: int) -> int:
+        """Registra un evento (AlertEvent.to_dict()) y devuelve su `seq` (el existente si ya estaba)."""
+        with self.lock:
+            cur = self.db.execute(
+                "INSERT OR IGNORE INTO alerts (tag, id, ts, candle_time, symbol, interval, title, message, "
+                "severity, price, kind) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (tag, event["id"], event["ts"], candle_time, event["symbol"], event["interval"], event["title"],
+                 event["message"], event["severity"], event["price"], event["kind"]),
+            )
+            if cur.rowcount:
+                seq = cur.lastrowid
+            else:
+                seq = self.db.execute("SELECT seq FROM alerts WHERE tag=? AND candle_time=? AND title=?",
+                                      (tag, candle_time, event["title"])).fetchone()[0]
+        self._schedule_commit()
+        return seq
+
+    @property
+    def last_seq(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM alerts").fetchone()[0]
+
+    # ---------- lectura ----------
+    def history(self, symbol: Optional[str] = None, interval: Optional[str] = None, tag: Optional[str] = None,
+                after: Optional[int] = None, until: Optional[int] = None, since_ts: Optional[int] = None,
+                limit: int = 200) -> List[Dict[str, Any]]:
+        """
+        Alertas en orden de `seq`. Con `after` se devuelven las siguientes a ese seq
+        (reanudar); sin él, las `limit` más recientes.
+        """
+        where, args = [], []
+        for col, val in (("symbol", symbol), ("interval", interval), ("tag", tag)):
+            if val is not None:
+                where.append(f"{col}=?")
+                args.append(val)
+        if after is not None:
+            where.append("seq>?")
+            args.append(after)
+        if until is not None:
+            where.append("seq<=?")
+            args.append(until)
+        if since_ts is not None:
+            where.append("ts>=?")
+            args.append(since_ts)
+        sql = f"SELECT {', '.join(_ALERT_COLS)} FROM alerts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self.lock:
+            if after is not None:
+                rows = self.db.execute(sql + " ORDER BY seq LIMIT ?", (*args, limit)).fetchall()
+            else:
+                rows = self.db.execute(sql + " ORDER BY seq DESC LIMIT ?", (*args, limit)).fetchall()[::-1]
+        return [dict(zip(_ALERT_COLS, r)) for r in rows]
+
+    # ---------- bandeja de salida ----------
+    def enqueue(self, key: str, chat: str, text: str) -> bool:
+        """Registra una notificación pendiente; False si (key, chat) ya estaba."""
+        with self.lock:
+            cur = self.db.execute("INSERT OR IGNORE INTO outbox (key, chat, text, created_at) VALUES (?, ?, ?, ?)",
+                                  (key, chat, text, time.time()))
+        self._schedule_commit()
+        return bool(cur.rowcount)
+
+    def delivered(self, chat: str, keys: List[str]):
+        now = time.time()
+        with self.lock:
+            self.db.executemany("UPDATE outbox SET delivered_at=?, attempts=attempts+1 WHERE key=? AND chat=?",
+                                [(now, k, chat) for k in keys])
+        self._schedule_commit()
+
+    def failed(self, chat: str, keys: List[str]):
+        with self.lock:
+            self.db.executemany("UPDATE outbox SET attempts=attempts+1 WHERE key=? AND chat=?",
+                                [(k, chat) for k in keys])
+        self._schedule_commit()
+
+    def pending(self, max_age_sec: float) -> List[Tuple[str, str, str]]:
+        """(key, chat, text) sin entregar y más recientes que `max_age_sec`, en orden de creación."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT key, chat, text FROM outbox WHERE delivered_at IS NULL AND created_at>=? ORDER BY created_at",
+                (time.time() - max_age_sec,),
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+alert_log = AlertLog(settings.ALERT_LOG_PATH)
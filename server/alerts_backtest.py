@@ -0,0 +1,277 @@
+"""
+Replay/backtest por lotes de AlertsEngine sobre velas históricas en columnas.
+
+Calcula con NumPy, para toda la serie de una vez, los cruces EFM, la serie de
+Balance y los rebotes (principal/tardío), y genera la misma secuencia de
+AlertEvent que daría alimentar las velas una a una a `on_closed_candle`
+(salvo `id` y `ts`: aquí `ts` es el tiempo de la vela).
+
+CLI:
+    python alerts_backtest.py --symbols DOGE_USDT,BTC_USDT --interval Min1 \
+        --days 30 --thresholds 10,20,30 --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from alerts_engine import AlertEvent, EngineConfig, RANGE_LEN, gauss_w
+
+# Mismo tamaño de ventana que el motor en streaming (deque de 600 y kernel de 500)
+BUF_LEN = 600
+NWE_LEN = 500
+
+Columns = Dict[str, np.ndarray]
+
+
+def _recurrence_ema(x: np.ndarray, length: int) -> np.ndarray:
+    # Recurrencias secuenciales: misma fórmula que alerts_engine.ema para obtener los mismos floats
+    k = 2.0 / (length + 1.0)
+    out = np.empty(len(x)); prev = None
+    for i, v in enumerate(x.tolist()):
+        prev = v if prev is None else v * k + prev * (1 - k)
+        out[i] = prev
+    return out
+
+
+def _atr_wilder(h: np.ndarray, l: np.ndarray, c: np.ndarray, length: int = 14) -> np.ndarray:
+    c_prev = np.concatenate(([np.nan], c[:-1]))
+    tr = np.fmax(h - l, np.fmax(np.abs(h - c_prev), np.abs(l - c_prev)))
+    if len(tr): tr[0] = h[0] - l[0]
+    out = np.empty(len(tr)); prev = None
+    for i, v in enumerate(tr.tolist()):
+        prev = v if prev is None else (prev * (length - 1) + v) / length
+        out[i] = prev
+    return out
+
+
+def _rolling(x: np.ndarray, window: int, fn) -> np.ndarray:
+    """Máx/mín sobre las últimas min(window, i+1) velas."""
+    out = np.empty(len(x))
+    head = min(window - 1, len(x))
+    out[:head] = fn.accumulate(x[:head])
+    if len(x) >= window:
+        out[window - 1:] = fn.reduce(sliding_window_view(x, window), axis=1)
+    return out
+
+
+def nwe_out_calc(c: np.ndarray, gauss: np.ndarray) -> np.ndarray:
+    """Kernel Nadaraya-Watson (ventana NWE_LEN) para cada vela."""
+    n_all = len(c)
+    g_rev = gauss[::-1].copy()
+    g_cum = np.concatenate(([0.0], np.cumsum(gauss)))
+    out = np.empty(n_all)
+    head = min(NWE_LEN - 1, n_all)
+    for i in range(head):
+        n = i + 1
+        out[i] = np.dot(c[:n], g_rev[NWE_LEN - n:]) / max(g_cum[n], 1e-12)
+    if n_all >= NWE_LEN:
+        out[NWE_LEN - 1:] = sliding_window_view(c, NWE_LEN) @ g_rev / max(g_cum[NWE_LEN], 1e-12)
+    return out
+
+
+def compute_series(cfg: EngineConfig, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Series completas (una entrada por vela) de lo que evalúa AlertsEngine:
+    efm_long/efm_short, balance (NaN si está desactivado), reb_up/reb_dn, late_up/late_dn.
+    """
+    o, h, l, c = (np.asarray(a, dtype=np.float64) for a in (o, h, l, c))
+    n = len(c)
+    idx = np.arange(n)
+    atr = _atr_wilder(h, l, c, 14)
+
+    # ---------- EFM ----------
+    efm_long = np.zeros(n, dtype=bool); efm_short = np.zeros(n, dtype=bool)
+    if cfg.enable_efm and n > 1:
+        mb = _recurrence_ema(0.5 * (h + l), 100)
+        e13 = _recurrence_ema(c, 13); e48 = _recurrence_ema(c, 48)
+        cross_up = (e13[:-1] <= e48[:-1]) & (e13[1:] > e48[1:])
+        cross_dn = (e13[:-1] >= e48[:-1]) & (e13[1:] < e48[1:])
+        efm_long[1:] = cross_up & (c[1:] > mb[1:])
+        efm_short[1:] = cross_dn & (c[1:] < mb[1:])
+
+    # ---------- Balance ----------
+    balance = np.full(n, np.nan)
+    if cfg.enable_balance and n > 0:
+        out_calc = nwe_out_calc(c, np.array([gauss_w(i, 8.0) for i in range(NWE_LEN)]))
+        mae_in = np.abs(c - out_calc)
+        mae_prev = np.empty(n); prev = None
+        for i, v in enumerate(mae_in.tolist()):
+            prev = v if prev is None else prev + (v - prev) / 499.0
+            mae_prev[i] = prev
+        scale_w = np.maximum(mae_prev * 3.0, 1e-10)
+        upper_break = _rolling(h, RANGE_LEN, np.maximum) + 0.20 * atr
+        lower_break = _rolling(l, RANGE_LEN, np.minimum) - 0.20 * atr
+        dist_up = upper_break - c
+        dist_dn = c - lower_break
+        bull_prox = np.where(dist_up <= 0, 1.0, np.maximum(0.0, 1.0 - dist_up / scale_w))
+        bear_prox = np.where(dist_dn <= 0, 1.0, np.maximum(0.0, 1.0 - dist_dn / scale_w))
+        bull_opp = np.clip((out_calc - lower_break) / scale_w, 0.0, 1.0)
+        bear_opp = np.clip((upper_break - out_calc) / scale_w, 0.0, 1.0)
+        balance = ((0.60 * bull_prox + 0.40 * bull_opp) - (0.60 * bear_prox + 0.40 * bear_opp)) * 100.0
+
+    # ---------- Estado de zona (última señal EFM hasta cada vela) ----------
+    sig = np.where(efm_long, 1, np.where(efm_short, -1, 0))
+    last_idx = np.maximum.accumulate(np.where(sig != 0, idx, -1)) if n else idx
+    has = last_idx >= 0
+    li = np.where(has, last_idx, 0)
+    is_long = has & (sig[li] == 1)
+    is_short = has & (sig[li] == -1)
+    body_low = np.minimum(o, c)[li]; body_high = np.maximum(o, c)[li]
+
+    rng = h - l
+    body = np.abs(c - o)
+    up_w = h - np.maximum(o, c)
+    dn_w = np.minimum(o, c) - l
+    impulse_up = (body >= 0.60 * rng) | ((c - o) >= 0.35 * atr)
+    impulse_dn = (body >= 0.60 * rng) | ((o - c) >= 0.35 * atr)
+    bull_bar = c >= o; bear_bar = c <= o
+
+    # ---------- Rebote principal ----------
+    reb_up = np.zeros(n, dtype=bool); reb_dn = np.zeros(n, dtype=bool)
+    if cfg.enable_rebounds:
+        ok = has & (rng > 0)
+        small_body = body <= 0.55 * rng
+        long_lower = dn_w >= 0.35 * rng
+        long_upper = up_w >= 0.35 * rng
+        eps = 0.03 * atr; touch_min = 0.02 * atr
+        pen_long = np.maximum(0.0, np.where(body_high != 0, body_high, h) - l)
+        pen_short = np.maximum(0.0, h - np.where(body_low != 0, body_low, l))
+        wick_long = (l >= body_low - eps) & (l <= body_high + eps) & (pen_long >= touch_min)
+        wick_short = (h <= body_high + eps) & (h >= body_low - eps) & (pen_short >= touch_min)
+        reb_up = ok & is_long & ((bull_bar & small_body & long_lower & wick_long) | (wick_long & impulse_up))
+        reb_dn = ok & is_short & ((bear_bar & small_body & long_upper & wick_short) | (wick_short & impulse_dn))
+
+    # ---------- Rebote tardío ----------
+    late_up = np.zeros(n, dtype=bool); late_dn = np.zeros(n, dtype=bool)
+    if cfg.enable_rebounds_late:
+        # len(self.closes) satura en BUF_LEN en el motor en streaming; se replica tal cual
+        mark_index = np.minimum(li + 1, BUF_LEN) - 1
+        bars_far = has & ((np.minimum(idx + 1, BUF_LEN) - 1 - mark_index) >= 12)
+        disp = 0.02 * atr
+        size = np.maximum(0.0, body_high - body_low)
+        low = np.where(is_long, body_high - size * 0.25 - disp, body_low - disp)
+        high = np.where(is_long, body_high + disp, body_low + size * 0.25 + disp)
+        pos = rng > 0
+        small_body = pos & (body <= 0.55 * rng)
+        long_lower = pos & (dn_w >= 0.35 * rng)
+        long_upper = pos & (up_w >= 0.35 * rng)
+        touch2 = 0.02 * atr
+        inside_long = (l >= low) & (l <= high) & (np.maximum(0.0, high - l) >= touch2)
+        inside_short = (h <= high) & (h >= low) & (np.maximum(0.0, h - low) >= touch2)
+        late_up = bars_far & is_long & ((bull_bar & small_body & long_lower & inside_long) | (inside_long & impulse_up))
+        late_dn = bars_far & is_short & ((bear_bar & small_body & long_upper & inside_short) | (inside_short & impulse_dn))
+
+    return {"efm_long": efm_long, "efm_short": efm_short, "balance": balance,
+            "reb_up": reb_up, "reb_dn": reb_dn, "late_up": late_up, "late_dn": late_dn}
+
+
+def replay(cfg: EngineConfig, cols: Columns) -> List[AlertEvent]:
+    """Secuencia de AlertEvent equivalente a la ruta en streaming."""
+    t = np.asarray(cols["time"]); c = np.asarray(cols["close"], dtype=np.float64)
+    s = compute_series(cfg, cols["open"], cols["high"], cols["low"], c)
+    thr = cfg.balance_threshold
+    bal_bull = s["balance"] >= thr
+    bal_bear = s["balance"] <= -thr
+    any_ev = s["efm_long"] | s["efm_short"] | bal_bull | bal_bear | s["reb_up"] | s["reb_dn"] | s["late_up"] | s["late_dn"]
+
+    def mk(i: int, title: str, message: str, sev: str, kind: str) -> AlertEvent:
+        return AlertEvent(str(uuid.uuid4()), int(t[i]), cfg.symbol, cfg.interval, title, message, sev, float(c[i]), kind)
+
+    evs: List[AlertEvent] = []
+    for i in np.flatnonzero(any_ev).tolist():
+        ci = float(c[i])
+        if s["efm_long"][i]: evs.append(mk(i, "EFMUS Long", f"EMA13>EMA48. C={ci:.6f}", "bull", "efm"))
+        if s["efm_short"][i]: evs.append(mk(i, "EFMUS Short", f"EMA13<EMA48. C={ci:.6f}", "bear", "efm"))
+        bal = float(s["balance"][i])
+        if bal_bull[i]: evs.append(mk(i, "Balance Bull", f"{bal:.2f} ≥ {thr}", "bull", "balance"))
+        if bal_bear[i]: evs.append(mk(i, "Balance Bear", f"{bal:.2f} ≤ -{thr}", "bear", "balance"))
+        if s["reb_up"][i]: evs.append(mk(i, "Rebote LONG (principal)", "zona activa", "bull", "rebound"))
+        if s["reb_dn"][i]: evs.append(mk(i, "Rebote SHORT (principal)", "zona activa", "bear", "rebound"))
+        if s["late_up"][i]: evs.append(mk(i, "Rebote LONG (tardío)", "zona tardía", "bull", "rebound_late"))
+        if s["late_dn"][i]: evs.append(mk(i, "Rebote SHORT (tardío)", "zona tardía", "bear", "rebound_late"))
+    return evs
+
+
+def columns_from_candles(candles: Sequence[dict]) -> Columns:
+    return {
+        "time": np.fromiter((k["time"] for k in candles), dtype=np.int64, count=len(candles)),
+        **{f: np.fromiter((k[f] for k in candles), dtype=np.float64, count=len(candles))
+           for f in ("open", "high", "low", "close", "volume")},
+    }
+
+
+# ============================
+# Barrido de parámetros (pool de procesos)
+# ============================
+def _sweep_symbol(args: Tuple[str, str, Columns, List[float], dict]) -> List[dict]:
+    # Las series no dependen del umbral: se calculan una vez por símbolo
+    symbol, interval, cols, thresholds, flags = args
+    cfg = EngineConfig(symbol, interval, 0.0, **flags)
+    s = compute_series(cfg, cols["open"], cols["high"], cols["low"], cols["close"])
+    base = {k: int(s[k].sum()) for k in ("efm_long", "efm_short", "reb_up", "reb_dn", "late_up", "late_dn")}
+    out = []
+    for thr in thresholds:
+        out.append({"symbol": symbol, "interval": interval, "balance_threshold": thr, "bars": len(cols["close"]),
+                    "balance_bull": int((s["balance"] >= thr).sum()), "balance_bear": int((s["balance"] <= -thr).sum()),
+                    **base})
+    return out
+
+
+def sweep(data: Dict[str, Columns], interval: str, thresholds: List[float],
+          workers: int = 0, **flags) -> List[dict]:
+    """Cuenta alertas por (símbolo, umbral) repartiendo los símbolos en un pool de procesos."""
+    jobs = [(sym, interval, cols, thresholds, flags) for sym, cols in data.items()]
+    if workers == 1 or len(jobs) <= 1:
+        return [r for job in jobs for r in _sweep_symbol(job)]
+    with ProcessPoolExecutor(max_workers=workers or None) as pool:
+        return [r for rows in pool.map(_sweep_symbol, jobs) for r in rows]
+
+
+async def _load(symbols: List[str], interval: str, days: float) -> Dict[str, Columns]:
+    # Import diferido: los workers del pool no necesitan abrir el store
+    from candle_store import get_candles
+    end = int(time.time())
+    start = end - int(days * 86400)
+    out: Dict[str, Columns] = {}
+    for sym in symbols:
+        out[sym] = columns_from_candles(await get_candles(sym, interval, start, end))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Backtest por lotes de AlertsEngine")
+    ap.add_argument("--symbols", required=True, help="lista separada por comas")
+    ap.add_argument("--interval", default="Min1")
+    ap.add_argument("--days", type=float, default=30.0)
+    ap.add_argument("--thresholds", default="20", help="umbrales de Balance separados por comas")
+    ap.add_argument("--workers", type=int, default=0, help="0 = núm. de CPUs")
+    ap.add_argument("--events", action="store_true", help="emitir los AlertEvent (primer umbral) en vez del resumen")
+    for flag in ("balance", "efm", "rebounds", "rebounds_late"):
+        ap.add_argument(f"--no-{flag.replace('_', '-')}", dest=f"enable_{flag}", action="store_false")
+    a = ap.parse_args()
+
+    symbols = [s.strip() for s in a.symbols.split(",") if s.strip()]
+    thresholds = [float(x) for x in a.thresholds.split(",")]
+    flags = {k: getattr(a, k) for k in ("enable_balance", "enable_efm", "enable_rebounds", "enable_rebounds_late")}
+    data = asyncio.run(_load(symbols, a.interval, a.days))
+
+    if a.events:
+        for sym, cols in data.items():
+            for ev in replay(EngineConfig(sym, a.interval, thresholds[0], **flags), cols):
+                print(json.dumps(ev.to_dict(), ensure_ascii=False))
+        return
+    for row in sweep(data, a.interval, thresholds, a.workers, **flags):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
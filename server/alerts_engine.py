@@ -1,9 +1,12 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Deque, List, Optional, Tuple, Dict
-from collections import deque
+from typing import List, Optional, Tuple, Dict
 import math, time, uuid
 
+import numpy as np
+
+from indicators import RingBuffer, RollingExtreme, gauss_w
+
 def ema(prev: Optional[float], x: float, length: int) -> float:
     if prev is None: return x
     k = 2.0 / (length + 1.0)
@@ -21,8 +24,8 @@ def atr_wilder(prev_atr: Optional[float], tr: float, length: int) -> float:
     if prev_atr is None: return tr
     return (prev_atr * (length - 1) + tr) / length
 
-def gauss_w(x: int, h: float) -> float:
-    return math.exp(-(x * x) / (h * h * 2.0)) if h > 0 else 1.0
+# Ventana (velas) del máx/mín usado por Balance
+RANGE_LEN = 16
 
 class Candle:
     def __init__(self, t:int,o:float,h:float,l:float,c:float,v:float):
@@ -39,21 +42,32 @@ class EngineConfig:
         self.enable_rebounds=enable_rebounds
         self.enable_rebounds_late=enable_rebounds_late
 
+    def key(self) -> tuple:
+        return (self.symbol, self.interval, float(self.balance_threshold), self.enable_balance,
+                self.enable_efm, self.enable_rebounds, self.enable_rebounds_late)
+
 class AlertEvent:
     def __init__(self, id:str, ts:int, symbol:str, interval:str, title:str, message:str,
                  severity:str="info", price:Optional[float]=None, kind:str="info"):
         self.id=id; self.ts=ts; self.symbol=symbol; self.interval=interval
         self.title=title; self.message=message; self.severity=severity; self.price=price; self.kind=kind
 
+    def to_dict(self) -> dict:
+        return {"id":self.id, "ts":self.ts, "symbol":self.symbol, "interval":self.interval, "title":self.title,
+                "message":self.message, "severity":self.severity, "price":self.price, "kind":self.kind}
+
 class AlertsEngine:
     def __init__(self, cfg: EngineConfig):
         self.cfg = cfg
-        self.closes: Deque[float] = deque(maxlen=600)
-        self.highs: Deque[float]  = deque(maxlen=600)
-        self.lows: Deque[float]   = deque(maxlen=600)
-        self.opens: Deque[float]  = deque(maxlen=600)
-        self.vols: Deque[float]   = deque(maxlen=600)
-        self.times: Deque[int]    = deque(maxlen=600)
+        self.closes = RingBuffer(600)
+        self.highs  = RingBuffer(600)
+        self.lows   = RingBuffer(600)
+        self.opens  = RingBuffer(600)
+        self.vols   = RingBuffer(600)
+        self.times  = RingBuffer(600, np.int64)
+        # Máx/mín de rangeLen velas para Balance
+        self.hh_roll = RollingExtreme(RANGE_LEN, True)
+        self.ll_roll = RollingExtreme(RANGE_LEN, False)
 
         self.prev_close: Optional[float] = None
         self.prev_atr: Optional[float] = None
@@ -63,7 +77,10 @@ class AlertsEngine:
         self.mb_avg: Optional[float] = None
 
         self.mae_prev: Optional[float] = None
-        self.gauss = [gauss_w(i, 8.0) for i in range(500)]
+        self.gauss = np.array([gauss_w(i, 8.0) for i in range(500)])
+        # Pesos alineados con closes.last(n) (más antiguo → más reciente) y sus sumas parciales
+        self._gauss_rev = self.gauss[::-1].copy()
+        self._gauss_cum = np.concatenate(([0.0], np.cumsum(self.gauss)))
 
         self.last_signal: Optional[str] = None
         self.zone_low: Optional[float] = None
@@ -73,21 +90,20 @@ class AlertsEngine:
         self.mark_index: Optional[int] = None
 
     def _nwe_out_calc(self, length: int = 500) -> float:
-        n = min(len(self.closes), length)
+        n = min(len(self.closes), length, len(self.gauss))
         if n == 0: return float('nan')
-        s=0.0; ws=0.0
-        for i in range(n):
-            w=self.gauss[i]; s += list(self.closes)[-1-i]*w; ws+=w
+        s = float(np.dot(self.closes.last(n), self._gauss_rev[len(self.gauss)-n:]))
+        ws = float(self._gauss_cum[n])
         return s/max(ws,1e-12)
 
     def _balance(self) -> Tuple[float, Dict[str, float]]:
         p = dict(h=8.0, mult=3.0, histScale=100.0, proxWidth=1.0,
                  wUpProx=0.60, wDnOut=0.40, wDnProx=0.60, wUpOut=0.40,
-                 rangeLen=16, atrLen=14, brBufATR=0.20)
+                 rangeLen=RANGE_LEN, atrLen=14, brBufATR=0.20)
         len_eff = min(p["rangeLen"], len(self.highs))
         if len_eff == 0: return float('nan'), {}
-        hh = max(list(self.highs)[-len_eff:])
-        ll = min(list(self.lows)[-len_eff:])
+        hh = self.hh_roll.value()
+        ll = self.ll_roll.value()
         atr = self.prev_atr or 0.0
         upper_break = hh + p["brBufATR"] * atr
         lower_break = ll - p["brBufATR"] * atr
@@ -187,6 +203,7 @@ class AlertsEngine:
     def on_closed_candle(self, c: Candle) -> List[AlertEvent]:
         evs: List[AlertEvent] = []
         self.opens.append(c.o); self.highs.append(c.h); self.lows.append(c.l); self.closes.append(c.c); self.vols.append(c.v); self.times.append(c.t)
+        self.hh_roll.push(c.h); self.ll_roll.push(c.l)
         tr = true_range(c.h, c.l, self.prev_close)
         self.prev_atr = atr_wilder(self.prev_atr, tr, 14)
         self.prev_close = c.c
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from settings import settings
+from alerts_engine import AlertsEngine, AlertEvent, Candle, EngineConfig
+from candle_store import get_candles
+from fanout import Subscriber, dumps
+from mexc_rest import interval_sec
+from mexc_stream import hub, KlineStreamer, StreamKey
+from backplane import backplane
+from alert_log import alert_log
+import metrics
+
+log = logging.getLogger("alerts")
+
+ConfigKey = tuple
+
+
+class AlertsGroup:
+    """Un motor por configuración distinta, compartido por todos sus suscriptores."""
+    def __init__(self, cfg: EngineConfig):
+        self.cfg = cfg
+        self.tag = "alerts:%s:%s:%s" % (cfg.symbol, cfg.interval, hashlib.sha1(repr(cfg.key()).encode()).hexdigest()[:10])
+        self.engine = AlertsEngine(cfg)
+        self.clients: Set[Subscriber] = set()
+        self.ready = False
+        self.pending: List[dict] = []   # cierres recibidos mientras se siembra
+        self.last_t: Optional[int] = None
+
+    def feed(self, candle: dict) -> List[AlertEvent]:
+        if self.last_t is not None and candle["time"] <= self.last_t:
+            return []
+        self.last_t = candle["time"]
+        c = Candle(candle["time"], candle["open"], candle["high"], candle["low"], candle["close"], candle["volume"])
+        with metrics.alerts_eval.time(self.cfg.interval):
+            return self.engine.on_closed_candle(c)
+
+
+class AlertStream:
+    """
+    Alertas de un (symbol, interval): escucha los cierres del KlineStreamer compartido
+    y evalúa una sola vez cada motor, repartiendo los eventos a sus suscriptores.
+    """
+    def __init__(self, symbol: str, interval: str):
+        self.symbol = symbol
+        self.interval = interval
+        self.groups: Dict[ConfigKey, AlertsGroup] = {}
+        self.streamer: Optional[KlineStreamer] = None
+        self._lock = asyncio.Lock()
+        # Evita mandar a Telegram la misma alerta desde dos configuraciones distintas
+        self._notified: Tuple[Optional[int], Set[str]] = (None, set())
+        self._tasks: Set[asyncio.Task] = set()
+        # attach() en curso: mientras haya alguno el stream no se desmonta (ni el
+        # streamer se libera) aunque de momento no tenga grupos
+        self.attaching = 0
+
+    @property
+    def idle(self) -> bool:
+        return not self.groups and not self.attaching
+
+    async def attach(self, cfg: EngineConfig, q: Subscriber) -> str:
+        self.attaching += 1
+        try:
+            async with self._lock:
+                if self.streamer is None:
+                    self.streamer = await hub.acquire(self.symbol, self.interval)
+                    self.streamer.add_close_listener(self.on_closed)
+            key = cfg.key()
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = AlertsGroup(cfg)
+                group.clients.add(q)
+            else:
+                group.clients.add(q)
+                return group.tag
+        finally:
+            self.attaching -= 1
+        await self._seed(group)
+        return group.tag
+
+    def _release_if_idle(self):
+        if self.idle and self.streamer is not None:
+            self.streamer.remove_close_listener(self.on_closed)
+            hub.release(self.streamer)
+            self.streamer = None
+
+    def detach(self, cfg: EngineConfig, q: Subscriber):
+        key = cfg.key()
+        group = self.groups.get(key)
+        if group is None:
+            return
+        group.clients.discard(q)
+        if not group.clients:
+            del self.groups[key]
+        self._release_if_idle()
+
+    async def _seed(self, group: AlertsGroup):
+        """Calienta el motor con histórico cerrado (sin emitir alertas)."""
+        step = interval_sec(self.interval)
+        now = int(time.time())
+        try:
+            candles = await get_candles(self.symbol, self.interval, now - settings.ALERTS_SEED_BARS * step, now)
+        except Exception as e:
+            log.warning(f"Seed failed {self.symbol} {self.interval}: {e}")
+            candles = []
+        for c in candles:
+            if c["time"] + step <= now:
+                group.feed(c)
+        group.ready = True
+        pending, group.pending = group.pending, []
+        for c in pending:
+            self._dispatch(group, group.feed(c), c)
+
+    def on_closed(self, candle: dict):
+        for group in list(self.groups.values()):
+            if not group.ready:
+                group.pending.append(candle)
+                continue
+            self._dispatch(group, group.feed(candle), candle)
+
+    def _dispatch(self, group: AlertsGroup, events: List[AlertEvent], candle: dict):
+        if not events:
+            return
+        t, sent = self._notified
+        if t != candle["time"]:
+            t, sent = candle["time"], set()
+            self._notified = (t, sent)
+        for ev in events:
+            payload = ev.to_dict()
+            # Registro persistente: `seq` permite a los clientes reanudar sin duplicados
+            payload["seq"] = alert_log.append(group.tag, payload, candle["time"])
+            frame = dumps({"type": "alert", "stream": group.tag, "payload": payload})
+            for q in group.clients:
+                q.put(frame)
+            if ev.title not in sent:
+                sent.add(ev.title)
+                task = asyncio.create_task(self._notify(
+                    f"[{ev.symbol} {ev.interval}] {ev.title}\n{ev.message}",
+                    f"{ev.symbol}:{ev.interval}:{t}:{ev.title}"))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, text: str, key: str):
+        try:
+            # Deduplicado también entre workers (backplane)
+            await backplane.notify(text, key)
+        except Exception as e:
+            log.warning(f"Telegram notify failed: {e}")
+
+
+class AlertsHub:
+    """Gestiona los AlertStream por (symbol, interval)."""
+    def __init__(self):
+        self.streams: Dict[StreamKey, AlertStream] = {}
+
+    async def subscribe(self, cfg: EngineConfig, q: Subscriber) -> str:
+        """Suscribe `q` a las alertas de `cfg`; devuelve la etiqueta del stream."""
+        key = (cfg.symbol, cfg.interval)
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = AlertStream(cfg.symbol, cfg.interval)
+        try:
+            return await stream.attach(cfg, q)
+        except BaseException:
+            # p. ej. StreamLimitError o cancelación: sin grupos ni otros attach, fuera
+            stream._release_if_idle()
+            if stream.idle and self.streams.get(key) is stream:
+                del self.streams[key]
+            raise
+
+    def unsubscribe(self, cfg: EngineConfig, q: Subscriber):
+        key = (cfg.symbol, cfg.interval)
+        stream = self.streams.get(key)
+        if stream is None:
+            return
+        stream.detach(cfg, q)
+        if stream.idle:
+            del self.streams[key]
+
+
+alerts_hub = AlertsHub()
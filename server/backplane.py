@@ -0,0 +1,462 @@
+"""
+Backplane entre procesos del proxy (varios workers de uvicorn o varios hosts).
+
+Un único proceso líder mantiene las suscripciones upstream con MEXC; el resto
+(seguidores) le piden los streams que necesitan y reciben las velas ya
+normalizadas, que repiten localmente a sus clientes (y de ellas derivan
+intervalos, indicadores y alertas). Los deltas del libro y las operaciones
+viajan igual, y cada seguidor mantiene su propio libro. Las notificaciones de Telegram se
+deduplican entre procesos.
+
+Implementaciones (BACKPLANE):
+- local:  un solo proceso, sin backplane (comportamiento por defecto).
+- socket: procesos del mismo host. El líder es quien tiene el flock de
+          BACKPLANE_SOCKET + ".lock" y sirve un socket Unix; si muere, el
+          sistema libera el lock y otro worker toma el relevo.
+- redis:  varios hosts (requiere el paquete `redis`). Liderazgo con
+          SET NX PX renovado; deseos de cada worker en hashes con TTL y velas
+          por pub/sub.
+
+Al cambiar de rol, StreamHub.rehome() pasa cada stream de upstream a remoto o
+al revés (re-homing tras failover).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from settings import settings
+from fanout import dumps
+from notifiers import notify_telegram
+from upstream_codec import DEAL, DEPTH
+
+log = logging.getLogger("backplane")
+
+StreamKey = Tuple[str, str]
+
+OPS = ("kline", DEPTH, DEAL)
+
+
+def stream_op(key: StreamKey) -> str:
+    """Nombre del canal de un stream: "depth" y "deal" para los de mercado, "kline" para las velas."""
+    return key[1] if key[1] in (DEPTH, DEAL) else "kline"
+
+
+class Backplane:
+    """Backplane local: un solo proceso, siempre líder."""
+    name = "local"
+
+    def __init__(self):
+        self.hub = None
+        self.leader = True
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._stop = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+        # Deduplicación de notificaciones (claves recientes)
+        self._notified: "OrderedDict[str, float]" = OrderedDict()
+
+    # ---------- ciclo de vida ----------
+    async def start(self, hub):
+        self.hub = hub
+
+    async def stop(self):
+        self._stop.set()
+        for t in list(self._tasks):
+            t.cancel()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def is_leader(self) -> bool:
+        return self.leader
+
+    async def _set_leader(self, leader: bool):
+        if leader == self.leader:
+            return
+        self.leader = leader
+        log.warning(f"[{self.name} {self.worker_id}] role -> {'leader' if leader else 'follower'}")
+        if self.hub is not None:
+            await self.hub.rehome()
+
+    # ---------- streams ----------
+    async def want(self, key: StreamKey):
+        """Un stream local necesita velas del líder."""
+
+    async def unwant(self, key: StreamKey):
+        """El stream local ya no necesita velas del líder."""
+
+    def has_remote(self, key: StreamKey) -> bool:
+        """Algún otro proceso quiere este stream (solo en el líder)."""
+        return False
+
+    async def publish(self, key: StreamKey, payload: Any):
+        """El líder reparte un mensaje normalizado (vela, delta del libro u operaciones) a los procesos interesados."""
+
+    async def _deliver(self, key: StreamKey, payload: Any):
+        """Mensaje recibido del líder: se publica en el stream local si es remoto."""
+        streamer = self.hub.streams.get(key) if self.hub is not None else None
+        if streamer is not None and streamer.remote:
+            streamer.msg_count += 1
+            streamer.last_msg_at = time.time()
+            await streamer.ingest(payload)
+
+    # ---------- notificaciones ----------
+    def _first_time(self, key: str) -> bool:
+        if key in self._notified:
+            return False
+        self._notified[key] = time.time()
+        while len(self._notified) > 10000:
+            self._notified.popitem(last=False)
+        return True
+
+    async def notify(self, text: str, key: str):
+        """Envía a Telegram una sola vez por `key` entre todos los procesos."""
+        if self._first_time(key):
+            await notify_telegram(text, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backplane": self.name, "worker": self.worker_id, "leader": self.leader}
+
+
+# ============================
+# Socket Unix (mismo host)
+# ============================
+class _Peer:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.wants: Set[StreamKey] = set()
+
+
+class SocketBackplane(Backplane):
+    name = "socket"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.leader = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[_Peer] = set()
+        self._remote: Dict[StreamKey, int] = {}   # líder: nº de peers por stream
+        self._wants: Set[StreamKey] = set()       # seguidor: streams pedidos al líder
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def start(self, hub):
+        await super().start(hub)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # El primer proceso en arrancar queda como líder antes de servir peticiones
+        if self._try_lock():
+            await self._lead()
+        self._spawn(self._run())
+
+    async def stop(self):
+        await super().stop()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.writer.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)   # libera el flock
+            self._lock_fd = None
+
+    def _try_lock(self) -> bool:
+        import fcntl
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _lead(self):
+        try:
+            os.unlink(self.path)   # socket huérfano del líder anterior
+        except OSError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        await self._set_leader(True)
+
+    async def _run(self):
+        """Seguidor: conecta con el líder; si cae, intenta quedarse con el lock."""
+        while not self._stop.is_set() and not self.leader:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                if self._try_lock():
+                    await self._lead()
+                    return
+                await asyncio.sleep(0.2)
+                continue
+            self._writer = writer
+            log.info(f"[socket {self.worker_id}] connected to leader")
+            try:
+                for key in list(self._wants):
+                    self._send({"op": "want", "symbol": key[0], "interval": key[1]})
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    m = json.loads(line)
+                    if m.get("op") in OPS:
+                        await self._deliver((m["symbol"], m["interval"]), m["payload"])
+                    elif m.get("op") == "error":
+                        log.warning(f"[socket {self.worker_id}] leader error: {m.get('error')}")
+            except (OSError, ValueError) as e:
+                log.warning(f"[socket {self.worker_id}] leader connection lost: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+            log.warning(f"[socket {self.worker_id}] leader gone; re-electing")
+
+    def _send(self, m: Dict[str, Any]):
+        if self._writer is not None:
+            self._writer.write((dumps(m) + "\n").encode())
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Líder: atiende a un seguidor (want/unwant/notify)."""
+        peer = _Peer(writer)
+        self._peers.add(peer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    m = json.loads(line)
+                    key = (m.get("symbol"), m.get("interval"))
+                    if m.get("op") == "want" and key not in peer.wants:
+                        await self._acquire_remote(key)
+                        peer.wants.add(key)
+                    elif m.get("op") == "unwant" and key in peer.wants:
+                        peer.wants.discard(key)
+                        self._release_remote(key)
+                    elif m.get("op") == "notify":
+                        await Backplane.notify(self, m["text"], m["key"])
+                except Exception as e:
+                    writer.write((dumps({"op": "error", "error": str(e)}) + "\n").encode())
+        except OSError:
+            pass
+        finally:
+            self._peers.discard(peer)
+            for key in peer.wants:
+                self._release_remote(key)
+            writer.close()
+
+    async def _acquire_remote(self, key: StreamKey):
+        # La referencia del hub mantiene vivo el stream upstream mientras algún peer lo quiera
+        await self.hub.acquire(*key)
+        self._remote[key] = self._remote.get(key, 0) + 1
+
+    def _release_remote(self, key: StreamKey):
+        n = self._remote.get(key, 0) - 1
+        if n > 0:
+            self._remote[key] = n
+        else:
+            self._remote.pop(key, None)
+        stream = self.hub.streams.get(key)
+        if stream is not None:
+            self.hub.release(stream)
+
+    def has_remote(self, key: StreamKey) -> bool:
+        return key in self._remote
+
+    async def want(self, key: StreamKey):
+        self._wants.add(key)
+        self._send({"op": "want", "symbol": key[0], "interval": key[1]})
+
+    async def unwant(self, key: StreamKey):
+        self._wants.discard(key)
+        self._send({"op": "unwant", "symbol": key[0], "interval": key[1]})
+
+    async def publish(self, key: StreamKey, payload: Any):
+        line = (dumps({"op": stream_op(key), "symbol": key[0], "interval": key[1], "payload": payload}) + "\n").encode()
+        for peer in list(self._peers):
+            if key not in peer.wants:
+                continue
+            if peer.writer.transport.get_write_buffer_size() > settings.BACKPLANE_PEER_BUFFER:
+                log.warning(f"[socket {self.worker_id}] dropping slow peer")
+                peer.writer.close()
+                self._peers.discard(peer)
+                continue
+            peer.writer.write(line)
+
+    async def notify(self, text: str, key: str):
+        if self.leader or self._writer is None:
+            await super().notify(text, key)
+        else:
+            self._send({"op": "notify", "text": text, "key": key})
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "socket": self.path, "peers": len(self._peers),
+                "remote_streams": len(self._remote), "wants": len(self._wants)}
+
+
+# ============================
+# Redis (varios hosts, opcional)
+# ============================
+class RedisBackplane(Backplane):
+    name = "redis"
+    PREFIX = "mexc:bp:"
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis.asyncio as aioredis   # dependencia opcional
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.leader = False
+        self.ttl_ms = int(settings.BACKPLANE_LEADER_TTL_SEC * 1000)
+        self._wants: Set[StreamKey] = set()
+        self._remote: Set[StreamKey] = set()   # líder: streams adquiridos para otros workers
+        self._pubsub = None
+
+    def _channel(self, key: StreamKey) -> str:
+        return f"{self.PREFIX}{stream_op(key)}:{key[0]}:{key[1]}"
+
+    async def start(self, hub):
+        await super().start(hub)
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(f"{self.PREFIX}ctl")
+        await self._elect()
+        self._spawn(self._heartbeat())
+        self._spawn(self._listen())
+
+    async def stop(self):
+        await super().stop()
+        if self.leader:
+            await self.redis.delete(f"{self.PREFIX}leader")
+        await self.redis.delete(f"{self.PREFIX}wants:{self.worker_id}")
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.redis.aclose()
+
+    async def _elect(self):
+        lkey = f"{self.PREFIX}leader"
+        if self.leader:
+            # Renovación solo si seguimos siendo el titular
+            ok = await self.redis.eval(
+                "if redis.call('get', KEYS[1]) == ARGV[1] then "
+                "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end",
+                1, lkey, self.worker_id, self.ttl_ms)
+        else:
+            ok = await self.redis.set(lkey, self.worker_id, nx=True, px=self.ttl_ms)
+        await self._set_leader(bool(ok))
+
+    async def _heartbeat(self):
+        while not self._stop.is_set():
+            try:
+                await self._elect()
+                wkey = f"{self.PREFIX}wants:{self.worker_id}"
+                if self._wants:
+                    await self.redis.delete(wkey)
+                    await self.redis.sadd(wkey, *(f"{s}|{i}" for s, i in self._wants))
+                    await self.redis.pexpire(wkey, self.ttl_ms * 3)
+                if self.leader:
+                    await self._reconcile()
+                else:
+                    self._drop_remote()
+            except Exception as e:
+                log.warning(f"[redis {self.worker_id}] heartbeat failed: {e}")
+            await asyncio.sleep(settings.BACKPLANE_LEADER_TTL_SEC / 3)
+
+    async def _reconcile(self):
+        """Líder: adquiere/libera los streams según los deseos vigentes de todos los workers."""
+        desired: Set[StreamKey] = set()
+        async for wkey in self.redis.scan_iter(f"{self.PREFIX}wants:*"):
+            if wkey.endswith(self.worker_id):
+                continue
+            for member in await self.redis.smembers(wkey):
+                symbol, _, interval = member.partition("|")
+                desired.add((symbol, interval))
+        for key in desired - self._remote:
+            try:
+                await self.hub.acquire(*key)
+                self._remote.add(key)
+            except Exception as e:
+                log.warning(f"[redis {self.worker_id}] cannot serve {key}: {e}")
+        for key in self._remote - desired:
+            self._remote.discard(key)
+            stream = self.hub.streams.get(key)
+            if stream is not None:
+                self.hub.release(stream)
+
+    def _drop_remote(self):
+        """Liderazgo perdido: soltamos lo que manteníamos para otros workers."""
+        for key in list(self._remote):
+            self._remote.discard(key)
+            stream = self.hub.streams.get(key)
+            if stream is not None:
+                self.hub.release(stream)
+
+    async def _listen(self):
+        while not self._stop.is_set():
+            try:
+                m = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                log.warning(f"[redis {self.worker_id}] pubsub error: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if not m:
+                continue
+            if m["channel"] == f"{self.PREFIX}ctl":
+                if self.leader:
+                    await self._reconcile()
+                continue
+            data = json.loads(m["data"])
+            await self._deliver((data["symbol"], data["interval"]), data["payload"])
+
+    async def want(self, key: StreamKey):
+        self._wants.add(key)
+        await self._pubsub.subscribe(self._channel(key))
+        wkey = f"{self.PREFIX}wants:{self.worker_id}"
+        await self.redis.sadd(wkey, f"{key[0]}|{key[1]}")
+        await self.redis.pexpire(wkey, self.ttl_ms * 3)
+        await self.redis.publish(f"{self.PREFIX}ctl", "want")
+
+    async def unwant(self, key: StreamKey):
+        self._wants.discard(key)
+        await self._pubsub.unsubscribe(self._channel(key))
+        await self.redis.srem(f"{self.PREFIX}wants:{self.worker_id}", f"{key[0]}|{key[1]}")
+        await self.redis.publish(f"{self.PREFIX}ctl", "unwant")
+
+    def has_remote(self, key: StreamKey) -> bool:
+        return key in self._remote
+
+    async def publish(self, key: StreamKey, payload: Any):
+        await self.redis.publish(self._channel(key),
+                                 dumps({"symbol": key[0], "interval": key[1], "payload": payload}))
+
+    async def notify(self, text: str, key: str):
+        # SET NX compartido: solo el primer worker que llega envía
+        if await self.redis.set(f"{self.PREFIX}notified:{key}", "1", nx=True, ex=86400):
+            await notify_telegram(text, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "remote_streams": len(self._remote), "wants": len(self._wants)}
+
+
+def create_backplane() -> Backplane:
+    kind = settings.BACKPLANE
+    if kind == "socket":
+        return SocketBackplane(settings.BACKPLANE_SOCKET)
+    if kind == "redis":
+        return RedisBackplane(settings.BACKPLANE_REDIS_URL)
+    if kind != "local":
+        raise ValueError(f"unknown BACKPLANE: {kind}")
+    return Backplane()
+
+
+backplane = create_backplane()
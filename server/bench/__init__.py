@@ -0,0 +1,9 @@
+"""
+Benchmarks reproducibles del proxy (sin red: MEXC simulado en local).
+
+Desde server/:
+
+    python -m bench.fake_mexc --port 8765 --rate 10       # MEXC simulado (WS + REST)
+    python -m bench.harness --streams 50 --clients 500    # latencia extremo a extremo
+    python -m bench.alerts_bench --save base.json / --baseline base.json
+"""
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark de AlertsEngine.on_closed_candle (coste por vela cerrada).
+
+Velas sintéticas deterministas (--seed) alimentadas una a una a un motor nuevo; se
+descartan las primeras --warmup (buffers aún vacíos) y se mide cada llamada con
+perf_counter_ns. Se repite --repeat veces y se queda la mejor mediana (menos ruido).
+
+Para seguir regresiones:
+
+    python -m bench.alerts_bench --save alerts_baseline.json        # en la rama base
+    python -m bench.alerts_bench --baseline alerts_baseline.json    # exit 1 si la mediana empeora > --tolerance
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from alerts_engine import AlertsEngine, Candle, EngineConfig
+
+
+def synthetic_candles(n: int, seed: int, step: int = 60) -> List[Candle]:
+    """Paseo aleatorio con volatilidad cambiante (tramos en rango y en tendencia)."""
+    rng = np.random.default_rng(seed)
+    vol = 0.002 * (1 + 0.8 * np.sin(np.arange(n) / 300.0))
+    ret = rng.normal(0, 1, n) * vol + 0.0003 * np.sin(np.arange(n) / 150.0)
+    close = 100 * np.exp(np.cumsum(ret))
+    open_ = np.concatenate(([100.0], close[:-1]))
+    wick = np.abs(rng.normal(0, 1, n)) * vol * close
+    high = np.maximum(open_, close) + wick
+    low = np.minimum(open_, close) - wick
+    volume = rng.uniform(100, 10000, n)
+    t0 = 1_700_000_000 // step * step
+    return [Candle(t0 + i * step, float(open_[i]), float(high[i]), float(low[i]), float(close[i]), float(volume[i]))
+            for i in range(n)]
+
+
+def run_once(candles: List[Candle], warmup: int) -> Dict[str, Any]:
+    engine = AlertsEngine(EngineConfig("BENCH_USDT", "Min1"))
+    for c in candles[:warmup]:
+        engine.on_closed_candle(c)
+    times = np.empty(len(candles) - warmup, dtype=np.int64)
+    events = 0
+    clock = time.perf_counter_ns
+    for i, c in enumerate(candles[warmup:]):
+        t0 = clock()
+        events += len(engine.on_closed_candle(c))
+        times[i] = clock() - t0
+    us = times / 1000.0
+    return {"median_us": float(np.median(us)), "p99_us": float(np.percentile(us, 99)),
+            "mean_us": float(us.mean()), "candles_per_sec": float(len(us) / (times.sum() / 1e9)),
+            "events": events}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--bars", type=int, default=20000, help="velas medidas")
+    ap.add_argument("--warmup", type=int, default=1000, help="velas previas sin medir")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--save", help="guardar el resultado como baseline")
+    ap.add_argument("--baseline", help="comparar con un baseline guardado")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="empeoramiento máximo de la mediana (0.15 = 15 %%)")
+    args = ap.parse_args()
+
+    candles = synthetic_candles(args.bars + args.warmup, args.seed)
+    runs = [run_once(candles, args.warmup) for _ in range(args.repeat)]
+    best = min(runs, key=lambda r: r["median_us"])
+    result = {
+        "bars": args.bars, "warmup": args.warmup, "repeat": args.repeat, "seed": args.seed,
+        **{k: round(v, 3) if isinstance(v, float) else v for k, v in best.items()},
+        "python": platform.python_version(), "machine": platform.machine(),
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)
+        if base.get("events") != result["events"]:
+            print(f"WARNING: events differ from baseline ({base.get('events')} -> {result['events']}): "
+                  f"engine behaviour changed", file=sys.stderr)
+        ratio = result["median_us"] / base["median_us"] - 1
+        print(f"median {base['median_us']:.3f} -> {result['median_us']:.3f} us ({ratio:+.1%})")
+        if ratio > args.tolerance:
+            print(f"REGRESSION: median slower than baseline by {ratio:.1%} (> {args.tolerance:.0%})", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
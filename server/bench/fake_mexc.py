@@ -0,0 +1,459 @@
+"""
+MEXC Futures simulado para pruebas y benchmarks (un solo puerto para WS y REST).
+
+WS (mismo protocolo que wss://contract.mexc.com/edge):
+    {"method": "sub.kline", "param": {"symbol", "interval"}}   -> rs.sub.kline + push.kline a `--rate` Hz
+    {"method": "unsub.kline", ...}                             -> rs.unsub.kline
+    {"method": "sub.depth", "param": {"symbol"}}               -> rs.sub.depth + push.depth (deltas con
+                                                                  version consecutiva) a `--rate` Hz
+    {"method": "sub.deal", "param": {"symbol"}}                -> rs.sub.deal + push.deal a `--rate` Hz
+    {"method": "unsub.depth" | "unsub.deal", ...}              -> rs.unsub.<canal>
+    {"method": "ping"}                                         -> {"channel": "pong"}
+
+REST (base http://host:port/api/v1):
+    GET /contract/detail                  contratos BTC/ETH/DOGE + BENCH{i}_USDT (--contracts)
+    GET /contract/kline/{symbol}?interval=&start=&end=
+                                          velas deterministas (mismo símbolo y t = misma vela)
+    GET /contract/depth/{symbol}?limit=   snapshot del libro con su `version`
+
+Las velas en vivo son un paseo aleatorio con semilla (--seed). Con --stamp el
+volumen (`q`) lleva el instante de emisión en ms para medir la latencia extremo a
+extremo en el cliente; todos los push llevan además `ts` (ms) como MEXC.
+
+Hay un libro sintético por símbolo, compartido por todas las conexiones y por la
+REST: el snapshot y los deltas de push.depth encajan por `version` como en MEXC.
+
+Con --replay FICHERO se reproducen ticks grabados (JSON por línea: el push completo
+o solo su `data`) en lugar de los sintéticos. Si el fichero trae `ts` se respeta el
+ritmo original (escalado por --speed); si no, se emite a --rate. Para grabar:
+
+    python -m bench.fake_mexc --record ticks.jsonl --symbols BTC_USDT,ETH_USDT --seconds 600
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+
+from mexc_rest import INTERVAL_SEC
+
+log = logging.getLogger("fake_mexc")
+
+StreamKey = Tuple[str, str]
+
+KLINE_MAX_BARS = 2000   # como MEXC: tope de velas por petición
+
+
+def _price(symbol: str, t: int) -> float:
+    """Precio determinista por (símbolo, tiempo): onda lenta + ruido con semilla."""
+    base = 10 + (sum(map(ord, symbol)) % 90) * 10
+    noise = random.Random(f"{symbol}:{t}").uniform(-0.003, 0.003)
+    return base * (1 + 0.05 * math.sin(t / 86400.0) + 0.01 * math.sin(t / 3600.0) + noise)
+
+
+def history(symbol: str, interval: str, start: int, end: int, now: Optional[int] = None) -> Dict[str, List[float]]:
+    """Velas de [start, end] (como mucho hasta la actual) en el formato de /contract/kline."""
+    step = INTERVAL_SEC.get(interval, 60)
+    now = int(time.time()) if now is None else now
+    end = min(end, now // step * step)
+    t = -(-start // step) * step
+    cols: Dict[str, List[float]] = {k: [] for k in ("time", "open", "high", "low", "close", "vol")}
+    while t <= end and len(cols["time"]) < KLINE_MAX_BARS:
+        o, c = _price(symbol, t), _price(symbol, t + step)
+        rng = random.Random(f"{symbol}:{interval}:{t}")
+        cols["time"].append(t)
+        cols["open"].append(round(o, 6))
+        cols["close"].append(round(c, 6))
+        cols["high"].append(round(max(o, c) * (1 + rng.uniform(0, 0.002)), 6))
+        cols["low"].append(round(min(o, c) * (1 - rng.uniform(0, 0.002)), 6))
+        cols["vol"].append(round(rng.uniform(100, 10000), 2))
+        t += step
+    return cols
+
+
+def contracts(n: int) -> List[Dict[str, Any]]:
+    names = ["BTC_USDT", "ETH_USDT", "DOGE_USDT"] + [f"BENCH{i}_USDT" for i in range(n)]
+    return [{"symbol": s, "displayNameEn": s.replace("_", "/"), "baseCoin": s.split("_")[0],
+             "quoteCoin": "USDT", "settleCoin": "USDT", "apiAllowed": True,
+             "priceScale": 4, "amountScale": 0} for s in names]
+
+
+class SyntheticTicks:
+    """Paseo aleatorio por stream; la vela cambia al cruzar el límite del intervalo."""
+    def __init__(self, symbol: str, interval: str, seed: int):
+        self.symbol = symbol
+        self.interval = interval
+        self.step = INTERVAL_SEC.get(interval, 60)
+        self.rng = random.Random(f"{seed}:{symbol}:{interval}")
+        self.bar: Optional[Dict[str, Any]] = None
+
+    def next(self) -> Dict[str, Any]:
+        now = time.time()
+        t = int(now) // self.step * self.step
+        if self.bar is None or self.bar["t"] != t:
+            o = self.bar["c"] if self.bar else round(_price(self.symbol, t), 6)
+            self.bar = {"symbol": self.symbol, "interval": self.interval, "t": t,
+                        "o": o, "h": o, "l": o, "c": o, "q": 0.0}
+        b = self.bar
+        b["c"] = round(b["c"] * (1 + self.rng.gauss(0, 0.0005)), 6)
+        b["h"] = max(b["h"], b["c"])
+        b["l"] = min(b["l"], b["c"])
+        b["q"] = round(b["q"] + self.rng.uniform(1, 100), 2)
+        return dict(b)
+
+    def ticks(self) -> Iterator[Tuple[Optional[int], Dict[str, Any]]]:
+        while True:
+            yield None, self.next()
+
+
+class SyntheticBook:
+    """Libro de un símbolo: niveles fijos alrededor del precio inicial cuyas cantidades cambian en cada delta."""
+    def __init__(self, symbol: str, seed: int, levels: int = 200):
+        self.symbol = symbol
+        self.rng = random.Random(f"{seed}:{symbol}:depth")
+        mid = _price(symbol, int(time.time()))
+        self.tick = 10 ** math.floor(math.log10(mid * 1e-4))
+        anchor = round(mid / self.tick) * self.tick
+        self.levels = levels
+        self.bids = {round(anchor - (i + 1) * self.tick, 8): self._size() for i in range(levels)}
+        self.asks = {round(anchor + (i + 1) * self.tick, 8): self._size() for i in range(levels)}
+        self._bid_prices = sorted(self.bids)
+        self._ask_prices = sorted(self.asks)
+        self.version = 1
+
+    def _size(self) -> float:
+        return round(self.rng.uniform(1, 5000))
+
+    def snapshot(self, limit: int) -> Dict[str, Any]:
+        bids = sorted(((p, q) for p, q in self.bids.items() if q > 0), reverse=True)[:limit]
+        asks = sorted((p, q) for p, q in self.asks.items() if q > 0)[:limit]
+        return {"asks": [[p, q, 1] for p, q in asks], "bids": [[p, q, 1] for p, q in bids],
+                "version": self.version, "timestamp": int(time.time() * 1000)}
+
+    def step(self) -> Dict[str, Any]:
+        """Siguiente delta: unos pocos niveles por lado con su cantidad absoluta (0 = eliminado)."""
+        delta: Dict[str, Any] = {"asks": [], "bids": []}
+        for side, book, prices in (("bids", self.bids, self._bid_prices), ("asks", self.asks, self._ask_prices)):
+            for _ in range(self.rng.randint(1, 4)):
+                # Más actividad cerca del precio: índice con sesgo hacia el mejor nivel
+                i = min(int(self.rng.expovariate(1 / 10)), self.levels - 1)
+                price = prices[-1 - i] if side == "bids" else prices[i]
+                size = 0 if self.rng.random() < 0.2 else self._size()
+                book[price] = size
+                delta[side].append([price, size, 1 if size else 0])
+        self.version += 1
+        delta["version"] = self.version
+        return delta
+
+
+class SyntheticDeals:
+    """Operaciones aleatorias alrededor del precio determinista del símbolo."""
+    def __init__(self, symbol: str, seed: int):
+        self.symbol = symbol
+        self.rng = random.Random(f"{seed}:{symbol}:deal")
+
+    def next(self) -> Dict[str, Any]:
+        now = time.time()
+        price = _price(self.symbol, int(now)) * (1 + self.rng.gauss(0, 0.0002))
+        return {"p": round(price, 6), "v": round(self.rng.uniform(1, 500)), "T": self.rng.choice((1, 2)),
+                "O": 3, "M": 2, "t": int(now * 1000)}
+
+
+class Replay:
+    """Ticks grabados, agrupados por stream; se reutilizan cíclicamente con otro símbolo si hace falta."""
+    def __init__(self, path: str):
+        self.streams: Dict[StreamKey, List[Tuple[Optional[int], Dict[str, Any]]]] = {}
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                m = json.loads(line)
+                if "data" in m:
+                    if m.get("channel", "push.kline") != "push.kline":
+                        continue
+                    ts, d = m.get("ts"), dict(m["data"])
+                    d.setdefault("symbol", m.get("symbol"))
+                else:
+                    ts, d = None, m
+                self.streams.setdefault((d.get("symbol"), d.get("interval")), []).append((ts, d))
+        if not self.streams:
+            raise ValueError(f"{path}: no push.kline frames")
+
+    def ticks(self, key: StreamKey) -> Iterator[Tuple[Optional[int], Dict[str, Any]]]:
+        seq = self.streams.get(key) or next(iter(self.streams.values()))
+        while True:
+            for ts, d in seq:
+                yield ts, {**d, "symbol": key[0], "interval": key[1]}
+
+
+class FakeMexc:
+    def __init__(self, rate: float = 10.0, seed: int = 1, stamp: bool = False, n_contracts: int = 100,
+                 rest_latency_ms: float = 0.0, replay: Optional[Replay] = None, speed: float = 1.0):
+        self.rate = rate
+        self.seed = seed
+        self.stamp = stamp
+        self.n_contracts = n_contracts
+        self.rest_latency = rest_latency_ms / 1000.0
+        self.replay = replay
+        self.speed = speed
+        self.counters = {"connections": 0, "subscriptions": 0, "pushed": 0, "rest": 0}
+        self.books: Dict[str, SyntheticBook] = {}
+        self.depth_subs: Dict[str, Set[Any]] = {}
+        self.depth_feeds: Dict[str, asyncio.Task] = {}
+
+    def book(self, symbol: str) -> SyntheticBook:
+        if symbol not in self.books:
+            self.books[symbol] = SyntheticBook(symbol, self.seed)
+        return self.books[symbol]
+
+    def _period(self) -> float:
+        return 1.0 / self.rate if self.rate > 0 else 1.0
+
+    # ---------- REST ----------
+    async def process_request(self, path: str, headers):
+        """Peticiones HTTP normales (sin Upgrade) se responden como la API REST."""
+        if headers.get("Upgrade", "").lower() == "websocket":
+            return None
+        self.counters["rest"] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+        url = urlsplit(path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        route = url.path.removeprefix("/api/v1")
+        if route == "/contract/detail":
+            return self._json(contracts(self.n_contracts))
+        if route.startswith("/contract/kline/"):
+            try:
+                start, end = int(q.get("start", 0)), int(q.get("end", time.time()))
+            except ValueError:
+                return self._json(None, code=400)
+            return self._json(history(route.rsplit("/", 1)[-1], q.get("interval", "Min1"), start, end))
+        if route.startswith("/contract/depth/"):
+            try:
+                limit = int(q.get("limit", 500))
+            except ValueError:
+                return self._json(None, code=400)
+            return self._json(self.book(route.rsplit("/", 1)[-1]).snapshot(limit))
+        if route == "/stats":
+            return self._json(self.counters)
+        return 404, [("Content-Type", "application/json")], b'{"success":false,"code":404}'
+
+    @staticmethod
+    def _json(data: Any, code: int = 0):
+        body = json.dumps({"success": code == 0, "code": code, "data": data}, separators=(",", ":")).encode()
+        return (200 if code == 0 else code), [("Content-Type", "application/json")], body
+
+    # ---------- WS ----------
+    async def handler(self, ws):
+        self.counters["connections"] += 1
+        feeds: Dict[StreamKey, asyncio.Task] = {}
+        try:
+            async for raw in ws:
+                try:
+                    m = json.loads(raw)
+                except ValueError:
+                    continue
+                method = m.get("method")
+                p = m.get("param") or {}
+                key = (p.get("symbol"), p.get("interval"))
+                if method == "ping":
+                    await ws.send(json.dumps({"channel": "pong", "data": int(time.time() * 1000)}))
+                elif method == "sub.kline":
+                    if key not in feeds:
+                        self.counters["subscriptions"] += 1
+                        feeds[key] = asyncio.create_task(self._feed(ws, key))
+                    await ws.send(json.dumps({"channel": "rs.sub.kline", "data": "success"}))
+                elif method == "unsub.kline":
+                    task = feeds.pop(key, None)
+                    if task:
+                        task.cancel()
+                    await ws.send(json.dumps({"channel": "rs.unsub.kline", "data": "success"}))
+                elif method == "sub.depth":
+                    self._depth_add(ws, key[0])
+                    await ws.send(json.dumps({"channel": "rs.sub.depth", "data": "success"}))
+                elif method == "unsub.depth":
+                    self._depth_remove(ws, key[0])
+                    await ws.send(json.dumps({"channel": "rs.unsub.depth", "data": "success"}))
+                elif method == "sub.deal":
+                    if (key[0], "deal") not in feeds:
+                        self.counters["subscriptions"] += 1
+                        feeds[(key[0], "deal")] = asyncio.create_task(self._deal_feed(ws, key[0]))
+                    await ws.send(json.dumps({"channel": "rs.sub.deal", "data": "success"}))
+                elif method == "unsub.deal":
+                    task = feeds.pop((key[0], "deal"), None)
+                    if task:
+                        task.cancel()
+                    await ws.send(json.dumps({"channel": "rs.unsub.deal", "data": "success"}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in feeds.values():
+                task.cancel()
+            for symbol in [s for s, subs in self.depth_subs.items() if ws in subs]:
+                self._depth_remove(ws, symbol)
+
+    # ---------- depth / deal ----------
+    def _depth_add(self, ws, symbol: str):
+        subs = self.depth_subs.setdefault(symbol, set())
+        if ws not in subs:
+            self.counters["subscriptions"] += 1
+            subs.add(ws)
+        if symbol not in self.depth_feeds:
+            self.depth_feeds[symbol] = asyncio.create_task(self._depth_feed(symbol))
+
+    def _depth_remove(self, ws, symbol: str):
+        subs = self.depth_subs.get(symbol)
+        if subs is None:
+            return
+        subs.discard(ws)
+        if not subs:
+            del self.depth_subs[symbol]
+            task = self.depth_feeds.pop(symbol, None)
+            if task:
+                task.cancel()
+
+    async def _depth_feed(self, symbol: str):
+        """Un delta por tick para todos los suscriptores del símbolo: la version es la misma para todos."""
+        period = self._period()
+        loop = asyncio.get_running_loop()
+        nxt = loop.time() + random.Random(f"{symbol}:depth").uniform(0, period)
+        book = self.book(symbol)
+        try:
+            while True:
+                nxt += period
+                delay = nxt - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                subs = self.depth_subs.get(symbol)
+                if not subs:
+                    return
+                msg = json.dumps({"channel": "push.depth", "data": book.step(), "symbol": symbol,
+                                  "ts": int(time.time() * 1000)}, separators=(",", ":"))
+                websockets.broadcast(subs, msg)
+                self.counters["pushed"] += len(subs)
+        except asyncio.CancelledError:
+            pass
+
+    async def _deal_feed(self, ws, symbol: str):
+        period = self._period()
+        loop = asyncio.get_running_loop()
+        nxt = loop.time() + random.Random(f"{symbol}:deal").uniform(0, period)
+        deals = SyntheticDeals(symbol, self.seed)
+        try:
+            while True:
+                nxt += period
+                delay = nxt - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                d = deals.next()
+                await ws.send(json.dumps({"channel": "push.deal", "data": d, "symbol": symbol,
+                                          "ts": d["t"]}, separators=(",", ":")))
+                self.counters["pushed"] += 1
+        except (asyncio.CancelledError, websockets.ConnectionClosed):
+            pass
+
+    async def _feed(self, ws, key: StreamKey):
+        """Un push.kline cada 1/rate s (o al ritmo grabado), con reloj absoluto para no derivar."""
+        period = self._period()
+        loop = asyncio.get_running_loop()
+        # Arranque escalonado para no emitir todos los streams en el mismo instante
+        nxt = loop.time() + random.Random(f"{key}").uniform(0, period)
+        if self.replay is not None:
+            source = self.replay.ticks(key)
+        else:
+            source = SyntheticTicks(key[0], key[1], self.seed).ticks()
+        prev_ts: Optional[int] = None
+        try:
+            for ts, d in source:
+                # Al volver al principio del replay (ts retrocede) se usa el ritmo --rate
+                if ts is not None and prev_ts is not None and ts >= prev_ts and self.speed > 0:
+                    nxt += max(0.0, (ts - prev_ts) / 1000.0 / self.speed)
+                else:
+                    nxt += period
+                prev_ts = ts
+                delay = nxt - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                now = time.time()
+                if self.stamp:
+                    d["q"] = now * 1000.0
+                await ws.send(json.dumps({"channel": "push.kline", "data": d, "symbol": key[0],
+                                          "ts": int(now * 1000)}, separators=(",", ":")))
+                self.counters["pushed"] += 1
+        except (asyncio.CancelledError, websockets.ConnectionClosed):
+            pass
+
+    async def serve(self, host: str, port: int):
+        async with websockets.serve(self.handler, host, port, process_request=self.process_request,
+                                    ping_interval=None, max_queue=None):
+            log.info(f"Fake MEXC on ws://{host}:{port} (REST http://{host}:{port}/api/v1), rate={self.rate}/s")
+            await asyncio.Future()
+
+
+async def record(url: str, streams: List[StreamKey], path: str, seconds: float):
+    """Graba los push.kline reales (JSON por línea) para reproducirlos después con --replay."""
+    deadline = time.time() + seconds
+    n = 0
+    async with websockets.connect(url, ping_interval=None) as ws:
+        for s, i in streams:
+            await ws.send(json.dumps({"method": "sub.kline", "param": {"symbol": s, "interval": i}}))
+        with open(path, "a") as f:
+            last_ping = 0.0
+            while time.time() < deadline:
+                if time.time() - last_ping > 15:
+                    await ws.send(json.dumps({"method": "ping"}))
+                    last_ping = time.time()
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=max(0.1, min(15, deadline - time.time())))
+                except asyncio.TimeoutError:
+                    continue
+                m = json.loads(raw)
+                if m.get("channel") == "push.kline":
+                    m.setdefault("ts", int(time.time() * 1000))
+                    f.write(json.dumps(m, separators=(",", ":")) + "\n")
+                    n += 1
+    log.info(f"Recorded {n} frames into {path}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--rate", type=float, default=10.0, help="push por segundo y stream (kline, depth, deal)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--stamp", action="store_true", help="volumen = instante de emisión (ms) para medir latencia")
+    ap.add_argument("--contracts", type=int, default=100, help="símbolos BENCH{i}_USDT en /contract/detail")
+    ap.add_argument("--rest-latency-ms", type=float, default=0.0, help="latencia artificial de la API REST")
+    ap.add_argument("--replay", help="ticks grabados (JSON por línea)")
+    ap.add_argument("--speed", type=float, default=1.0, help="factor de velocidad del replay con ts")
+    ap.add_argument("--record", help="grabar push.kline reales en este fichero y salir")
+    ap.add_argument("--upstream", default="wss://contract.mexc.com/edge", help="WS real para --record")
+    ap.add_argument("--symbols", default="BTC_USDT", help="símbolos a grabar (coma)")
+    ap.add_argument("--interval", default="Min1", help="intervalo a grabar")
+    ap.add_argument("--seconds", type=float, default=300, help="duración de la grabación")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    # Cada petición REST aparece como "connection rejected"; solo interesan los avisos
+    logging.getLogger("websockets.server").setLevel(logging.WARNING)
+
+    if args.record:
+        keys = [(s.strip(), args.interval) for s in args.symbols.split(",") if s.strip()]
+        asyncio.run(record(args.upstream, keys, args.record, args.seconds))
+        return
+    fake = FakeMexc(args.rate, args.seed, args.stamp, args.contracts, args.rest_latency_ms,
+                    Replay(args.replay) if args.replay else None, args.speed)
+    try:
+        asyncio.run(fake.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Benchmark extremo a extremo: MEXC simulado -> proxy (main.py) -> M clientes /ws/kline.
+
+Arranca bench.fake_mexc (con --stamp: el volumen de cada push es su instante de
+emisión) y el proxy con uvicorn apuntando a él, abre `--clients` conexiones
+repartidas entre `--streams` streams (BENCH{i}_USDT) y durante `--duration`
+segundos mide:
+
+- latencia emisión -> recepción en el cliente (p50/p90/p99/p99.9/máx, ms)
+- mensajes/s totales y por cliente
+- CPU (%) y RSS del proxy; coste por cliente (CPU y memoria añadida)
+- CPU del propio harness (si se satura, usar --procs para repartir los clientes)
+
+Desde server/:
+
+    python -m bench.harness --streams 50 --clients 500 --rate 10 --duration 30
+    python -m bench.harness --server-url http://127.0.0.1:8000 --server-pid 1234 ...  # proxy ya arrancado
+    python -m bench.harness ... --json results.json                                    # para comparar ejecuciones
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import websockets
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+# ============================
+# Recursos de un proceso (/proc, Linux)
+# ============================
+def proc_usage(pid: int) -> Tuple[float, int]:
+    """(segundos de CPU user+sys, RSS en bytes) del proceso `pid`."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+        with open(f"/proc/{pid}/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+    except (OSError, IndexError, ValueError):
+        return float("nan"), 0
+
+
+def percentiles(values: np.ndarray) -> Dict[str, Optional[float]]:
+    if not len(values):
+        return {k: None for k in ("p50", "p90", "p99", "p999", "max", "mean")}
+    p = np.percentile(values, [50, 90, 99, 99.9])
+    return {"p50": round(p[0], 3), "p90": round(p[1], 3), "p99": round(p[2], 3), "p999": round(p[3], 3),
+            "max": round(float(values.max()), 3), "mean": round(float(values.mean()), 3)}
+
+
+# ============================
+# Clientes
+# ============================
+async def _client(url: str, t_start: float, t_end: float, lat: List[float], counts: List[int], idx: int,
+                  errors: List[str]):
+    try:
+        async with websockets.connect(url, ping_interval=None, max_queue=None, max_size=None) as ws:
+            while True:
+                timeout = t_end - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                now = time.time()
+                if now < t_start:
+                    continue
+                msg = json.loads(raw)
+                if msg.get("type") != "kline":
+                    continue
+                counts[idx] += 1
+                # volumen = instante de emisión en el MEXC simulado (ms)
+                lat.append(now * 1000.0 - msg["payload"]["volume"])
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+
+async def _run_clients(urls: List[str], t_start: float, t_end: float, ramp: float) -> Dict[str, Any]:
+    lat: List[float] = []
+    counts = [0] * len(urls)
+    errors: List[str] = []
+    tasks = []
+    for i, url in enumerate(urls):
+        tasks.append(asyncio.create_task(_client(url, t_start, t_end, lat, counts, i, errors)))
+        if ramp:
+            await asyncio.sleep(ramp / len(urls))
+    await asyncio.gather(*tasks)
+    cpu, _ = proc_usage(os.getpid())
+    return {"lat": np.asarray(lat, dtype=np.float64), "counts": counts, "errors": errors, "cpu": cpu}
+
+
+def _worker(urls: List[str], t_start: float, t_end: float, ramp: float, out: "mp.Queue"):
+    out.put(asyncio.run(_run_clients(urls, t_start, t_end, ramp)))
+
+
+def drive_clients(urls: List[str], t_start: float, t_end: float, ramp: float, procs: int) -> Dict[str, Any]:
+    """Ejecuta los clientes en este proceso (procs=1) o repartidos en `procs` procesos."""
+    if procs <= 1:
+        return asyncio.run(_run_clients(urls, t_start, t_end, ramp))
+    out: "mp.Queue" = mp.Queue()
+    workers = [mp.Process(target=_worker, args=(urls[i::procs], t_start, t_end, ramp, out)) for i in range(procs)]
+    for w in workers:
+        w.start()
+    parts = [out.get() for _ in workers]
+    for w in workers:
+        w.join()
+    return {"lat": np.concatenate([p["lat"] for p in parts]),
+            "counts": [c for p in parts for c in p["counts"]],
+            "errors": [e for p in parts for e in p["errors"]],
+            "cpu": sum(p["cpu"] for p in parts)}
+
+
+# ============================
+# Procesos auxiliares
+# ============================
+def _wait_http(url: str, timeout: float = 20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status < 500:
+                    return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_fake(port: int, rate: float, replay: Optional[str]) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "bench.fake_mexc", "--port", str(port), "--rate", str(rate), "--stamp"]
+    if replay:
+        cmd += ["--replay", replay]
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, stdout=subprocess.DEVNULL)
+    _wait_http(f"http://127.0.0.1:{port}/api/v1/stats")
+    return proc
+
+
+def start_server(port: int, fake_port: int, streams: int, workdir: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MEXC_WS_URL": f"ws://127.0.0.1:{fake_port}",
+        "MEXC_REST_BASE": f"http://127.0.0.1:{fake_port}/api/v1",
+        "CANDLE_DB_PATH": os.path.join(workdir, "candles.sqlite3"),
+        "BACKPLANE": "local",
+        "STREAM_MAX_LIVE": str(max(streams, 500)),
+        **extra_env,
+    }
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, env=env)
+    _wait_http(f"http://127.0.0.1:{port}/health")
+    return proc
+
+
+# ============================
+# Ejecución
+# ============================
+def run(args) -> Dict[str, Any]:
+    procs: List[subprocess.Popen] = []
+    workdir = tempfile.mkdtemp(prefix="mexc-bench-")
+    try:
+        if args.server_url:
+            base, pid = args.server_url.rstrip("/"), args.server_pid
+        else:
+            procs.append(start_fake(args.fake_port, args.rate, args.replay))
+            env = dict(kv.split("=", 1) for kv in args.env)
+            server = start_server(args.port, args.fake_port, args.streams, workdir, env)
+            procs.append(server)
+            base, pid = f"http://127.0.0.1:{args.port}", server.pid
+
+        ws_base = base.replace("http", "ws", 1)
+        query = f"&policy={args.policy}" if args.policy else ""
+        urls = [f"{ws_base}/ws/kline?symbol=BENCH{i % args.streams}_USDT&interval={args.interval}{query}"
+                for i in range(args.clients)]
+
+        cpu0, rss0 = proc_usage(pid) if pid else (float("nan"), 0)
+        t_start = time.time() + args.ramp + args.warmup
+        t_end = t_start + args.duration
+        # CPU/RSS del proxy justo al empezar la ventana de medida (tras rampa y calentamiento)
+        sampler: Dict[str, Tuple[float, int]] = {}
+        timer = threading.Timer(max(0.0, t_start - time.time()),
+                                lambda: sampler.setdefault("start", proc_usage(pid) if pid else (float("nan"), 0)))
+        timer.start()
+        try:
+            res = drive_clients(urls, t_start, t_end, args.ramp, args.procs)
+        finally:
+            timer.cancel()
+        cpu1, rss1 = proc_usage(pid) if pid else (float("nan"), 0)
+        cpu_s, _ = sampler.get("start", (cpu0, rss0))
+
+        lat = res["lat"]
+        total = int(sum(res["counts"]))
+        server_cpu = (cpu1 - cpu_s) / args.duration * 100 if pid else None
+        return {
+            "config": {"streams": args.streams, "clients": args.clients, "rate": args.rate,
+                       "interval": args.interval, "duration": args.duration, "policy": args.policy,
+                       "procs": args.procs},
+            "latency_ms": percentiles(lat),
+            "messages": total,
+            "msgs_per_sec": round(total / args.duration, 1),
+            "msgs_per_sec_per_client": round(total / args.duration / max(1, args.clients), 2),
+            "expected_per_sec": args.clients * args.rate,
+            "clients_without_data": sum(1 for c in res["counts"] if c == 0),
+            "errors": len(res["errors"]),
+            "error_samples": res["errors"][:5],
+            "server": {
+                "pid": pid,
+                "cpu_pct": round(server_cpu, 1) if server_cpu is not None else None,
+                "cpu_ms_per_client_sec": round(server_cpu * 10 / max(1, args.clients), 4) if server_cpu is not None else None,
+                "rss_mb": round(rss1 / 2**20, 1) if pid else None,
+                "rss_kb_per_client": round((rss1 - rss0) / 1024 / max(1, args.clients), 1) if pid else None,
+            },
+            "harness_cpu_pct": round(res["cpu"] / (args.duration + args.ramp + args.warmup) * 100, 1),
+        }
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--streams", type=int, default=10, help="streams upstream distintos (N)")
+    ap.add_argument("--clients", type=int, default=100, help="clientes /ws/kline (M), repartidos entre los streams")
+    ap.add_argument("--rate", type=float, default=10.0, help="push.kline por segundo y stream en el MEXC simulado")
+    ap.add_argument("--interval", default="Min1")
+    ap.add_argument("--duration", type=float, default=20.0, help="segundos de medida")
+    ap.add_argument("--warmup", type=float, default=3.0, help="segundos sin medir tras conectar todos")
+    ap.add_argument("--ramp", type=float, default=2.0, help="segundos para abrir todas las conexiones")
+    ap.add_argument("--policy", help="política ante cliente lento (conflate | drop_oldest | disconnect)")
+    ap.add_argument("--procs", type=int, default=1, help="procesos para los clientes")
+    ap.add_argument("--port", type=int, default=8800)
+    ap.add_argument("--fake-port", type=int, default=8765)
+    ap.add_argument("--replay", help="ticks grabados para el MEXC simulado")
+    ap.add_argument("--env", action="append", default=[], help="variable extra para el proxy (CLAVE=valor)")
+    ap.add_argument("--server-url", help="proxy ya arrancado (no se lanza ni fake ni uvicorn)")
+    ap.add_argument("--server-pid", type=int, help="pid del proxy externo para medir CPU/RSS")
+    ap.add_argument("--json", help="guardar el resultado en este fichero")
+    args = ap.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
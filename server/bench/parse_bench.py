@@ -0,0 +1,159 @@
+"""
+Benchmark del camino de entrada upstream: mensajes/s en un núcleo.
+
+Frames con la forma real de MEXC (push.kline con todos sus campos + un % de pong)
+repartidos entre --streams streams:
+
+- decode:   solo decodificación + normalización de la vela
+            legacy = json.loads del frame entero + dict reconstruido (código anterior)
+            y después sniff de canal + cada decoder instalado (json / orjson / msgspec)
+- pipeline: UpstreamConnection.handle completo (decode, store.on_live, fan-out a
+            --clients suscriptores por stream) frente al mismo recorrido con el
+            parseo legacy
+
+Desde server/:
+
+    python -m bench.parse_bench --frames 200000 --pong-ratio 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def make_frames(n: int, streams: int, pong_ratio: float, seed: int = 3) -> List[str]:
+    rng = random.Random(seed)
+    out = []
+    t = 1_700_000_000 // 60 * 60
+    price = [100.0 + i for i in range(streams)]
+    for k in range(n):
+        if rng.random() < pong_ratio:
+            out.append(json.dumps({"channel": "pong", "data": 1700000000000 + k}))
+            continue
+        i = rng.randrange(streams)
+        price[i] *= 1 + rng.gauss(0, 0.0005)
+        c = round(price[i], 4)
+        data = {"a": round(rng.uniform(1e5, 1e6), 4), "c": c, "h": c * 1.001, "interval": "Min1",
+                "l": c * 0.999, "o": c, "q": round(rng.uniform(1, 1e4), 1), "rc": c, "rh": c * 1.001,
+                "rl": c * 0.999, "ro": c, "symbol": f"BENCH{i}_USDT", "t": t + (k // (streams * 600)) * 60}
+        out.append(json.dumps({"channel": "push.kline", "data": data, "symbol": f"BENCH{i}_USDT",
+                               "ts": 1700000000000 + k}, separators=(",", ":")))
+    return out
+
+
+def legacy_kline(raw: str):
+    """Parseo anterior: json.loads de todo + dict nuevo con float() por campo."""
+    data = json.loads(raw)
+    channel = data.get("channel")
+    if channel == "pong":
+        return None
+    if channel == "push.kline":
+        d = data.get("data", {})
+        key = (d.get("symbol") or data.get("symbol"), d.get("interval"))
+        candle = {
+            "symbol": d.get("symbol", key[0]),
+            "interval": d.get("interval", key[1]),
+            "time": int(d["t"]),
+            "open": float(d["o"]),
+            "high": float(d["h"]),
+            "low": float(d["l"]),
+            "close": float(d["c"]),
+            "volume": float(d.get("q", 0.0)),
+        }
+        return key, candle, data.get("ts")
+    return None
+
+
+def _rate(fn: Callable[[str], object], frames: List[str], repeat: int) -> float:
+    best = 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for raw in frames:
+            fn(raw)
+        best = max(best, len(frames) / (time.perf_counter() - t0))
+    return best
+
+
+def bench_decode(frames: List[str], repeat: int) -> Dict[str, float]:
+    import upstream_codec as uc
+
+    out = {"legacy": _rate(legacy_kline, frames, repeat)}
+    for name, cls in uc.DECODERS.items():
+        if (name == "orjson" and uc.orjson is None) or (name == "msgspec" and uc.msgspec is None):
+            continue
+        dec = cls()
+
+        def fn(raw: str, dec=dec):
+            ch = uc.sniff_channel(raw)
+            if ch is not None and ch != uc.KLINE_CHANNEL:
+                return None
+            return dec.kline(raw)
+        out[name] = _rate(fn, frames, repeat)
+    return out
+
+
+async def _bench_pipeline(frames: List[str], streams: int, clients: int, repeat: int) -> Dict[str, float]:
+    import mexc_stream as ms
+    import upstream_codec as uc
+    from fanout import Subscriber
+
+    pool = ms.UpstreamPool(10 ** 6)
+    conn = ms.UpstreamConnection(pool, 10 ** 6, 0)
+    for i in range(streams):
+        st = ms.KlineStreamer(f"BENCH{i}_USDT", "Min1", pool)
+        pool.routes[st.key()] = st
+        for _ in range(clients):
+            st.attach(Subscriber())
+
+    async def legacy(raw: str):
+        t0 = time.perf_counter()
+        r = legacy_kline(raw)
+        if r is not None:
+            streamer = pool.routes.get(r[0])
+            if streamer is not None:
+                await streamer.on_kline(r[1], t0)
+
+    async def rate(fn) -> float:
+        best = 0.0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for raw in frames:
+                await fn(raw)
+            best = max(best, len(frames) / (time.perf_counter() - t0))
+        return best
+
+    return {"legacy": await rate(legacy), f"handle ({uc.decoder.name})": await rate(conn.handle)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--frames", type=int, default=200000)
+    ap.add_argument("--streams", type=int, default=100)
+    ap.add_argument("--pong-ratio", type=float, default=0.1, help="fracción de frames que no son push.kline")
+    ap.add_argument("--clients", type=int, default=2, help="suscriptores por stream en el pipeline")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--skip-pipeline", action="store_true")
+    args = ap.parse_args()
+
+    # El pipeline escribe velas cerradas en el store: SQLite temporal
+    os.environ.setdefault("CANDLE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="mexc-bench-"), "c.sqlite3"))
+    frames = make_frames(args.frames, args.streams, args.pong_ratio)
+
+    def report(title: str, rates: Dict[str, float]):
+        base: Optional[float] = rates.get("legacy")
+        print(title)
+        for name, r in rates.items():
+            print(f"  {name:<22} {r:>12,.0f} msg/s  x{r / base:.2f}" if base else f"  {name:<22} {r:>12,.0f} msg/s")
+
+    report("decode (1 core):", bench_decode(frames, args.repeat))
+    if not args.skip_pipeline:
+        rates = asyncio.run(_bench_pipeline(frames, args.streams, args.clients, args.repeat))
+        report(f"pipeline, {args.clients} clients/stream (1 core):", rates)
+
+
+if __name__ == "__main__":
+    main()
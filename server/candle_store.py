@@ -0,0 +1,521 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from settings import settings
+import metrics
+from mexc_rest import fetch_klines, interval_sec
+
+log = logging.getLogger("store")
+
+StreamKey = Tuple[str, str]
+
+_COLS = ("time", "open", "high", "low", "close", "volume")
+
+Columns = Dict[str, np.ndarray]
+
+T = TypeVar("T")
+
+
+def to_columns(candles: List[Dict[str, Any]]) -> Columns:
+    """Lista de velas -> columnas (time int64, resto float64)."""
+    n = len(candles)
+    return {k: np.fromiter((c[k] for c in candles), np.int64 if k == "time" else np.float64, n) for k in _COLS}
+
+
+class CandleStore:
+    """
+    Almacén persistente de velas por (symbol, interval) sobre SQLite.
+
+    - Solo se persisten velas CERRADAS (la vela en formación cambia con cada tick).
+    - La vela en formación que llega por WS se mantiene en memoria (`live`), así
+      una petición "caliente" se sirve sin salir del proceso.
+    - SQLite nunca se usa desde el event loop: las lecturas van por `read()`
+      (asyncio.to_thread) y las escrituras se encolan y un único writer las
+      graba por lotes en un hilo. La conexión es única, así que todo acceso pasa
+      por `lock`. La última vela guardada por stream se lleva en memoria
+      (`last_stored`), así un cierre en vivo no consulta la base.
+    """
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Compartida entre los hilos de read() y el writer: siempre bajo self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS candles (
+                symbol   TEXT    NOT NULL,
+                interval TEXT    NOT NULL,
+                time     INTEGER NOT NULL,
+                open     REAL    NOT NULL,
+                high     REAL    NOT NULL,
+                low      REAL    NOT NULL,
+                close    REAL    NOT NULL,
+                volume   REAL    NOT NULL,
+                PRIMARY KEY (symbol, interval, time)
+            ) WITHOUT ROWID
+            """
+        )
+        self.db.commit()
+        self.live: Dict[StreamKey, Dict[str, Any]] = {}
+        # Primer timestamp disponible en MEXC (evita pedir una y otra vez lo que no existe)
+        self.origin: Dict[StreamKey, int] = {}
+        # Huecos ya pedidos a MEXC sin resultado (sin operaciones): no se vuelven a pedir
+        self.checked: Dict[StreamKey, List[Tuple[int, int]]] = {}
+        # Última vela guardada (o encolada) por stream; None = ninguna
+        self.last_stored: Dict[StreamKey, Optional[int]] = {}
+        self._pending: List[tuple] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    # ---------- lectura ----------
+    async def read(self, fn: Callable[..., T], *args) -> T:
+        """Ejecuta una lectura síncrona del store en un hilo, tras grabar lo encolado."""
+        await self.flush()
+        return await asyncio.to_thread(fn, *args)
+
+    def bounds(self, symbol: str, interval: str) -> Tuple[Optional[int], Optional[int]]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT MIN(time), MAX(time) FROM candles WHERE symbol=? AND interval=?",
+                (symbol, interval),
+            ).fetchone()
+        return row[0], row[1]
+
+    async def last_time(self, symbol: str, interval: str) -> Optional[int]:
+        """Última vela guardada del stream; la base solo se consulta la primera vez."""
+        key = (symbol, interval)
+        if key not in self.last_stored:
+            _, last = await self.read(self.bounds, symbol, interval)
+            self._note_stored(key, last)
+        return self.last_stored[key]
+
+    def _note_stored(self, key: StreamKey, t: Optional[int]):
+        # Solo desde el event loop: nunca retrocede
+        cur = self.last_stored.get(key)
+        if cur is None or (t is not None and t > cur):
+            self.last_stored[key] = t
+
+    def holes(self, symbol: str, interval: str, start: int, end: int, step: int) -> List[Tuple[int, int]]:
+        """
+        Tramos [a, b] de [start, end] (start alineado a `step`) sin velas guardadas.
+        Lo normal es que no haya ninguno: primero se compara el COUNT con lo esperado.
+        """
+        with self.lock:
+            n = self.db.execute(
+                "SELECT COUNT(*) FROM candles WHERE symbol=? AND interval=? AND time BETWEEN ? AND ?",
+                (symbol, interval, start, end),
+            ).fetchone()[0]
+            if n >= (end - start) // step + 1:
+                return []
+            rows = self.db.execute(
+                "SELECT time FROM candles WHERE symbol=? AND interval=? AND time BETWEEN ? AND ? ORDER BY time",
+                (symbol, interval, start, end),
+            ).fetchall()
+        edges = np.array([start - step] + [r[0] for r in rows] + [end + step], dtype=np.int64)
+        gaps = np.flatnonzero(np.diff(edges) > step)
+        holes = [(int(edges[i] + step), int(edges[i + 1] - step)) for i in gaps]
+        checked = tuple(self.checked.get((symbol, interval), ()))
+        return [(a, b) for a, b in holes if not any(ca <= a and b <= cb for ca, cb in checked)]
+
+    def mark_checked(self, symbol: str, interval: str, start: int, end: int):
+        checked = self.checked.setdefault((symbol, interval), [])
+        checked.append((start, end))
+        del checked[:-1000]
+
+    def range(self, symbol: str, interval: str, start: int, end: int) -> List[Dict[str, Any]]:
+        with metrics.klines_fetch.time("cache"):
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT time, open, high, low, close, volume FROM candles "
+                    "WHERE symbol=? AND interval=? AND time BETWEEN ? AND ? ORDER BY time",
+                    (symbol, interval, start, end),
+                ).fetchall()
+            return [dict(zip(_COLS, r)) for r in rows]
+
+    def range_columns(self, symbol: str, interval: str, start: int, end: int) -> Columns:
+        """Como range() pero en columnas NumPy, sin crear un dict por vela."""
+        with metrics.klines_fetch.time("cache"):
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT time, open, high, low, close, volume FROM candles "
+                    "WHERE symbol=? AND interval=? AND time BETWEEN ? AND ? ORDER BY time",
+                    (symbol, interval, start, end),
+                ).fetchall()
+            arr = np.array(rows, dtype=np.float64).reshape(-1, len(_COLS))
+            cols = {k: arr[:, i] for i, k in enumerate(_COLS)}
+            cols["time"] = np.array([r[0] for r in rows], dtype=np.int64)
+            return cols
+
+    # ---------- escritura ----------
+    def _write(self, rows: List[tuple]):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO candles (symbol, interval, time, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.commit()
+
+    def _queue(self, symbol: str, interval: str, candles: List[Dict[str, Any]]):
+        """Encola velas cerradas; el writer las graba (un lote por vuelta) fuera del event loop."""
+        if not candles:
+            return
+        self._note_stored((symbol, interval), max(c["time"] for c in candles))
+        self._pending.extend((symbol, interval, c["time"], c["open"], c["high"], c["low"], c["close"], c["volume"])
+                             for c in candles)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            rows, self._pending = self._pending, []
+            self._write(rows)
+            return
+        if self._writer is None:
+            self._writer = loop.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        try:
+            while self._pending:
+                # Lo que se encola mientras se graba un lote sale en el siguiente
+                rows, self._pending = self._pending, []
+                try:
+                    await asyncio.to_thread(self._write, rows)
+                except sqlite3.Error as e:
+                    log.warning(f"Candle store write failed ({len(rows)} rows): {e}")
+        finally:
+            self._writer = None
+
+    async def flush(self):
+        """Espera a que esté grabado todo lo encolado."""
+        while self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    async def upsert(self, symbol: str, interval: str, candles: List[Dict[str, Any]]):
+        self._queue(symbol, interval, candles)
+        await self.flush()
+
+    def on_live(self, symbol: str, interval: str, candle: Dict[str, Any],
+                persist: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Registra la vela en formación recibida por WS. Si abre una vela nueva,
+        la anterior queda cerrada: se persiste (salvo `persist=False`, velas
+        derivadas de Min1) y se devuelve.
+
+        Solo se persiste si continúa lo guardado (última + step o anterior): una
+        vela suelta tras un hueco dejaría en el store un tramo incompleto.
+        """
+        key = (symbol, interval)
+        prev = self.live.get(key)
+        self.live[key] = {k: candle[k] for k in _COLS}
+        if prev is not None and candle["time"] > prev["time"]:
+            if persist:
+                if key not in self.last_stored:
+                    # Solo la primera vez por stream (KlineStreamer.start ya la carga con last_time)
+                    self._note_stored(key, self.bounds(symbol, interval)[1])
+                last = self.last_stored[key]
+                if last is None or prev["time"] <= last + interval_sec(interval):
+                    self._queue(symbol, interval, [prev])
+            return prev
+        return None
+
+
+store = CandleStore(settings.CANDLE_DB_PATH)
+
+
+# ============================
+# Intervalos derivados de Min1
+# ============================
+BASE_INTERVAL = "Min1"
+# Solo intervalos múltiplos exactos de Min1 alineados con epoch (Day1 y superiores
+# no: su corte en MEXC no coincide necesariamente con 00:00 UTC)
+RESAMPLED = frozenset(i.strip() for i in settings.RESAMPLE_INTERVALS.split(",") if i.strip())
+
+
+def is_resampled(interval: str) -> bool:
+    return interval in RESAMPLED and interval != BASE_INTERVAL
+
+
+def resample_columns(cols: Columns, step: int) -> Columns:
+    """
+    Agrega columnas Min1 (ordenadas) en velas de `step` segundos (vectorizado).
+    `count` = velas Min1 de cada bucket (completo si es step // 60).
+    """
+    t = cols["time"]
+    if not len(t):
+        return {**{k: v[:0] for k, v in cols.items()}, "count": t[:0]}
+    bucket = (t // step) * step
+    idx = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    last = np.concatenate((idx[1:] - 1, [len(t) - 1]))
+    return {
+        "time": bucket[idx],
+        "open": cols["open"][idx],
+        "high": np.maximum.reduceat(cols["high"], idx),
+        "low": np.minimum.reduceat(cols["low"], idx),
+        "close": cols["close"][last],
+        "volume": np.add.reduceat(cols["volume"], idx),
+        "count": np.diff(np.append(idx, len(t))),
+    }
+
+
+async def complete_buckets(symbol: str, interval: str, cols: Columns) -> Columns:
+    """
+    Los buckets ya cerrados a los que les falta algún Min1 darían OHLCV y volumen
+    erróneos: se sustituyen por la vela nativa del intervalo (store o MEXC, que se
+    guarda). Sin Min1 completos ni vela nativa, el bucket no se sirve.
+    """
+    step = interval_sec(interval)
+    now = int(time.time())
+    t = cols["time"]
+    bad = np.flatnonzero((cols["count"] < step // 60) & (t + step <= now))
+    if not len(bad):
+        return cols
+    first, last = int(t[bad[0]]), int(t[bad[-1]])
+    native = {c["time"]: c for c in await store.read(store.range, symbol, interval, first, last)}
+    missing = [int(t[i]) for i in bad if int(t[i]) not in native]
+    if missing:
+        for a, b in _chunks(missing[0], missing[-1], step):
+            if not any(a <= m <= b for m in missing):
+                continue
+            try:
+                rows = await fetch_klines(symbol, interval, a, b)
+            except Exception as e:
+                log.warning(f"Native fetch for incomplete buckets failed {symbol} {interval} [{a}, {b}]: {e}")
+                continue
+            closed = [c for c in rows if c["time"] + step <= now]
+            await store.upsert(symbol, interval, closed)
+            native.update((c["time"], c) for c in closed)
+    cols = {k: v.copy() for k, v in cols.items()}
+    keep = np.ones(len(t), dtype=bool)
+    for i in bad:
+        c = native.get(int(t[i]))
+        if c is None:
+            keep[i] = False
+            continue
+        for k in _COLS[1:]:
+            cols[k][i] = c[k]
+        cols["count"][i] = step // 60
+    log.debug(f"{symbol} {interval}: {len(bad)} buckets with missing Min1 rows "
+             f"({int((~keep).sum())} without native bar, dropped)")
+    return {k: v[keep] for k, v in cols.items()}
+
+
+def from_columns(cols: Columns) -> List[Dict[str, Any]]:
+    lists = [cols[k].tolist() for k in _COLS]
+    return [dict(zip(_COLS, row)) for row in zip(*lists)]
+
+
+async def _min1_split(symbol: str, interval: str) -> Optional[int]:
+    """
+    Primera vela de `interval` que puede agregarse desde Min1 guardado (la del
+    primer bucket completo). None si el intervalo no es derivado o no hay Min1.
+    """
+    if not is_resampled(interval):
+        return None
+    first, _ = await store.read(store.bounds, symbol, BASE_INTERVAL)
+    if first is None:
+        return None
+    step = interval_sec(interval)
+    return -(-first // step) * step
+
+
+# ============================
+# Lectura con relleno incremental desde MEXC
+# ============================
+def _chunks(start: int, end: int, step: int) -> List[Tuple[int, int]]:
+    """Parte [start, end] en tramos alineados de como mucho KLINES_CHUNK_BARS velas."""
+    span = settings.KLINES_CHUNK_BARS * step
+    out: List[Tuple[int, int]] = []
+    a = (start // step) * step
+    while a <= end:
+        b = min(end, a + span - step)
+        out.append((a, b))
+        a = b + step
+    return out
+
+
+async def _segments(symbol: str, interval: str, start: int, end: int, now: int) -> List[Tuple[str, int, int]]:
+    """
+    Segmentos de [start, end] en orden temporal: ("remote" | "store" | "hole", a, b).
+    Los huecos dentro del tramo guardado ("hole") también se piden a MEXC.
+    """
+    key = (symbol, interval)
+    step = interval_sec(interval)
+    current_open = (min(end, now) // step) * step
+    first, last = await store.read(store.bounds, symbol, interval)
+    live = store.live.get(key)
+
+    segments: List[Tuple[str, int, int]] = []
+    if first is None:
+        segments.append(("remote", start, end))
+    else:
+        origin = store.origin.get(key)
+        if start <= first - step and (origin is None or origin < first):
+            segments.append(("remote", start, first - step))
+        if start <= last and end >= first:
+            a = first if start <= first else -(-start // step) * step
+            b = min(end, last)
+            # Month1 no tiene paso fijo: ahí no se buscan huecos
+            holes = await store.read(store.holes, symbol, interval, a, b, step) if a <= b and interval != "Month1" else []
+            for ha, hb in holes:
+                if a < ha:
+                    segments.append(("store", a, ha - step))
+                segments.append(("hole", ha, hb))
+                a = hb + step
+            if a <= b:
+                segments.append(("store", a, b))
+        # La vela en formación solo cubre la cola si es justo la siguiente a la guardada
+        known_last = live["time"] if live and live["time"] == last + step and live["time"] <= end else last
+        if known_last < current_open:
+            segments.append(("remote", max(start, last + step), end))
+    return segments
+
+
+async def iter_candles(symbol: str, interval: str, start: int, end: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Velas de [start, end] en lotes ordenados. Los intervalos derivados (RESAMPLED)
+    se agregan desde Min1 guardado donde lo hay; lo anterior se sirve nativo.
+    """
+    split = await _min1_split(symbol, interval)
+    if split is None:
+        async for batch in _iter_native(symbol, interval, start, end):
+            yield batch
+        return
+    step = interval_sec(interval)
+    if start < split:
+        async for batch in _iter_native(symbol, interval, start, min(end, split - step)):
+            yield batch
+    a = -(-max(start, split) // step) * step
+    if end < a:
+        return
+    # Los Min1 llegan por lotes; cada bucket se emite cuando llega el siguiente
+    pending: List[Dict[str, Any]] = []
+    async for batch in _iter_native(symbol, BASE_INTERVAL, a, (end // step) * step + step - 60):
+        pending.extend(batch)
+        cut = (pending[-1]["time"] // step) * step
+        done = [c for c in pending if c["time"] < cut]
+        if done:
+            pending = pending[len(done):]
+            yield from_columns(await complete_buckets(symbol, interval, resample_columns(to_columns(done), step)))
+    if pending:
+        yield from_columns(await complete_buckets(symbol, interval, resample_columns(to_columns(pending), step)))
+
+
+async def _iter_native(symbol: str, interval: str, start: int, end: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Genera las velas de [start, end] en lotes ordenados por tiempo, sirviendo desde
+    el store y pidiendo a MEXC solo los tramos que faltan (cabeza anterior al primer
+    dato y cola posterior al último cerrado).
+
+    Los tramos remotos se trocean y se descargan en paralelo (acotado por
+    KLINES_FETCH_CONCURRENCY); cada lote se entrega en cuanto llega su turno, así
+    el primero sale sin esperar al resto. Se deduplica por timestamp.
+    """
+    key = (symbol, interval)
+    step = interval_sec(interval)
+    now = int(time.time())
+    segments = await _segments(symbol, interval, start, end, now)
+    first, _ = await store.read(store.bounds, symbol, interval)
+    live = store.live.get(key)
+
+    sem = asyncio.Semaphore(settings.KLINES_FETCH_CONCURRENCY)
+
+    async def fetch(a: int, b: int) -> List[Dict[str, Any]]:
+        async with sem:
+            return await fetch_klines(symbol, interval, a, b)
+
+    # Lanzamos todas las descargas de golpe; el semáforo acota la concurrencia
+    plan: List[Tuple[str, int, int, Optional[asyncio.Task]]] = []
+    for kind, a, b in segments:
+        if kind == "store":
+            plan.append((kind, a, b, None))
+        else:
+            plan.extend((kind, ca, cb, asyncio.create_task(fetch(ca, cb))) for ca, cb in _chunks(a, b, step))
+
+    # Tramo de cabeza: si MEXC no tiene datos tan antiguos, recordamos el origen
+    head_end: Optional[int] = None
+    if segments and segments[0][0] == "remote" and (first is None or segments[0][2] < first):
+        head_end = segments[0][2]
+    head_first: Optional[int] = None
+
+    last_t = start - 1
+    try:
+        for kind, a, b, task in plan:
+            if task is None:
+                rows = await store.read(store.range, symbol, interval, a, b)
+            else:
+                rows = await task
+                if kind == "hole":
+                    # Lo que MEXC no devuelva del hueco no existe: no se vuelve a pedir
+                    store.mark_checked(symbol, interval, a, b)
+                if head_end is not None and b <= head_end and head_first is None and rows:
+                    head_first = rows[0]["time"]
+                # Solo persistimos velas cerradas; la que está en formación se devuelve pero no se guarda
+                await store.upsert(symbol, interval, [c for c in rows if c["time"] + step <= now])
+            batch = [c for c in rows if last_t < c["time"] <= end]
+            if batch:
+                last_t = batch[-1]["time"]
+                yield batch
+        if live and last_t < live["time"] <= end:
+            yield [live]
+        if head_end is not None and (head_first is None or head_first >= start + step):
+            store.origin[key] = head_first if head_first is not None else head_end + step
+    finally:
+        for _, _, _, task in plan:
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def get_candles(symbol: str, interval: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Versión no incremental de iter_candles: devuelve todas las velas de [start, end]."""
+    out: List[Dict[str, Any]] = []
+    async for batch in iter_candles(symbol, interval, start, end):
+        out.extend(batch)
+    return out
+
+
+async def get_columns(symbol: str, interval: str, start: int, end: int) -> Columns:
+    """
+    Velas de [start, end] en columnas. Si todo está ya en el store (caso caliente)
+    se leen directamente como arrays; si falta algo se rellena vía iter_candles.
+    Los intervalos derivados se agregan desde las columnas Min1.
+    """
+    split = await _min1_split(symbol, interval)
+    if split is not None:
+        step = interval_sec(interval)
+        parts = []
+        if start < split:
+            parts.append(await _native_columns(symbol, interval, start, min(end, split - step)))
+        a = -(-max(start, split) // step) * step
+        if end >= a:
+            min1 = await _native_columns(symbol, BASE_INTERVAL, a, (end // step) * step + step - 60)
+            parts.append(await complete_buckets(symbol, interval, resample_columns(min1, step)))
+        if not parts:
+            return to_columns([])
+        return {k: np.concatenate([p[k] for p in parts]) for k in _COLS}
+    return await _native_columns(symbol, interval, start, end)
+
+
+async def _native_columns(symbol: str, interval: str, start: int, end: int) -> Columns:
+    segments = await _segments(symbol, interval, start, end, int(time.time()))
+    if any(kind != "store" for kind, _, _ in segments):
+        out: List[Dict[str, Any]] = []
+        async for batch in _iter_native(symbol, interval, start, end):
+            out.extend(batch)
+        return to_columns(out)
+    if segments:
+        cols = await store.read(store.range_columns, symbol, interval, segments[0][1], segments[0][2])
+    else:
+        cols = to_columns([])
+    live = store.live.get((symbol, interval))
+    last_t = cols["time"][-1] if len(cols["time"]) else start - 1
+    if live and last_t < live["time"] <= end:
+        cols = {k: np.append(v, live[k]) for k, v in cols.items()}
+    return cols
@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional; sin él se usa json estándar
+    orjson = None
+
+# Políticas ante un cliente lento (buffer lleno)
+POLICY_CONFLATE = "conflate"        # se queda solo la última versión de cada vela (misma clave)
+POLICY_DROP_OLDEST = "drop_oldest"  # se descarta el frame más antiguo
+POLICY_DISCONNECT = "disconnect"    # se cierra la conexión con un close code
+POLICIES = (POLICY_CONFLATE, POLICY_DROP_OLDEST, POLICY_DISCONNECT)
+
+# Frames perdidos por motivo (series fijas: put() está en el hot path)
+_LOST_CONFLATED = metrics.client_frames_lost.labels("conflated")
+_LOST_DROPPED = metrics.client_frames_lost.labels("dropped")
+_LOST_DISCONNECT = metrics.client_frames_lost.labels("disconnect")
+
+
+def dumps(obj: Any) -> str:
+    """Serializa a JSON (texto) con orjson si está disponible."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class SlowConsumer(Exception):
+    """El cliente no consume al ritmo del stream y su política es desconectar."""
+
+
+# Frame ya serializado: texto JSON o binario columnar (wire.py)
+Frame = Union[str, bytes]
+
+# Marca de las claves internas (frames que no se fusionan)
+_SEQ = object()
+
+
+class Subscriber:
+    """
+    Buffer de salida acotado de un cliente WebSocket. Recibe frames ya
+    serializados (se codifican una vez por broadcast, no una por cliente) y
+    aplica la política de cliente lento cuando se llena.
+
+    Los frames fusionables llevan clave (stream, tiempo de vela); así un mismo
+    Subscriber puede recibir varios streams (conexión multiplexada).
+
+    Con `throttle_ms` > 0 se fusionan las actualizaciones de la misma vela y se
+    publica como mucho un frame por ventana y stream; cuando llega una vela
+    nueva la anterior (ya cerrada) sale de inmediato.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, maxsize: int = 1024, policy: str = POLICY_CONFLATE, throttle_ms: int = 0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown slow-consumer policy: {policy}")
+        self.id = next(self._ids)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.throttle = max(0, throttle_ms) / 1000.0
+        self._buf: "OrderedDict[Hashable, Frame]" = OrderedDict()
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        # Por stream: frames pendientes y (última vela enviada, próxima ventana)
+        self._pending: Dict[Hashable, int] = {}
+        self._last: Dict[Hashable, Tuple[Any, float]] = {}
+        self.overflowed = False
+        # Contadores de retraso
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.max_lag = 0
+
+    @property
+    def lag(self) -> int:
+        return len(self._buf)
+
+    def put(self, frame: Frame, key: Optional[Tuple[Hashable, Any]] = None):
+        """Encola un frame; `key` = (stream, tiempo de vela) o None si no se fusiona."""
+        if self.overflowed:
+            return
+        buf = self._buf
+        conflate = self.policy == POLICY_CONFLATE or self.throttle > 0
+        if conflate and key is not None and key in buf:
+            # Misma vela aún sin enviar: sustituimos el frame conservando su posición
+            buf[key] = frame
+            self.conflated += 1
+            _LOST_CONFLATED.inc()
+            return
+        if len(buf) >= self.maxsize:
+            if self.policy == POLICY_DISCONNECT:
+                self.overflowed = True
+                _LOST_DISCONNECT.inc(len(buf))
+                buf.clear()
+                self._pending.clear()
+                self._ready.set()
+                return
+            self._pop(next(iter(buf)))
+            self.dropped += 1
+            _LOST_DROPPED.inc()
+        if not conflate or key is None:
+            key = (_SEQ, next(self._seq))
+        else:
+            self._pending[key[0]] = self._pending.get(key[0], 0) + 1
+        buf[key] = frame
+        if len(buf) > self.max_lag:
+            self.max_lag = len(buf)
+        self._ready.set()
+
+    def _pop(self, key: Hashable) -> Frame:
+        stream = key[0]
+        if stream is not _SEQ:
+            n = self._pending.get(stream, 0) - 1
+            if n > 0:
+                self._pending[stream] = n
+            else:
+                self._pending.pop(stream, None)
+        return self._buf.pop(key)
+
+    def forget(self, stream: Hashable):
+        """Descarta lo pendiente de un stream (p. ej. al desuscribirse)."""
+        for key in [k for k in self._buf if k[0] == stream]:
+            self._pop(key)
+        self._last.pop(stream, None)
+
+    async def get(self) -> Frame:
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._buf:
+                if self.overflowed:
+                    raise SlowConsumer(f"subscriber {self.id} exceeded {self.maxsize} pending frames")
+                self._ready.clear()
+                await self._ready.wait()
+            if self.overflowed:
+                raise SlowConsumer(f"subscriber {self.id} exceeded {self.maxsize} pending frames")
+
+            now = loop.time()
+            deadline: Optional[float] = None
+            for key in self._buf:
+                stream = key[0]
+                if self.throttle and stream is not _SEQ:
+                    last = self._last.get(stream)
+                    # Misma vela dentro de su ventana y sin vela nueva detrás: se retiene
+                    if last and last[0] == key[1] and now < last[1] and self._pending.get(stream, 0) == 1:
+                        deadline = last[1] if deadline is None else min(deadline, last[1])
+                        continue
+                    self._last[stream] = (key[1], now + self.throttle)
+                self.sent += 1
+                return self._pop(key)
+
+            # Todo lo pendiente está retenido: esperamos a la ventana o a un frame nuevo
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), max(0.0, deadline - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"id": self.id, "policy": self.policy, "throttle_ms": int(self.throttle * 1000),
+                "lag": self.lag, "max_lag": self.max_lag, "sent": self.sent,
+                "dropped": self.dropped, "conflated": self.conflated,
+                "overflowed": self.overflowed}
@@ -0,0 +1,553 @@
+"""
+Motor de indicadores del gráfico (port de web/lib/indicators.ts).
+
+Dos modos con la misma semántica (semillas SMA, arranque de RSI, NaN iniciales):
+
+- Lote: `compute(params, o, h, l, c, names)` sobre arrays columnares de NumPy;
+  lo vectorizable (TR, NWE, máx/mín de rango, Balance...) se calcula de golpe y
+  las recurrencias (EMA/RMA/RSI) recorren la serie una vez.
+- Incremental: `IndicatorSet.update(candle, closed)` avanza O(1) por vela
+  (O(maxLen) para el núcleo gaussiano del NWE). Con `closed=False` solo calcula
+  los valores de la vela en formación sin tocar el estado.
+
+Los campos de salida por grupo están en FIELDS.
+"""
+import math
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+NAN = float("nan")
+
+
+# ============================
+# Buffers compartidos (también los usa alerts_engine)
+# ============================
+def gauss_w(x: int, h: float) -> float:
+    return math.exp(-(x * x) / (h * h * 2.0)) if h > 0 else 1.0
+
+
+class RingBuffer:
+    """
+    Buffer circular preasignado sobre NumPy. Cada valor se escribe dos veces
+    (pos y pos+cap) para que los últimos n sean siempre una vista contigua.
+    len() satura en `cap`, igual que un deque(maxlen=cap).
+    """
+    __slots__ = ("cap", "buf", "pos", "count")
+
+    def __init__(self, cap: int, dtype=np.float64):
+        self.cap = cap
+        self.buf = np.zeros(2 * cap, dtype=dtype)
+        self.pos = 0
+        self.count = 0
+
+    def append(self, x):
+        self.buf[self.pos] = x
+        self.buf[self.pos + self.cap] = x
+        self.pos = (self.pos + 1) % self.cap
+        self.count += 1
+
+    def last(self, n: int) -> np.ndarray:
+        end = self.pos + self.cap
+        return self.buf[end - n:end]
+
+    def __len__(self) -> int:
+        return min(self.count, self.cap)
+
+    def __getitem__(self, i: int) -> float:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.buf[self.pos + self.cap - len(self) + i].item()
+
+
+class RollingExtreme:
+    """Máximo (o mínimo) de ventana deslizante con deque monótono: O(1) amortizado."""
+    __slots__ = ("window", "sign", "q", "n")
+
+    def __init__(self, window: int, maximum: bool = True):
+        self.window = window
+        self.sign = 1.0 if maximum else -1.0
+        self.q: Deque[Tuple[int, float]] = deque()
+        self.n = 0
+
+    def push(self, x: float):
+        v = self.sign * x
+        while self.q and self.q[-1][1] <= v:
+            self.q.pop()
+        self.q.append((self.n, v))
+        self.n += 1
+        while self.q[0][0] <= self.n - 1 - self.window:
+            self.q.popleft()
+
+    def value(self) -> float:
+        return self.sign * self.q[0][1] if self.q else NAN
+
+
+# ============================
+# Parámetros (mismos valores por defecto que el panel web)
+# ============================
+# Tope de las longitudes de ventana: NWE y breakout cuestan O(velas × longitud)
+# y el núcleo gaussiano se reserva entero, así que sin tope una sola petición
+# podría agotar CPU o memoria.
+MAX_LENGTH = 5000
+
+# (mínimo, máximo) admitidos por from_mapping; las longitudes no listadas van de 1 a MAX_LENGTH
+PARAM_LIMITS: Dict[str, Tuple[float, float]] = {
+    "nwe_max_len": (2, MAX_LENGTH),     # el MAE del NWE usa una RMA de nwe_max_len - 1
+    "nwe_h": (0.0, float(MAX_LENGTH)),
+    "nwe_mult": (0.0, 100.0),
+    "breakout_buf": (0.0, 100.0),
+    "balance_scale": (0.0, 1e6),
+    "balance_prox": (0.01, 100.0),    # divide la distancia a la envolvente
+}
+
+
+class IndicatorParams:
+    def __init__(self, ema_length: int = 20, rsi_length: int = 14,
+                 macd_fast: int = 12, macd_slow: int = 26, macd_signal: int = 9,
+                 atr_length: int = 14,
+                 nwe_h: float = 8.0, nwe_mult: float = 3.0, nwe_max_len: int = 500,
+                 breakout_range: int = 16, breakout_atr: int = 14, breakout_buf: float = 0.2,
+                 balance_scale: float = 100.0, balance_prox: float = 1.0,
+                 mbias_len: int = 100, mbias_smooth: int = 100, mbias_osc: int = 7,
+                 efmus_fast: int = 13, efmus_slow: int = 48):
+        self.ema_length = ema_length
+        self.rsi_length = rsi_length
+        self.macd_fast = macd_fast
+        self.macd_slow = macd_slow
+        self.macd_signal = macd_signal
+        self.atr_length = atr_length
+        self.nwe_h = nwe_h
+        self.nwe_mult = nwe_mult
+        self.nwe_max_len = nwe_max_len
+        self.breakout_range = breakout_range
+        self.breakout_atr = breakout_atr
+        self.breakout_buf = breakout_buf
+        self.balance_scale = balance_scale
+        self.balance_prox = balance_prox
+        self.mbias_len = mbias_len
+        self.mbias_smooth = mbias_smooth
+        self.mbias_osc = mbias_osc
+        self.efmus_fast = efmus_fast
+        self.efmus_slow = efmus_slow
+
+    @classmethod
+    def from_mapping(cls, m: Dict[str, Any]) -> "IndicatorParams":
+        """
+        Construye los parámetros desde un dict (p. ej. query string); ignora claves
+        ajenas. ValueError si un valor no es numérico, no es finito o está fuera de
+        PARAM_LIMITS.
+        """
+        p = cls()
+        for k, default in vars(p).items():
+            if k in m:
+                v = type(default)(m[k])
+                lo, hi = PARAM_LIMITS.get(k, (1, MAX_LENGTH))
+                if not (math.isfinite(v) and lo <= v <= hi):
+                    raise ValueError(f"{k} must be between {lo} and {hi}")
+                setattr(p, k, v)
+        return p
+
+    def key(self) -> tuple:
+        return tuple(vars(self).values())
+
+
+# Campos devueltos por cada grupo (el orden es el de salida)
+FIELDS: Dict[str, Tuple[str, ...]] = {
+    "ema": ("ema",),
+    "rsi": ("rsi",),
+    "macd": ("macd", "macd_signal", "macd_hist"),
+    "atr": ("atr",),
+    "nwe": ("nwe_out", "nwe_up", "nwe_dn"),
+    "breakout": ("breakout_up", "breakout_dn"),
+    "balance": ("balance",),
+    "mbias": ("mbias_avg", "mbias_osc", "mbias_osc_smooth"),
+    "efmus": ("efmus_fast", "efmus_slow", "efmus_signal"),
+}
+NAMES = tuple(FIELDS)
+
+
+def parse_names(raw: Optional[str]) -> Tuple[str, ...]:
+    """'ema,rsi' -> ('ema', 'rsi'); vacío o None = todos."""
+    if not raw:
+        return NAMES
+    names = tuple(dict.fromkeys(n.strip() for n in raw.split(",") if n.strip()))
+    unknown = [n for n in names if n not in FIELDS]
+    if unknown:
+        raise ValueError(f"unknown indicators: {', '.join(unknown)} (available: {', '.join(NAMES)})")
+    return names
+
+
+def _clamp01(x: float) -> float:
+    return x if x != x else max(0.0, min(1.0, x))
+
+
+# ============================
+# Estados incrementales
+# ============================
+class _Smoother:
+    """
+    EMA (k = 2/(L+1)) o RMA de Wilder (k = 1/L) con semilla SMA de las primeras
+    L muestras. Los NaN iniciales se saltan (como ta.ema de Pine), así una serie
+    derivada que aún no ha arrancado no deja la media en NaN para siempre.
+    """
+    __slots__ = ("L", "k", "wilder", "n", "acc", "v")
+
+    def __init__(self, length: int, wilder: bool = False):
+        self.L = length
+        self.wilder = wilder
+        self.k = 1.0 / length if wilder else 2.0 / (length + 1)
+        self.n = 0
+        self.acc = 0.0
+        self.v = NAN
+
+    def calc(self, x: float) -> Tuple[float, tuple]:
+        n, acc, v = self.n, self.acc, self.v
+        if n == 0 and x != x:
+            return NAN, (n, acc, v)
+        if n < self.L:
+            n += 1
+            acc += x
+            if n == self.L:
+                v = acc / self.L
+        elif self.wilder:
+            v = v + self.k * (x - v)
+        else:
+            v = x * self.k + v * (1 - self.k)
+        return v, (n, acc, v)
+
+    def set(self, st: tuple):
+        self.n, self.acc, self.v = st
+
+
+class _Rsi:
+    """RSI de Wilder: primer valor tras `length` variaciones."""
+    __slots__ = ("L", "n", "prev", "gain", "loss")
+
+    def __init__(self, length: int):
+        self.L = length
+        self.n = 0
+        self.prev = NAN
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def calc(self, x: float) -> Tuple[float, tuple]:
+        n, gain, loss = self.n, self.gain, self.loss
+        out = NAN
+        if n > 0:
+            ch = x - self.prev
+            g, l = (ch, 0.0) if ch > 0 else (0.0, -ch)
+            if n <= self.L:
+                gain += g
+                loss += l
+                if n == self.L:
+                    gain /= self.L
+                    loss /= self.L
+                    out = self._value(gain, loss)
+            else:
+                gain = (gain * (self.L - 1) + g) / self.L
+                loss = (loss * (self.L - 1) + l) / self.L
+                out = self._value(gain, loss)
+        return out, (n + 1, x, gain, loss)
+
+    @staticmethod
+    def _value(gain: float, loss: float) -> float:
+        return 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+    def set(self, st: tuple):
+        self.n, self.prev, self.gain, self.loss = st
+
+
+class _Nwe:
+    """Media gaussiana de los últimos maxLen cierres (envolvente NWE)."""
+    __slots__ = ("max_len", "w0", "w_rev", "w_cum", "closes")
+
+    def __init__(self, h: float, max_len: int):
+        w = np.array([gauss_w(j, h) for j in range(max_len)])
+        self.max_len = max_len
+        self.w0 = float(w[0])
+        self.w_rev = w[::-1].copy()
+        self.w_cum = np.concatenate(([0.0], np.cumsum(w)))
+        self.closes = RingBuffer(max_len)
+
+    def calc(self, x: float) -> float:
+        m = min(len(self.closes), self.max_len - 1)   # cierres previos en la ventana
+        s = x * self.w0
+        if m:
+            s += float(np.dot(self.closes.last(m), self.w_rev[self.max_len - 1 - m:self.max_len - 1]))
+        den = float(self.w_cum[m + 1])
+        return s / den if den > 0 else NAN
+
+
+class IndicatorSet:
+    """
+    Estado incremental de todos los indicadores de un (symbol, interval).
+    `update(candle, closed=True)` consolida la vela; con `closed=False` devuelve
+    los valores que tendría la vela en formación sin modificar el estado.
+    """
+    def __init__(self, params: Optional[IndicatorParams] = None, names: Iterable[str] = NAMES):
+        p = self.params = params or IndicatorParams()
+        self.names = tuple(names)
+        self.count = 0
+        self.prev_close = NAN
+        self.ema = _Smoother(p.ema_length)
+        self.rsi = _Rsi(p.rsi_length)
+        self.macd_f = _Smoother(p.macd_fast)
+        self.macd_s = _Smoother(p.macd_slow)
+        self.macd_sig = _Smoother(p.macd_signal)
+        self.atr = _Smoother(p.atr_length, wilder=True)
+        self.br_atr = self.atr if p.breakout_atr == p.atr_length else _Smoother(p.breakout_atr, wilder=True)
+        self.nwe = _Nwe(p.nwe_h, p.nwe_max_len)
+        self.nwe_mae = _Smoother(p.nwe_max_len - 1, wilder=True)
+        self.hh = RollingExtreme(p.breakout_range, True)
+        self.ll = RollingExtreme(p.breakout_range, False)
+        self.ha1 = [_Smoother(p.mbias_len) for _ in range(4)]       # o, h, l, c
+        self.ha2 = [_Smoother(p.mbias_smooth) for _ in range(4)]    # haopen, hahigh, halow, haclose
+        self.ha_osc = _Smoother(p.mbias_osc)
+        self.ha_prev = (NAN, NAN)   # (haopen, haclose) de la vela anterior
+        self.ef_f = _Smoother(p.efmus_fast)
+        self.ef_s = _Smoother(p.efmus_slow)
+        self.ef_up = False
+
+    def update(self, candle: Dict[str, Any], closed: bool = True) -> Dict[str, Optional[float]]:
+        p = self.params
+        o, h, l, c = float(candle["open"]), float(candle["high"]), float(candle["low"]), float(candle["close"])
+        commit: List[Tuple[Any, tuple]] = []
+
+        def step(st, x: float) -> float:
+            v, new = st.calc(x)
+            commit.append((st, new))
+            return v
+
+        out: Dict[str, float] = {}
+        cp = c if self.prev_close != self.prev_close else self.prev_close
+        tr = max(h - l, abs(h - cp), abs(l - cp))
+        want = set(self.names)
+        need_nwe = "nwe" in want or "balance" in want
+        need_br = "breakout" in want or "balance" in want
+
+        if "ema" in want:
+            out["ema"] = step(self.ema, c)
+        if "rsi" in want:
+            out["rsi"] = step(self.rsi, c)
+        if "macd" in want:
+            f, s = step(self.macd_f, c), step(self.macd_s, c)
+            m = f - s
+            sig = step(self.macd_sig, m if m == m else 0.0)
+            ok = m == m and sig == sig
+            out.update(macd=m, macd_signal=sig if ok else NAN, macd_hist=m - sig if ok else NAN)
+        atr = step(self.atr, tr) if "atr" in want or need_br else NAN
+        if "atr" in want:
+            out["atr"] = atr
+        if need_nwe:
+            nwe_out = self.nwe.calc(c)
+            mae = step(self.nwe_mae, abs(c - nwe_out)) * p.nwe_mult
+            env_wd = max(mae if mae == mae else tr, 1e-10)
+            up, dn = nwe_out + mae, nwe_out - mae
+            if "nwe" in want:
+                out.update(nwe_out=nwe_out, nwe_up=up, nwe_dn=dn)
+        if need_br:
+            a = atr if self.br_atr is self.atr else step(self.br_atr, tr)
+            atr0 = a if a == a else tr
+            hh = self.hh.value() if self.count else h
+            ll = self.ll.value() if self.count else l
+            upper, lower = hh + p.breakout_buf * atr0, ll - p.breakout_buf * atr0
+            if "breakout" in want:
+                out.update(breakout_up=upper, breakout_dn=lower)
+        if "balance" in want:
+            scale_w = p.balance_prox * env_wd
+            d_up, d_dn = upper - c, c - lower
+            bull_prox = 1.0 if d_up <= 0 else _clamp01(1 - d_up / scale_w)
+            bear_prox = 1.0 if d_dn <= 0 else _clamp01(1 - d_dn / scale_w)
+            bull = 0.60 * bull_prox + 0.40 * _clamp01((dn - lower) / scale_w)
+            bear = 0.60 * bear_prox + 0.40 * _clamp01((upper - up) / scale_w)
+            out["balance"] = (bull - bear) * p.balance_scale
+        if "mbias" in want:
+            o1, h1, l1, c1 = (step(st, x) for st, x in zip(self.ha1, (o, h, l, c)))
+            haclose = (o1 + h1 + l1 + c1) / 4
+            prev_open, prev_close = self.ha_prev
+            haopen = (o1 + c1) / 2 if prev_open != prev_open else (prev_open + prev_close) / 2
+            ha_ok = haopen == haopen and haclose == haclose
+            hahigh = max(h1, haopen, haclose) if ha_ok and h1 == h1 else NAN
+            halow = min(l1, haopen, haclose) if ha_ok and l1 == l1 else NAN
+            o2, h2, l2, c2 = (step(st, x) for st, x in zip(self.ha2, (haopen, hahigh, halow, haclose)))
+            osc = 100 * (c2 - o2)
+            out.update(mbias_avg=(h2 + l2) / 2, mbias_osc=osc,
+                       mbias_osc_smooth=step(self.ha_osc, osc if osc == osc else 0.0))
+        if "efmus" in want:
+            f, s = step(self.ef_f, c), step(self.ef_s, c)
+            now_up = f > s
+            sig = 0
+            if f == f and s == s:
+                sig = 1 if now_up and not self.ef_up and self.count else -1 if self.ef_up and not now_up else 0
+            out.update(efmus_fast=f, efmus_slow=s, efmus_signal=sig)
+
+        if closed:
+            for st, new in commit:
+                st.set(new)
+            self.prev_close = c
+            self.count += 1
+            if need_nwe:
+                self.nwe.closes.append(c)
+            if need_br:
+                self.hh.push(h)
+                self.ll.push(l)
+            if "mbias" in want:
+                self.ha_prev = (haopen, haclose)
+            if "efmus" in want:
+                self.ef_up = now_up
+        return {k: _num(v) for k, v in out.items()}
+
+
+def _num(v: float) -> Optional[float]:
+    """NaN/inf -> None (null en JSON)."""
+    return v if isinstance(v, int) or math.isfinite(v) else None
+
+
+# ============================
+# Modo lote (arrays columnares)
+# ============================
+def _smooth(src: np.ndarray, length: int, wilder: bool = False) -> np.ndarray:
+    st = _Smoother(length, wilder)
+    out = np.empty(len(src))
+    for i, x in enumerate(src.tolist()):
+        out[i], new = st.calc(x)
+        st.set(new)
+    return out
+
+
+def ema(src: np.ndarray, length: int) -> np.ndarray:
+    return _smooth(src, length)
+
+
+def rma(src: np.ndarray, length: int) -> np.ndarray:
+    return _smooth(src, length, wilder=True)
+
+
+def true_range(h: np.ndarray, l: np.ndarray, c: np.ndarray) -> np.ndarray:
+    cp = np.concatenate((c[:1], c[:-1]))
+    return np.maximum(h - l, np.maximum(np.abs(h - cp), np.abs(l - cp)))
+
+
+def rsi(c: np.ndarray, length: int) -> np.ndarray:
+    st = _Rsi(length)
+    out = np.empty(len(c))
+    for i, x in enumerate(c.tolist()):
+        out[i], new = st.calc(x)
+        st.set(new)
+    return out
+
+
+def macd(c: np.ndarray, fast: int, slow: int, signal: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    m = ema(c, fast) - ema(c, slow)
+    sig = ema(np.nan_to_num(m, nan=0.0), signal)
+    sig = np.where(np.isfinite(m), sig, np.nan)
+    return m, sig, m - sig
+
+
+def nwe(c: np.ndarray, tr: np.ndarray, h: float, mult: float, max_len: int) -> Dict[str, np.ndarray]:
+    w = np.array([gauss_w(j, h) for j in range(max_len)])
+    n = len(c)
+    out = np.convolve(c, w)[:n] / np.cumsum(w)[np.minimum(np.arange(n), max_len - 1)]
+    mae = rma(np.abs(c - out), max_len - 1) * mult
+    return {"out": out, "up": out + mae, "dn": out - mae,
+            "env_wd": np.maximum(np.where(np.isfinite(mae), mae, tr), 1e-10)}
+
+
+def breakout(h: np.ndarray, l: np.ndarray, atr0: np.ndarray, range_len: int, buf: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Máx/mín de las `range_len` velas ANTERIORES (la primera usa la suya) ± buf·ATR."""
+    pad = range_len - 1
+    hh = sliding_window_view(np.concatenate((np.full(pad, -np.inf), h)), range_len).max(axis=1)
+    ll = sliding_window_view(np.concatenate((np.full(pad, np.inf), l)), range_len).min(axis=1)
+    hh = np.concatenate((hh[:1], hh[:-1]))
+    ll = np.concatenate((ll[:1], ll[:-1]))
+    return hh + buf * atr0, ll - buf * atr0
+
+
+def market_bias(o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray,
+                length: int, smooth: int, osc_len: int) -> Dict[str, np.ndarray]:
+    o1, h1, l1, c1 = (ema(x, length) for x in (o, h, l, c))
+    haclose = (o1 + h1 + l1 + c1) / 4
+    seed = ((o1 + c1) / 2).tolist()
+    hc = haclose.tolist()
+    haopen = np.empty(len(c))
+    prev_o = prev_c = NAN
+    for i in range(len(c)):
+        prev_o = seed[i] if prev_o != prev_o else (prev_o + prev_c) / 2
+        prev_c = hc[i]
+        haopen[i] = prev_o
+    with np.errstate(invalid="ignore"):
+        hahigh = np.fmax(h1, np.fmax(haopen, haclose))
+        halow = np.fmin(l1, np.fmin(haopen, haclose))
+    bad = ~(np.isfinite(haopen) & np.isfinite(haclose) & np.isfinite(h1))
+    hahigh[bad] = np.nan
+    halow[bad] = np.nan
+    o2, h2, l2, c2 = (ema(x, smooth) for x in (haopen, hahigh, halow, haclose))
+    osc = 100 * (c2 - o2)
+    return {"avg": (h2 + l2) / 2, "osc": osc, "osc_smooth": ema(np.nan_to_num(osc, nan=0.0), osc_len)}
+
+
+def efmus(c: np.ndarray, fast: int, slow: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    f, s = ema(c, fast), ema(c, slow)
+    up = f > s
+    prev = np.concatenate(([False], up[:-1]))
+    ok = np.isfinite(f) & np.isfinite(s)
+    sig = np.zeros(len(c), dtype=np.int64)
+    sig[ok & up & ~prev] = 1
+    sig[ok & ~up & prev] = -1
+    sig[0] = 0
+    return f, s, sig
+
+
+def compute(params: IndicatorParams, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray,
+            names: Sequence[str] = NAMES) -> Dict[str, np.ndarray]:
+    """Calcula en lote los grupos `names`; devuelve {campo: array} alineado con las velas."""
+    p = params
+    want = set(names)
+    out: Dict[str, np.ndarray] = {}
+    n = len(c)
+    if n == 0:
+        return {f: np.empty(0) for g in names for f in FIELDS[g]}
+    tr = true_range(h, l, c)
+    if "ema" in want:
+        out["ema"] = ema(c, p.ema_length)
+    if "rsi" in want:
+        out["rsi"] = rsi(c, p.rsi_length)
+    if "macd" in want:
+        out["macd"], out["macd_signal"], out["macd_hist"] = macd(c, p.macd_fast, p.macd_slow, p.macd_signal)
+    if "atr" in want:
+        out["atr"] = rma(tr, p.atr_length)
+    if "nwe" in want or "balance" in want:
+        env = nwe(c, tr, p.nwe_h, p.nwe_mult, p.nwe_max_len)
+        if "nwe" in want:
+            out.update(nwe_out=env["out"], nwe_up=env["up"], nwe_dn=env["dn"])
+    if "breakout" in want or "balance" in want:
+        a = rma(tr, p.breakout_atr)
+        upper, lower = breakout(h, l, np.where(np.isfinite(a), a, tr), p.breakout_range, p.breakout_buf)
+        if "breakout" in want:
+            out.update(breakout_up=upper, breakout_dn=lower)
+    if "balance" in want:
+        scale_w = p.balance_prox * env["env_wd"]
+        d_up, d_dn = upper - c, c - lower
+        bull_prox = np.where(d_up <= 0, 1.0, np.clip(1 - d_up / scale_w, 0, 1))
+        bear_prox = np.where(d_dn <= 0, 1.0, np.clip(1 - d_dn / scale_w, 0, 1))
+        bull = 0.60 * bull_prox + 0.40 * np.clip((env["dn"] - lower) / scale_w, 0, 1)
+        bear = 0.60 * bear_prox + 0.40 * np.clip((upper - env["up"]) / scale_w, 0, 1)
+        out["balance"] = (bull - bear) * p.balance_scale
+    if "mbias" in want:
+        mb = market_bias(o, h, l, c, p.mbias_len, p.mbias_smooth, p.mbias_osc)
+        out.update(mbias_avg=mb["avg"], mbias_osc=mb["osc"], mbias_osc_smooth=mb["osc_smooth"])
+    if "efmus" in want:
+        out["efmus_fast"], out["efmus_slow"], out["efmus_signal"] = efmus(c, p.efmus_fast, p.efmus_slow)
+    return {f: out[f] for g in names for f in FIELDS[g]}
+
+
+def to_json_column(a: np.ndarray) -> List[Optional[float]]:
+    """Array -> lista JSON con null en lugar de NaN."""
+    if a.dtype.kind in "iu":
+        return a.tolist()
+    return [x if math.isfinite(x) else None for x in a.tolist()]
@@ -1,14 +1,50 @@
+import asyncio
 import time
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 
-import httpx
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import numpy as np
 
 from settings import settings
-from mexc_stream import hub
+from mexc_stream import hub, StreamLimitError
+from upstream_codec import DEAL, DEPTH
+from backplane import backplane
+import mexc_rest
+from mexc_rest import INTERVAL_SEC, interval_sec, contracts_cache
+from candle_store import get_columns, get_candles, iter_candles, store
+from alerts_engine import EngineConfig
+from alerts_hub import alerts_hub
+from alert_log import alert_log
+from fanout import POLICIES, SlowConsumer, Subscriber, dumps
+from indicators import IndicatorParams, compute, parse_names, to_json_column
+import metrics
+from notifiers import notifier
+from profiler import profiler
+import wire
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único cliente HTTP (pool) para toda la vida de la app
+    mexc_rest.client()
+    # Backplane entre workers: decide quién es líder antes de abrir streams
+    await backplane.start(hub)
+    # Notificaciones que quedaron pendientes antes del último reinicio
+    await notifier.start()
+    yield
+    profiler.stop()
+    await notifier.stop()
+    await backplane.stop()
+    # Velas cerradas aún encoladas para el store
+    await store.flush()
+    await mexc_rest.aclose()
 
-app = FastAPI(title="MEXC Futures Realtime Proxy", version="1.1.0")
+
+app = FastAPI(title="MEXC Futures Realtime Proxy", version="1.1.0", lifespan=lifespan)
 
 # CORS abierto para desarrollo (restringe en prod)
 app.add_middleware(
@@ -25,119 +61,574 @@ def health():
     return {"ok": True}
 
 
+@app.get("/api/streams")
+def streams():
+    """Métricas del ciclo de vida de los streams (vivos, en espera, expulsados...)."""
+    return hub.stats()
+
+
+# ============================
+# Observabilidad
+# ============================
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus."""
+    if not settings.METRICS_ENABLED:
+        return JSONResponse({"error": "metrics disabled"}, status_code=404)
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _profiler_guard() -> Optional[JSONResponse]:
+    if not settings.PROFILER_ENABLED:
+        return JSONResponse({"error": "profiler disabled (PROFILER_ENABLED=1)"}, status_code=404)
+    return None
+
+
+# async: se ejecutan en el hilo del event loop, que es el que se muestrea
+@app.post("/debug/profiler/start")
+async def profiler_start(interval_ms: Optional[float] = Query(None, ge=1, le=1000)):
+    err = _profiler_guard()
+    if err is not None:
+        return err
+    profiler.start(interval_ms or settings.PROFILER_INTERVAL_MS)
+    return profiler.stats()
+
+
+@app.post("/debug/profiler/stop")
+async def profiler_stop():
+    err = _profiler_guard()
+    if err is not None:
+        return err
+    profiler.stop()
+    return profiler.stats()
+
+
+@app.get("/debug/profiler")
+async def profiler_report(format: str = Query("json", pattern="^(json|collapsed)$"),
+                          top: int = Query(20, ge=0, le=10000)):
+    """Resumen (json) o pilas plegadas para flamegraph/speedscope (collapsed)."""
+    err = _profiler_guard()
+    if err is not None:
+        return err
+    if format == "collapsed":
+        return Response(content=profiler.collapsed(top), media_type="text/plain")
+    return profiler.stats(top)
+
+
 # ============================
 # Contratos disponibles (Futuros)
 # ============================
 @app.get("/api/contracts")
-async def contracts():
+async def contracts(request: Request):
     """
     Devuelve la lista de contratos de futuros (USDT-settled) aptos para API.
-    Fuente oficial: GET /api/v1/contract/detail
+    Fuente oficial: GET /api/v1/contract/detail (cacheada con TTL, ETag y
+    stale-while-revalidate; las peticiones simultáneas comparten una sola descarga).
     """
-    url = f"{settings.MEXC_REST_BASE}/contract/detail"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json().get("data", [])
-
-    # Filtrado y normalización
-    out: List[Dict[str, Any]] = []
-    for it in data:
-        # Campos típicos: symbol, displayNameEn, baseCoin, quoteCoin, settleCoin, apiAllowed, priceScale, amountScale
-        if it.get("settleCoin") != "USDT":
-            continue
-        api_allowed = it.get("apiAllowed")
-        if api_allowed is not None and not api_allowed:
-            continue
-
-        out.append({
-            "symbol": it.get("symbol"),
-            "displayName": it.get("displayNameEn") or it.get("displayName") or it.get("symbol"),
-            "baseCoin": it.get("baseCoin"),
-            "quoteCoin": it.get("quoteCoin"),
-            "priceScale": it.get("priceScale"),
-            "amountScale": it.get("amountScale"),
-        })
-
-    # Orden alfabético por símbolo
-    out.sort(key=lambda x: (x.get("symbol") or ""))
-
-    return {"contracts": out}
+    body = await contracts_cache.get()
+    headers = {
+        "ETag": contracts_cache.etag,
+        "Cache-Control": f"public, max-age={settings.CONTRACTS_TTL_SEC}, "
+                         f"stale-while-revalidate={settings.CONTRACTS_STALE_SEC}",
+    }
+    if request.headers.get("if-none-match") == contracts_cache.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # ============================
 # Histórico para sembrar gráfico
 # ============================
+def _time_range(step_sec: int, limit: int, startTime: Optional[int], endTime: Optional[int]) -> Tuple[int, int]:
+    """
+    [start, end] en segundos a partir de startTime/endTime (ms). Sin startTime se
+    cubren `limit` velas que terminan en endTime (o ahora); solo con startTime,
+    `limit` velas desde ahí. Acotado a KLINES_MAX_BARS.
+    """
+    now = int(time.time())
+    end = min(now, endTime // 1000) if endTime is not None else now
+    if startTime is not None:
+        start = startTime // 1000
+        if endTime is None:
+            end = min(now, start + (limit - 1) * step_sec)
+    else:
+        start = end - limit * step_sec
+    # Tope de velas por consulta
+    return max(start, end - settings.KLINES_MAX_BARS * step_sec), end
+
+
 @app.get("/api/klines")
 async def klines(
+    request: Request,
     symbol: str = Query(default=settings.DEFAULT_SYMBOL),
     interval: str = Query(default=settings.DEFAULT_INTERVAL),
-    limit: int = Query(default=500, ge=1, le=2000),
+    limit: int = Query(default=500, ge=1, le=settings.KLINES_MAX_BARS),
+    startTime: Optional[int] = Query(default=None, ge=0, description="epoch ms"),
+    endTime: Optional[int] = Query(default=None, ge=0, description="epoch ms"),
+    format: Optional[str] = Query(default=None, pattern="^(json|binary)$"),
+    delta: bool = Query(default=True, description="binario: tiempos en delta"),
+    compress: bool = Query(default=False, description="binario: datos con zlib"),
 ):
     """
     Devuelve candles normalizados para lightweight-charts.
-    Usa REST de MEXC Futures: /api/v1/contract/kline/{symbol}?interval=Min1&start=&end=
+    Se sirve desde el almacén local (candle_store) y solo se pide a MEXC lo que
+    falta: /api/v1/contract/kline/{symbol}?interval=Min1&start=&end=
+
+    Rango: startTime/endTime (ms). Sin startTime se devuelven `limit` velas que
+    terminan en endTime (o ahora); solo con startTime, `limit` velas desde ahí.
+    Si el rango excede un tramo de MEXC la respuesta se envía en streaming.
+
+    Con `format=binary` (o Accept: application/vnd.mexc.columnar) se devuelve el
+    formato columnar de wire.py, construido directamente desde los arrays del store.
     """
-    now = int(time.time())
-    step_sec_map: Dict[str, int] = {
-        "Min1": 60, "Min5": 300, "Min15": 900, "Min30": 1800, "Min60": 3600,
-        "Hour4": 14400, "Hour8": 28800, "Day1": 86400, "Week1": 604800, "Month1": 2592000
-    }
-    step_sec = step_sec_map.get(interval, 60)
-    start = now - limit * step_sec
+    step_sec = interval_sec(interval)
+    start, end = _time_range(step_sec, limit, startTime, endTime)
+    if wire.wants_binary(request.headers.get("accept"), format):
+        cols = await get_columns(symbol, interval, start, end) if start <= end else {}
+        body = wire.encode(cols, {"symbol": symbol, "interval": interval}, delta, compress)
+        return Response(content=body, media_type=wire.MEDIA_TYPE)
+    if start > end:
+        return {"symbol": symbol, "interval": interval, "candles": []}
 
-    url = f"{settings.MEXC_REST_BASE}/contract/kline/{symbol}"
-    params = {"interval": interval, "start": start, "end": now}
+    if (end - start) // step_sec < settings.KLINES_CHUNK_BARS:
+        candles = await get_candles(symbol, interval, start, end)
+        return {"symbol": symbol, "interval": interval, "candles": candles}
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        payload = r.json().get("data", {})
+    async def body():
+        # Mismo documento JSON que la respuesta normal, emitido lote a lote
+        yield f'{{"symbol":{dumps(symbol)},"interval":{dumps(interval)},"candles":['
+        sep = ""
+        async for batch in iter_candles(symbol, interval, start, end):
+            if batch:
+                yield sep + ",".join(map(dumps, batch))
+                sep = ","
+        yield "]}"
 
-    # La API devuelve arrays paralelos
-    times: List[int] = payload.get("time", [])
-    opens: List[str] = payload.get("open", [])
-    highs: List[str] = payload.get("high", [])
-    lows: List[str] = payload.get("low", [])
-    closes: List[str] = payload.get("close", [])
-    vols: List[str] = payload.get("vol", [])
+    return StreamingResponse(body(), media_type="application/json")
 
-    n = min(len(times), len(opens), len(highs), len(lows), len(closes))
-    candles = []
-    for i in range(n):
-        candles.append({
-            "time": int(times[i]),
-            "open": float(opens[i]),
-            "high": float(highs[i]),
-            "low": float(lows[i]),
-            "close": float(closes[i]),
-            "volume": float(vols[i]) if i < len(vols) else 0.0,
-        })
 
-    return {"symbol": symbol, "interval": interval, "candles": candles}
+# ============================
+# Indicadores calculados en servidor
+# ============================
+@app.get("/api/indicators")
+async def indicators(
+    request: Request,
+    symbol: str = Query(default=settings.DEFAULT_SYMBOL),
+    interval: str = Query(default=settings.DEFAULT_INTERVAL),
+    limit: int = Query(default=500, ge=1, le=settings.KLINES_MAX_BARS),
+    startTime: Optional[int] = Query(default=None, ge=0, description="epoch ms"),
+    endTime: Optional[int] = Query(default=None, ge=0, description="epoch ms"),
+    names: Optional[str] = Query(default=None, description="ema,rsi,macd,atr,nwe,breakout,balance,mbias,efmus"),
+    format: Optional[str] = Query(default=None, pattern="^(json|binary)$"),
+    delta: bool = Query(default=True),
+    compress: bool = Query(default=False),
+):
+    """
+    Series de indicadores en columnas alineadas con `time` (null = sin valor aún).
+    El rango se interpreta como en /api/klines; se calculan además
+    INDICATORS_WARMUP_BARS velas previas para que los primeros valores coincidan
+    con los de una serie larga. Con startTime = última vela conocida el cliente
+    pide solo la cola (modo incremental).
+
+    Parámetros de cada indicador por query (mismos nombres que IndicatorParams):
+    ema_length, rsi_length, macd_fast, macd_slow, macd_signal, nwe_h, nwe_mult...
+    Admite el formato binario columnar igual que /api/klines (NaN = sin valor).
+    """
+    try:
+        groups = parse_names(names)
+        params = IndicatorParams.from_mapping(dict(request.query_params))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    step_sec = interval_sec(interval)
+    start, end = _time_range(step_sec, limit, startTime, endTime)
+    binary = wire.wants_binary(request.headers.get("accept"), format)
+    if start > end:
+        if binary:
+            return Response(content=wire.encode({}, {"symbol": symbol, "interval": interval}), media_type=wire.MEDIA_TYPE)
+        return {"symbol": symbol, "interval": interval, "time": [], "indicators": {}}
+    cols = await get_columns(symbol, interval, start - settings.INDICATORS_WARMUP_BARS * step_sec, end)
+
+    def run() -> Any:
+        t = cols["time"]
+        series = compute(params, cols["open"], cols["high"], cols["low"], cols["close"], groups)
+        first = int(np.searchsorted(t, start))
+        if binary:
+            out = {"time": t[first:], **{k: v[first:] for k, v in series.items()}}
+            return Response(content=wire.encode(out, {"symbol": symbol, "interval": interval}, delta, compress),
+                            media_type=wire.MEDIA_TYPE)
+        return {"symbol": symbol, "interval": interval, "time": t[first:].tolist(),
+                "indicators": {k: to_json_column(v[first:]) for k, v in series.items()}}
+
+    # Cálculo NumPy fuera del event loop
+    return await asyncio.to_thread(run)
+
+
+# ============================
+# Histórico de alertas (registro persistente)
+# ============================
+@app.get("/api/alerts")
+async def alerts_history(
+    symbol: Optional[str] = Query(default=None),
+    interval: Optional[str] = Query(default=None),
+    stream: Optional[str] = Query(default=None, description="etiqueta del stream de /ws/alerts (alerts:...)"),
+    after: Optional[int] = Query(default=None, ge=0, description="seq: solo alertas posteriores"),
+    since: Optional[int] = Query(default=None, ge=0, description="epoch s del evento"),
+    limit: int = Query(default=200, ge=1, le=5000),
+):
+    """
+    Alertas registradas en orden de `seq`. Sin `after` devuelve las `limit` más
+    recientes; con `after` = último seq visto, las siguientes (para reanudar tras
+    un reinicio: repetir con `after = last_seq` mientras `more` sea true).
+    """
+    rows = await asyncio.to_thread(alert_log.history, symbol, interval, stream, after, None, since, limit)
+    last = rows[-1]["seq"] if rows else after
+    return {"alerts": rows, "last_seq": last, "more": after is not None and len(rows) == limit}
+
+
+async def _alert_replay(tag: str, after: Optional[int]) -> List[str]:
+    """Frames de las alertas registradas de `tag` posteriores a `after` (mismo formato que en vivo)."""
+    if after is None:
+        return []
+    rows = await asyncio.to_thread(alert_log.history, None, None, tag, after, None, None, settings.ALERTS_REPLAY_MAX)
+    return [dumps({"type": "alert", "stream": tag, "replay": True,
+                   "payload": {k: v for k, v in r.items() if k not in ("tag", "candle_time")}}) for r in rows]
 
 
 # ============================
 # WebSocket: reenvío de push.kline
 # ============================
+async def _send(websocket: WebSocket, frame):
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
 @app.websocket("/ws/kline")
 async def ws_kline(
     websocket: WebSocket,
     symbol: str = settings.DEFAULT_SYMBOL,
     interval: str = settings.DEFAULT_INTERVAL,
+    policy: Optional[str] = None,
+    throttle_ms: int = 0,
+    indicators: bool = False,
+    format: Optional[str] = None,
+):
+    """
+    Reenvía push.kline del stream compartido. `throttle_ms` > 0 activa la
+    conflación: como mucho un frame por ventana para la vela en formación
+    (el cierre de vela se entrega siempre de inmediato).
+
+    Con `indicators=true` cada payload incluye `indicators` (campos de
+    indicators.FIELDS con los parámetros por defecto), calculados una sola vez
+    por stream y compartidos por todos los clientes que los piden.
+
+    Con `format=binary` los frames de vela van como mensajes binarios en el
+    formato columnar de wire.py (una fila; meta con type/stream).
+    """
+    await websocket.accept()
+    if policy is not None and policy not in POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of {', '.join(POLICIES)}")
+        return
+    if not 0 <= throttle_ms <= 60000:
+        await websocket.close(code=1008, reason="throttle_ms must be between 0 and 60000")
+        return
+    if interval not in INTERVAL_SEC:
+        await websocket.close(code=1008, reason=f"interval must be one of {', '.join(INTERVAL_SEC)}")
+        return
+    try:
+        stream = await hub.acquire(symbol, interval)
+    except StreamLimitError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+    q = stream.subscribe(policy, throttle_ms, indicators, format == "binary")
+
+    try:
+        while True:
+            await _send(websocket, await q.get())
+    except SlowConsumer as e:
+        await websocket.close(code=settings.SLOW_CONSUMER_CLOSE_CODE, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        stream.unsubscribe(q)
+        hub.release(stream)
+
+
+# ============================
+# WebSocket: libro de órdenes y operaciones
+# ============================
+@app.websocket("/ws/depth")
+async def ws_depth(
+    websocket: WebSocket,
+    symbol: str = settings.DEFAULT_SYMBOL,
+    top: int = settings.DEPTH_DEFAULT_TOP,
+    policy: Optional[str] = None,
+    throttle_ms: int = 0,
 ):
+    """
+    Top-N del libro de órdenes del contrato: cada frame es el snapshot completo
+    de los `top` mejores niveles por lado ({"bids": [[precio, cantidad], ...],
+    "asks": [...], "version", "ts"}). Un libro por símbolo compartido por todos
+    los clientes; como mucho un frame cada DEPTH_PUSH_MS, o cada `throttle_ms`.
+    """
     await websocket.accept()
-    stream = hub.get_or_create(symbol, interval)
-    await stream.start()
-    q = stream.subscribe()
+    if policy is not None and policy not in POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of {', '.join(POLICIES)}")
+        return
+    if not 0 <= throttle_ms <= 60000:
+        await websocket.close(code=1008, reason="throttle_ms must be between 0 and 60000")
+        return
+    if not 1 <= top <= settings.DEPTH_MAX_TOP:
+        await websocket.close(code=1008, reason=f"top must be between 1 and {settings.DEPTH_MAX_TOP}")
+        return
+    try:
+        stream = await hub.acquire(symbol, DEPTH)
+    except StreamLimitError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+    q = stream.subscribe(policy, throttle_ms, top)
 
     try:
         while True:
-            msg = await q.get()
-            await websocket.send_json(msg)
+            await _send(websocket, await q.get())
+    except SlowConsumer as e:
+        await websocket.close(code=settings.SLOW_CONSUMER_CLOSE_CODE, reason=str(e))
     except WebSocketDisconnect:
         pass
     except Exception:
         pass
     finally:
         stream.unsubscribe(q)
+        hub.release(stream)
+
+
+@app.websocket("/ws/trades")
+async def ws_trades(
+    websocket: WebSocket,
+    symbol: str = settings.DEFAULT_SYMBOL,
+    policy: Optional[str] = None,
+    throttle_ms: int = 0,
+):
+    """
+    Operaciones del contrato ({"time" (ms), "price", "volume", "side"}): al
+    conectar, las últimas TRADES_HISTORY. Ninguna se descarta por conflación; con
+    `throttle_ms` > 0 se envía como mucho un frame por ventana con todas las
+    operaciones acumuladas.
+    """
+    await websocket.accept()
+    if policy is not None and policy not in POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of {', '.join(POLICIES)}")
+        return
+    if not 0 <= throttle_ms <= 60000:
+        await websocket.close(code=1008, reason="throttle_ms must be between 0 and 60000")
+        return
+    try:
+        stream = await hub.acquire(symbol, DEAL)
+    except StreamLimitError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+    q = stream.subscribe(policy)
+
+    try:
+        while True:
+            frames = [await q.get()]
+            while q.lag:
+                frames.append(await q.get())
+            await _send(websocket, stream.merge(frames))
+            if throttle_ms:
+                await asyncio.sleep(throttle_ms / 1000.0)
+    except SlowConsumer as e:
+        await websocket.close(code=settings.SLOW_CONSUMER_CLOSE_CODE, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        stream.unsubscribe(q)
+        hub.release(stream)
+
+
+# ============================
+# WebSocket: alertas (un motor por configuración, compartido)
+# ============================
+@app.websocket("/ws/alerts")
+async def ws_alerts(
+    websocket: WebSocket,
+    symbol: str = settings.DEFAULT_SYMBOL,
+    interval: str = settings.DEFAULT_INTERVAL,
+    balance_threshold: float = 20.0,
+    enable_balance: bool = True,
+    enable_efm: bool = True,
+    enable_rebounds: bool = True,
+    enable_rebounds_late: bool = True,
+    policy: Optional[str] = None,
+    after: Optional[int] = None,
+):
+    """
+    Alertas en vivo. Con `after` (último `seq` recibido) se reenvían antes las
+    registradas desde entonces; puede repetirse alguna ya en cola: deduplicar por `seq`.
+    """
+    await websocket.accept()
+    if policy is not None and policy not in POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of {', '.join(POLICIES)}")
+        return
+    if interval not in INTERVAL_SEC:
+        await websocket.close(code=1008, reason=f"interval must be one of {', '.join(INTERVAL_SEC)}")
+        return
+    cfg = EngineConfig(symbol, interval, balance_threshold, enable_balance,
+                       enable_efm, enable_rebounds, enable_rebounds_late)
+    q = Subscriber(settings.CLIENT_QUEUE_MAX, policy or settings.SLOW_CONSUMER_POLICY)
+    try:
+        tag = await alerts_hub.subscribe(cfg, q)
+    except StreamLimitError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+
+    try:
+        for frame in await _alert_replay(tag, after):
+            await _send(websocket, frame)
+        while True:
+            await _send(websocket, await q.get())
+    except SlowConsumer as e:
+        await websocket.close(code=settings.SLOW_CONSUMER_CLOSE_CODE, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        alerts_hub.unsubscribe(cfg, q)
+
+
+# ============================
+# WebSocket multiplexado: varias suscripciones por conexión
+# ============================
+def _flag(m: Dict[str, Any], name: str, default: bool) -> bool:
+    """Booleano JSON estricto: "false", 0 o null no valen (bool("false") sería True)."""
+    v = m.get(name, default)
+    if not isinstance(v, bool):
+        raise ValueError(f"{name} must be true or false")
+    return v
+
+
+def _alerts_config(m: Dict[str, Any]) -> EngineConfig:
+    return EngineConfig(
+        m["symbol"], m["interval"], float(m.get("balance_threshold", 20.0)),
+        _flag(m, "enable_balance", True), _flag(m, "enable_efm", True),
+        _flag(m, "enable_rebounds", True), _flag(m, "enable_rebounds_late", True),
+    )
+
+
+@app.websocket("/ws/stream")
+async def ws_stream(
+    websocket: WebSocket,
+    policy: Optional[str] = None,
+    throttle_ms: int = 0,
+    format: Optional[str] = None,
+):
+    """
+    Una sola conexión para muchos (symbol, interval) y canales kline/alerts.
+
+    Cliente → {"op": "subscribe" | "unsubscribe", "channel": "kline" | "alerts",
+               "symbol": ..., "interval": ..., ["indicators": true (kline)],
+               [parámetros de alertas], ["after": seq (alerts, reenvío)]}
+    Servidor → frames con "stream" (p. ej. "kline:DOGE_USDT:Min1"), más
+               {"type": "subscribed" | "unsubscribed" | "error", ...}.
+    Todas las suscripciones comparten un único buffer acotado por conexión.
+    Con `format=binary` las velas van en binario columnar (el resto sigue en JSON).
+    """
+    await websocket.accept()
+    if policy is not None and policy not in POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of {', '.join(POLICIES)}")
+        return
+    if not 0 <= throttle_ms <= 60000:
+        await websocket.close(code=1008, reason="throttle_ms must be between 0 and 60000")
+        return
+
+    q = Subscriber(settings.CLIENT_QUEUE_MAX, policy or settings.SLOW_CONSUMER_POLICY, throttle_ms)
+    kline_subs: Dict[str, Any] = {}                  # tag -> KlineStreamer
+    alert_subs: Dict[tuple, Tuple[str, EngineConfig]] = {}  # cfg.key() -> (tag, cfg)
+
+    def reply(msg: Dict[str, Any]):
+        q.put(dumps(msg))
+
+    async def handle(m: Dict[str, Any]):
+        op, channel = m.get("op"), m.get("channel", "kline")
+        if op not in ("subscribe", "unsubscribe") or channel not in ("kline", "alerts"):
+            return reply({"type": "error", "error": "op must be subscribe|unsubscribe, channel kline|alerts", "request": m})
+        if not m.get("symbol") or not m.get("interval"):
+            return reply({"type": "error", "error": "symbol and interval are required", "request": m})
+        if m["interval"] not in INTERVAL_SEC:
+            return reply({"type": "error", "error": "unknown interval", "request": m})
+
+        if channel == "kline":
+            tag = f"kline:{m['symbol']}:{m['interval']}"
+            if op == "subscribe":
+                if tag not in kline_subs:
+                    if len(kline_subs) + len(alert_subs) >= settings.MUX_MAX_SUBSCRIPTIONS:
+                        return reply({"type": "error", "error": "too many subscriptions", "stream": tag})
+                    indicators = _flag(m, "indicators", False)
+                    stream = await hub.acquire(m["symbol"], m["interval"])
+                    stream.attach(q, indicators, format == "binary")
+                    kline_subs[tag] = stream
+                return reply({"type": "subscribed", "stream": tag})
+            stream = kline_subs.pop(tag, None)
+            if stream is not None:
+                stream.unsubscribe(q)
+                hub.release(stream)
+                q.forget(tag)
+            return reply({"type": "unsubscribed", "stream": tag})
+
+        cfg = _alerts_config(m)
+        if op == "subscribe":
+            if cfg.key() not in alert_subs:
+                if len(kline_subs) + len(alert_subs) >= settings.MUX_MAX_SUBSCRIPTIONS:
+                    return reply({"type": "error", "error": "too many subscriptions", "request": m})
+                alert_subs[cfg.key()] = (await alerts_hub.subscribe(cfg, q), cfg)
+            tag = alert_subs[cfg.key()][0]
+            reply({"type": "subscribed", "stream": tag})
+            for frame in await _alert_replay(tag, int(m["after"]) if m.get("after") is not None else None):
+                q.put(frame)
+            return
+        entry = alert_subs.pop(cfg.key(), None)
+        if entry is not None:
+            alerts_hub.unsubscribe(entry[1], q)
+        return reply({"type": "unsubscribed", "stream": entry[0] if entry else None})
+
+    async def reader():
+        while True:
+            try:
+                m = await websocket.receive_json()
+            except (ValueError, KeyError):
+                reply({"type": "error", "error": "invalid JSON"})
+                continue
+            try:
+                await handle(m if isinstance(m, dict) else {})
+            except StreamLimitError as e:
+                reply({"type": "error", "error": str(e), "request": m})
+            except (TypeError, ValueError) as e:
+                reply({"type": "error", "error": str(e), "request": m})
+
+    async def writer():
+        while True:
+            await _send(websocket, await q.get())
+
+    tasks = [asyncio.create_task(reader()), asyncio.create_task(writer())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            if isinstance(t.exception(), SlowConsumer):
+                await websocket.close(code=settings.SLOW_CONSUMER_CLOSE_CODE, reason=str(t.exception()))
+    except Exception:
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+        for stream in kline_subs.values():
+            stream.unsubscribe(q)
+            hub.release(stream)
+        for _, cfg in alert_subs.values():
+            alerts_hub.unsubscribe(cfg, q)
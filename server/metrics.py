@@ -0,0 +1,215 @@
+"""
+Métricas en formato de exposición de Prometheus (texto 0.0.4), sin dependencias.
+
+Counter / Gauge / Histogram con etiquetas; cada observación es una suma en un
+dict (barata en el hot path). Lo que ya existe como estado (profundidad de las
+colas, descartes de cada Subscriber...) se lee al hacer scrape mediante
+colectores registrados con `registry.collector(fn)`.
+"""
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+# Buckets por defecto (segundos): de 50 µs a 10 s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v == -math.inf:
+        return "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def labels(self, *labels: str) -> "_CounterChild":
+        """Serie fija para el hot path: evita rearmar la tupla de etiquetas en cada inc()."""
+        self.values.setdefault(labels, 0.0)
+        return _CounterChild(self.values, labels)
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}"
+                                for k, v in self.values.items()]
+
+
+class _CounterChild:
+    __slots__ = ("values", "key")
+
+    def __init__(self, values: Dict[Labels, float], key: Labels):
+        self.values = values
+        self.key = key
+
+    def inc(self, amount: float = 1.0):
+        self.values[self.key] += amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float):
+        self.values[labels] = value
+
+    def remove(self, *labels: str):
+        self.values.pop(labels, None)
+
+
+class _Series:
+    """Una serie de un histograma: conteos por bucket (+Inf al final) y suma."""
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Labels, _Series] = {}
+
+    def labels(self, *labels: str) -> _Series:
+        """Serie fija para el hot path (observe() directo, sin buscar por etiquetas)."""
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = _Series(self.buckets)
+        return series
+
+    def observe(self, value: float, *labels: str):
+        self.labels(*labels).observe(value)
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, series in self.series.items():
+            acc = 0
+            for le, c in zip(self.buckets + (math.inf,), series.counts):
+                acc += c
+                le_label = 'le="%s"' % _fmt(le)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_fmt(series.sum)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[_Metric]]):
+        """fn() devuelve métricas generadas en el momento del scrape."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        for fn in self.collectors:
+            for m in fn():
+                lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, doc, labels))
+
+
+def histogram(name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, doc, labels, buckets))
+
+
+# ============================
+# Métricas del proxy
+# ============================
+STREAM = ("symbol", "interval")
+
+upstream_messages = counter("mexc_upstream_messages_total", "Mensajes push de MEXC por stream (kline, depth, deal)", STREAM)
+upstream_parse = histogram("mexc_upstream_parse_seconds", "Decodificación y normalización de un push.kline", STREAM)
+upstream_lag = histogram("mexc_upstream_lag_seconds", "Retraso exchange -> proxy (ts del push frente a la recepción)",
+                         buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+upstream_gaps = counter("mexc_upstream_gaps_total", "Huecos detectados en un stream (reconexión o salto de velas)", STREAM)
+upstream_backfilled = counter("mexc_upstream_backfilled_total", "Velas recuperadas por REST al rellenar huecos", STREAM)
+upstream_out_of_order = counter("mexc_upstream_out_of_order_total", "Velas descartadas por llegar con un tiempo anterior", STREAM)
+depth_resyncs = counter("mexc_depth_resyncs_total", "Snapshots REST pedidos para (re)sincronizar un libro de órdenes", ("symbol",))
+upstream_reconnects = counter("mexc_upstream_reconnects_total", "Reconexiones de cada conexión upstream", ("conn",))
+upstream_connected = gauge("mexc_upstream_connected", "1 si la conexión upstream está abierta", ("conn",))
+upstream_backoff = gauge("mexc_upstream_backoff_seconds", "Espera actual antes de reconectar", ("conn",))
+
+broadcast_seconds = histogram("mexc_broadcast_seconds", "Serialización y reparto de un frame a los clientes del stream", STREAM)
+# conflated = sustituido por una versión más nueva, dropped = drop_oldest, disconnect = cliente expulsado
+client_frames_lost = counter("mexc_client_frames_lost_total", "Frames que no llegaron a enviarse a un cliente", ("reason",))
+
+klines_fetch = histogram("mexc_klines_fetch_seconds", "Obtención de velas por origen (upstream = REST de MEXC, cache = store local)",
+                         ("source",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+alerts_eval = histogram("mexc_alerts_eval_seconds", "AlertsEngine.on_closed_candle por vela", ("interval",))
+
+notify_messages = counter("mexc_notify_messages_total", "Mensajes a Telegram por resultado (sent | failed | retried)", ("result",))
+notify_coalesced = counter("mexc_notify_alerts_total", "Alertas entregadas dentro de mensajes de Telegram (agrupadas)")
+notify_pending = gauge("mexc_notify_pending", "Alertas en cola de envío por chat", ("chat",))
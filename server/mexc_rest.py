@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Any, Optional
+
+import httpx
+
+from settings import settings
+from fanout import dumps
+from order_book import parse_levels
+import metrics
+
+log = logging.getLogger("rest")
+
+# Duración de cada intervalo de MEXC Futures en segundos
+INTERVAL_SEC: Dict[str, int] = {
+    "Min1": 60, "Min5": 300, "Min15": 900, "Min30": 1800, "Min60": 3600,
+    "Hour4": 14400, "Hour8": 28800, "Day1": 86400, "Week1": 604800, "Month1": 2592000
+}
+
+
+def interval_sec(interval: str) -> int:
+    return INTERVAL_SEC.get(interval, 60)
+
+
+# ============================
+# Cliente HTTP compartido (pool de conexiones, HTTP/2 si hay `h2`)
+# ============================
+_client: Optional[httpx.AsyncClient] = None
+
+
+def client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        try:
+            import h2  # noqa: F401  (httpx[http2])
+            http2 = settings.MEXC_HTTP2
+        except ImportError:
+            http2 = False
+        _client = httpx.AsyncClient(
+            base_url=settings.MEXC_REST_BASE,
+            http2=http2,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=settings.REST_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.REST_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+async def request(path: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """GET con reintentos y backoff exponencial (con jitter) ante errores de red, 429 y 5xx."""
+    attempt = 0
+    while True:
+        try:
+            r = await client().get(path, params=params, headers=headers)
+            if r.status_code == 304:
+                return r
+            if r.status_code not in _RETRY_STATUS:
+                r.raise_for_status()
+                return r
+            err: Exception = httpx.HTTPStatusError(f"{r.status_code} from MEXC", request=r.request, response=r)
+        except httpx.TransportError as e:
+            err = e
+        attempt += 1
+        if attempt > settings.REST_RETRIES:
+            raise err
+        delay = min(settings.REST_BACKOFF_MAX_SEC, settings.REST_BACKOFF_SEC * 2 ** (attempt - 1))
+        delay *= 0.5 + random.random() / 2
+        log.warning(f"GET {path} failed ({err}); retry {attempt}/{settings.REST_RETRIES} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+# ============================
+# Single-flight: peticiones idénticas en vuelo comparten resultado
+# ============================
+class _Flight:
+    """Petición en vuelo: tarea desacoplada de quien la lanzó y nº de clientes esperándola."""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+_inflight: Dict[Hashable, _Flight] = {}
+
+
+async def single_flight(key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    La petición corre en una tarea propia compartida por todos los que la esperan:
+    si uno se cancela (p. ej. su cliente se desconecta) el resto sigue esperando;
+    solo se cancela cuando ya no queda nadie.
+    """
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = _inflight[key] = _Flight(asyncio.create_task(fn()))
+
+        def done(task: "asyncio.Task[Any]", flight: _Flight = flight):
+            if _inflight.get(key) is flight:
+                del _inflight[key]
+            if not task.cancelled():
+                task.exception()  # marcado como recuperado aunque nadie más espere
+        flight.task.add_done_callback(done)
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+
+
+# ============================
+# Velas
+# ============================
+def parse_klines(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Convierte los arrays paralelos de /contract/kline en candles normalizados
+    (formato lightweight-charts).
+    """
+    times = payload.get("time") or []
+    vols = payload.get("vol") or []
+    if len(vols) < len(times):
+        vols = list(vols) + [0.0] * (len(times) - len(vols))
+    rows = zip(times, payload.get("open") or [], payload.get("high") or [],
+               payload.get("low") or [], payload.get("close") or [], vols)
+    return [
+        {"time": int(t), "open": float(o), "high": float(h), "low": float(l),
+         "close": float(c), "volume": float(v)}
+        for t, o, h, l, c, v in rows
+    ]
+
+
+async def fetch_klines(symbol: str, interval: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    Descarga velas de MEXC Futures: /api/v1/contract/kline/{symbol}?interval=&start=&end=
+    (start/end en segundos epoch).
+    """
+    async def do() -> List[Dict[str, Any]]:
+        with metrics.klines_fetch.time("upstream"):
+            r = await request(f"/contract/kline/{symbol}", params={"interval": interval, "start": start, "end": end})
+            return parse_klines(r.json().get("data", {}))
+    return await single_flight(("kline", symbol, interval, start, end), do)
+
+
+# ============================
+# Libro de órdenes (snapshot para sincronizar los deltas de push.depth)
+# ============================
+async def fetch_depth(symbol: str, limit: int) -> Dict[str, Any]:
+    """/api/v1/contract/depth/{symbol}?limit= -> {"version", "bids", "asks", "ts"} con niveles (precio, cantidad)."""
+    async def do() -> Dict[str, Any]:
+        r = await request(f"/contract/depth/{symbol}", params={"limit": limit})
+        d = r.json().get("data") or {}
+        return {"version": int(d["version"]), "bids": parse_levels(d.get("bids")),
+                "asks": parse_levels(d.get("asks")), "ts": d.get("timestamp")}
+    return await single_flight(("depth", symbol, limit), do)
+
+
+# ============================
+# Contratos (caché TTL + stale-while-revalidate)
+# ============================
+def normalize_contracts(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Filtra contratos USDT aptos para API y los normaliza, ordenados por símbolo."""
+    out: List[Dict[str, Any]] = []
+    for it in data:
+        # Campos típicos: symbol, displayNameEn, baseCoin, quoteCoin, settleCoin, apiAllowed, priceScale, amountScale
+        if it.get("settleCoin") != "USDT":
+            continue
+        api_allowed = it.get("apiAllowed")
+        if api_allowed is not None and not api_allowed:
+            continue
+
+        out.append({
+            "symbol": it.get("symbol"),
+            "displayName": it.get("displayNameEn") or it.get("displayName") or it.get("symbol"),
+            "baseCoin": it.get("baseCoin"),
+            "quoteCoin": it.get("quoteCoin"),
+            "priceScale": it.get("priceScale"),
+            "amountScale": it.get("amountScale"),
+        })
+
+    # Orden alfabético por símbolo
+    out.sort(key=lambda x: (x.get("symbol") or ""))
+    return out
+
+
+class ContractsCache:
+    """
+    Caché de /contract/detail ya filtrado y serializado.
+
+    - Fresco (< CONTRACTS_TTL_SEC): se sirve tal cual.
+    - Caducado pero dentro de CONTRACTS_STALE_SEC: se sirve y se refresca en segundo plano.
+    - Sin datos o demasiado viejo: se espera al refresco (uno solo, compartido).
+    El ETag (hash del cuerpo) permite responder 304 a los clientes.
+    """
+    def __init__(self):
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0
+        self._upstream_etag: Optional[str] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    async def get(self) -> bytes:
+        age = self.age()
+        if self.body is not None and age < settings.CONTRACTS_TTL_SEC:
+            return self.body
+        if self.body is not None and age < settings.CONTRACTS_TTL_SEC + settings.CONTRACTS_STALE_SEC:
+            self._refresh_background()
+            return self.body
+        await single_flight("contracts", self._refresh)
+        return self.body
+
+    def _refresh_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_quiet())
+
+    async def _refresh_quiet(self):
+        try:
+            await single_flight("contracts", self._refresh)
+        except Exception as e:
+            log.warning(f"Contracts refresh failed, serving stale: {e}")
+
+    async def _refresh(self):
+        headers = {"If-None-Match": self._upstream_etag} if self._upstream_etag else None
+        r = await request("/contract/detail", headers=headers)
+        if r.status_code == 304 and self.body is not None:
+            self.fetched_at = time.time()
+            return
+        contracts = normalize_contracts(r.json().get("data", []))
+        body = dumps({"contracts": contracts}).encode()
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.fetched_at = time.time()
+        self._upstream_etag = r.headers.get("etag")
+
+
+contracts_cache = ContractsCache()
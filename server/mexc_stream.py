@@ -1,13 +1,25 @@
+import abc
 import asyncio
 import json
 import logging
 import time
-from typing import Dict, Tuple, Set, Optional
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Set, Optional
 
+import numpy as np
 import websockets
 from websockets.exceptions import ConnectionClosed
 
 from settings import settings
+from candle_store import BASE_INTERVAL, store, get_candles, is_resampled
+from backplane import backplane
+from fanout import Subscriber, dumps
+from indicators import IndicatorSet
+from upstream_codec import DEAL, DEPTH, KLINE_CHANNEL, MARKET_CHANNELS, decoder, sniff_channel
+from order_book import OrderBook, SequenceGap
+import wire
+import metrics
+from mexc_rest import fetch_depth, fetch_klines, interval_sec
 
 # Configuración de logging básica
 logging.basicConfig(
@@ -20,20 +32,806 @@ log = logging.getLogger("mexc")
 StreamKey = Tuple[str, str]
 
 
-class KlineStreamer:
+class UpstreamStreamer(abc.ABC):
     """
-    Mantiene una conexión WebSocket con MEXC Futures para un (symbol, interval),
-    y hace broadcast de cada vela recibida a todos los suscriptores locales (colas asyncio).
+    Base de los streams lógicos de un contrato. No abren socket propio: se
+    suscriben (sub.<channel>) a través del UpstreamPool, o piden el stream al
+    líder por el backplane, y reparten lo recibido a sus Subscriber locales.
+    StreamHub los gestiona por (symbol, interval); en depth y trades el
+    "intervalo" es el canal (DEPTH, DEAL).
     """
-    def __init__(self, symbol: str, interval: str):
+    channel = "kline"
+
+    def __init__(self, symbol: str, interval: str, pool: "UpstreamPool", tag: str):
         self.symbol = symbol
         self.interval = interval
-        self.clients: Set[asyncio.Queue] = set()
+        self.pool = pool
+        # Etiqueta del stream en cada frame (conexiones multiplexadas)
+        self.tag = tag
+        self._key: StreamKey = (symbol, interval)
+        # Frame JSON = prefijo fijo + payload serializado (sin dict envoltorio)
+        self._json_prefix = dumps({"type": tag.split(":", 1)[0], "stream": tag})[:-1] + ',"payload":'
+        # Series de métricas de este stream (sin buscar por etiquetas en cada mensaje)
+        self._m_messages = metrics.upstream_messages.labels(symbol, interval)
+        self._m_parse = metrics.upstream_parse.labels(symbol, interval)
+        self._m_broadcast = metrics.broadcast_seconds.labels(symbol, interval)
+        self.clients: Set[Subscriber] = set()
+        self._active = False
+        # True si los datos llegan del proceso líder (backplane) y no de MEXC
+        self.remote = False
+        # Ciclo de vida (gestionado por StreamHub)
+        self.refs = 0
+        self.created_at = time.time()
+        self.idle_since: Optional[float] = None
+        self.msg_count = 0
+        self.last_msg_at: Optional[float] = None
+
+    def key(self) -> StreamKey:
+        return self._key
+
+    def sub_param(self) -> Dict[str, Any]:
+        """`param` de sub.<channel> / unsub.<channel>."""
+        return {"symbol": self.symbol}
+
+    async def start(self):
+        if self._active:
+            return
+        self._active = True
+        await self._attach_source()
+
+    async def _attach_source(self):
+        # El líder se suscribe a MEXC; un seguidor pide el stream al líder
+        self.remote = not backplane.is_leader()
+        if self.remote:
+            await backplane.want(self.key())
+        else:
+            await self.pool.subscribe(self)
+
+    async def _detach_source(self):
+        if self.remote:
+            await backplane.unwant(self.key())
+        else:
+            await self.pool.unsubscribe(self)
+
+    async def rehome(self):
+        """Tras un cambio de rol en el backplane, cambia el origen de los datos."""
+        if self._active and self.remote == backplane.is_leader():
+            await self._detach_source()
+            await self._attach_source()
+            self.mark_resync()
+
+    async def stop(self):
+        if not self._active:
+            return
+        self._active = False
+        await self._detach_source()
+
+    def attach(self, sub: Subscriber):
+        self.clients.add(sub)
+
+    def unsubscribe(self, sub: Subscriber):
+        self.clients.discard(sub)
+
+    def mark_resync(self):
+        """El origen se ha reabierto (reconexión, cambio de líder)."""
+
+    @abc.abstractmethod
+    async def ingest(self, payload: dict):
+        """Procesa un mensaje ya normalizado (de MEXC o del líder) y lo reparte a los clientes."""
+
+    async def on_message(self, payload: dict, t0: Optional[float] = None):
+        """
+        Mensaje de depth/trades ya normalizado (upstream_codec). El líder lo reenvía
+        tal cual a los workers que siguen el stream: cada uno hace su propia
+        sincronización (las velas, en cambio, entran por KlineStreamer.on_kline).
+        """
+        self.msg_count += 1
+        self.last_msg_at = time.time()
+        self._m_messages.inc()
+        if t0 is not None:
+            self._m_parse.observe(time.perf_counter() - t0)
+        await self.ingest(payload)
+        if backplane.has_remote(self._key):
+            await backplane.publish(self._key, payload)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "refs": self.refs,
+            "source": "backplane" if self.remote else "upstream",
+            "clients": len(self.clients),
+            "subscribers": [sub.stats() for sub in self.clients],
+            "messages": self.msg_count,
+            "age_sec": round(now - self.created_at, 1),
+            "idle_sec": round(now - self.idle_since, 1) if self.idle_since else None,
+            "last_msg_age_sec": round(now - self.last_msg_at, 1) if self.last_msg_at else None,
+        }
+
+
+class KlineStreamer(UpstreamStreamer):
+    """
+    Stream lógico de velas para un (symbol, interval). Hace broadcast de cada vela
+    recibida a todos los suscriptores locales: el mensaje se serializa una sola
+    vez y el mismo frame va al buffer de cada cliente.
+    """
+    def __init__(self, symbol: str, interval: str, pool: "UpstreamPool"):
+        super().__init__(symbol, interval, pool, f"kline:{symbol}:{interval}")
+        # Suscriptores que reciben también los indicadores (subconjunto de clients)
+        self.ind_clients: Set[Subscriber] = set()
+        # Suscriptores con frames binarios columnares (wire.py)
+        self.bin_clients: Set[Subscriber] = set()
+        # Estado incremental de indicadores: uno por stream, compartido por todos los clientes
+        self.indicators: Optional[IndicatorSet] = None
+        self._ind_ready = False
+        self._ind_pending: List[dict] = []
+        self._ind_last_t: Optional[int] = None
+        self._ind_task: Optional[asyncio.Task] = None
+        # Callbacks síncronos invocados con cada vela cerrada (p. ej. alertas)
+        self.close_listeners: List[Callable[[dict], None]] = []
+        # Callbacks async invocados con cada actualización (p. ej. intervalos derivados)
+        self.kline_listeners: List[Callable[[dict], Awaitable[None]]] = []
+        # Continuidad: última vela publicada; los huecos se rellenan por REST antes de seguir
+        self.last_time: Optional[int] = None
+        self._last: Optional[dict] = None
+        self._resync = False
+        self._backfill_task: Optional[asyncio.Task] = None
+        self._held: Dict[int, dict] = {}   # velas en vivo retenidas durante un backfill (última versión)
+        self.gaps = 0
+        self.backfilled = 0
+        self.out_of_order = 0
+
+    def sub_param(self) -> Dict[str, Any]:
+        return {"symbol": self.symbol, "interval": self.interval}
+
+    async def start(self):
+        if not self._active and self.last_time is None:
+            # Tras un reinicio la primera vela en vivo se compara con la última
+            # guardada: lo que cerró mientras el proceso estaba parado se rellena
+            self.last_time = await store.last_time(self.symbol, self.interval)
+        await super().start()
+
+    async def stop(self):
+        if not self._active:
+            return
+        self._active = False
+        if self._ind_task is not None and not self._ind_task.done():
+            self._ind_task.cancel()
+        if self._backfill_task is not None:
+            self._backfill_task.cancel()
+            self._backfill_task = None
+        self._held.clear()
+        await self._detach_source()
+
+    def subscribe(self, policy: Optional[str] = None, throttle_ms: int = 0,
+                  indicators: bool = False, binary: bool = False) -> Subscriber:
+        sub = Subscriber(settings.CLIENT_QUEUE_MAX, policy or settings.SLOW_CONSUMER_POLICY, throttle_ms)
+        self.attach(sub, indicators, binary)
+        return sub
+
+    def attach(self, sub: Subscriber, indicators: bool = False, binary: bool = False):
+        """Añade un Subscriber existente (compartido entre varios streams)."""
+        self.clients.add(sub)
+        if indicators:
+            self.ind_clients.add(sub)
+            self._ensure_indicators()
+        if binary:
+            self.bin_clients.add(sub)
+
+    def unsubscribe(self, sub: Subscriber):
+        self.clients.discard(sub)
+        self.ind_clients.discard(sub)
+        self.bin_clients.discard(sub)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            **super().stats(now),
+            "indicator_clients": len(self.ind_clients),
+            "binary_clients": len(self.bin_clients),
+            "listeners": len(self.close_listeners),
+            "gaps": self.gaps,
+            "backfilled": self.backfilled,
+            "out_of_order": self.out_of_order,
+        }
+
+    # ---------- indicadores ----------
+    def _ensure_indicators(self):
+        if self.indicators is None:
+            self.indicators = IndicatorSet()
+            self._ind_task = asyncio.create_task(self._seed_indicators())
+
+    async def _seed_indicators(self):
+        """Calienta los indicadores con histórico cerrado; los cierres que llegan mientras, se encolan."""
+        step = interval_sec(self.interval)
+        now = int(time.time())
+        try:
+            candles = await get_candles(self.symbol, self.interval, now - settings.INDICATORS_WARMUP_BARS * step, now)
+        except Exception as e:
+            log.warning(f"Indicators seed failed {self.symbol} {self.interval}: {e}")
+            candles = []
+        for c in candles:
+            if c["time"] + step <= now:
+                self._feed_indicators(c)
+        self._ind_ready = True
+        pending, self._ind_pending = self._ind_pending, []
+        for c in pending:
+            self._feed_indicators(c)
+
+    def _feed_indicators(self, candle: dict):
+        if self._ind_last_t is not None and candle["time"] <= self._ind_last_t:
+            return
+        self._ind_last_t = candle["time"]
+        self.indicators.update(candle)
+
+    def add_close_listener(self, cb: Callable[[dict], None]):
+        self.close_listeners.append(cb)
+
+    def remove_close_listener(self, cb: Callable[[dict], None]):
+        if cb in self.close_listeners:
+            self.close_listeners.remove(cb)
+
+    def add_kline_listener(self, cb: Callable[[dict], Awaitable[None]]):
+        self.kline_listeners.append(cb)
+
+    def remove_kline_listener(self, cb: Callable[[dict], Awaitable[None]]):
+        if cb in self.kline_listeners:
+            self.kline_listeners.remove(cb)
+
+    def _emit_closed(self, candle: dict):
+        for cb in list(self.close_listeners):
+            try:
+                cb(candle)
+            except Exception as e:
+                log.exception(f"Close listener error {self.symbol} {self.interval}: {e}")
+
+    async def broadcast(self, candle: dict, key: Any = None, ind: Optional[dict] = None):
+        """
+        Un frame por variante (JSON/binario × con/sin indicadores) y se crea solo
+        si algún cliente la usa; nunca uno por cliente.
+        """
+        if not self.clients:
+            return
+        t0 = time.perf_counter()
+        if not self.ind_clients and not self.bin_clients:
+            # Caso común: todos en JSON sin indicadores, un único frame
+            frame = self._json_prefix + dumps(candle) + "}"
+            for sub in self.clients:
+                sub.put(frame, key)
+        else:
+            frames: Dict[Tuple[bool, bool], Any] = {}
+            for sub in self.clients:
+                variant = (ind is not None and sub in self.ind_clients, sub in self.bin_clients)
+                frame = frames.get(variant)
+                if frame is None:
+                    payload = {**candle, "indicators": ind} if variant[0] else candle
+                    if variant[1]:
+                        frame = self._binary({"type": "kline", "stream": self.tag, "payload": payload})
+                    else:
+                        frame = self._json_prefix + dumps(payload) + "}"
+                    frames[variant] = frame
+                sub.put(frame, key)
+        self._m_broadcast.observe(time.perf_counter() - t0)
+
+    @staticmethod
+    def _binary(msg: dict) -> bytes:
+        """Frame de vela en formato columnar de una fila (indicadores como columnas extra)."""
+        p = msg["payload"]
+        cols = {k: [p[k]] for k in ("time", "open", "high", "low", "close", "volume")}
+        for k, v in (p.get("indicators") or {}).items():
+            cols[k] = [float("nan") if v is None else v]
+        meta = {"type": msg["type"], "stream": msg["stream"], "symbol": p["symbol"], "interval": p["interval"]}
+        return wire.encode({k: np.asarray(v) for k, v in cols.items()}, meta, delta=False)
+
+    async def on_kline(self, candle: dict, t0: Optional[float] = None):
+        """
+        Vela ya normalizada (upstream_codec) de un push.kline enrutado por la conexión
+        upstream. `t0` (perf_counter al recibir el frame) mide la decodificación completa.
+        """
+        self.msg_count += 1
+        self.last_msg_at = time.time()
+        self._m_messages.inc()
+        if t0 is not None:
+            self._m_parse.observe(time.perf_counter() - t0)
+        await self.ingest(candle)
+
+    # ---------- continuidad (huecos y desorden) ----------
+    def mark_resync(self):
+        """El origen se ha reabierto (reconexión, cambio de líder): la próxima vela revisa el hueco."""
+        self._resync = True
+
+    async def ingest(self, candle: dict):
+        """
+        Entrada de velas en vivo (upstream o backplane). Descarta las anteriores a la
+        última publicada y, si falta alguna vela entre medias (o el origen se acaba de
+        reabrir), rellena el hueco por REST: mientras tanto se retienen las velas en
+        vivo y se publican después, en orden y sin duplicados.
+        """
+        t = candle["time"]
+        if self._backfill_task is not None:
+            self._held[t] = candle
+            return
+        last = self.last_time
+        if last is not None:
+            if t < last:
+                self.out_of_order += 1
+                metrics.upstream_out_of_order.inc(self.symbol, self.interval)
+                return
+            if t > last + interval_sec(self.interval) or (self._resync and t > last):
+                self._resync = False
+                self._held[t] = candle
+                self._backfill_task = asyncio.create_task(self._backfill(last, t))
+                return
+        self._resync = False
+        await self._emit(candle)
+
+    async def _backfill(self, since: int, until: int):
+        """Velas [since, until) por REST: `since` se vuelve a pedir para tener su cierre definitivo."""
+        step = interval_sec(self.interval)
+        start = max(since, until - settings.BACKFILL_MAX_BARS * step)
+        self.gaps += 1
+        metrics.upstream_gaps.inc(self.symbol, self.interval)
+        emitted = 0
+        try:
+            try:
+                bars = await fetch_klines(self.symbol, self.interval, start, until - step)
+            except Exception as e:
+                log.warning(f"Backfill failed {self.symbol} {self.interval} [{since}, {until}): {e}")
+                bars = []
+            for bar in sorted(bars, key=lambda b: b["time"]):
+                if not since <= bar["time"] < until or not self._is_new(bar):
+                    continue
+                await self._emit({"symbol": self.symbol, "interval": self.interval, **bar})
+                emitted += 1
+            if emitted:
+                log.info(f"Backfilled {emitted} bars {self.symbol} {self.interval} [{since}, {until})")
+        finally:
+            self._backfill_task = None
+            self.backfilled += emitted
+            metrics.upstream_backfilled.inc(self.symbol, self.interval, amount=emitted)
+            held, self._held = self._held, {}
+            for t in sorted(held):
+                if self._is_new(held[t]):
+                    await self._emit(held[t])
+
+    def _is_new(self, candle: dict) -> bool:
+        """Posterior a la última publicada, o la misma vela con valores distintos."""
+        last = self._last
+        if last is None or candle["time"] > last["time"]:
+            return True
+        return candle["time"] == last["time"] and any(candle[k] != last[k] for k in
+                                                      ("open", "high", "low", "close", "volume"))
+
+    async def _emit(self, candle: dict):
+        self.last_time = candle["time"]
+        self._last = candle
+        await self.publish(candle)
+        # Líder: reparte la vela normalizada a los workers que siguen este stream
+        if backplane.has_remote(self._key):
+            await backplane.publish(self._key, candle)
+
+    async def publish(self, candle: dict, persist: bool = True):
+        """Registra la vela en formación y la reparte (clientes, cierres, listeners)."""
+        # Vela en formación al store (persiste la anterior al cerrarse)
+        closed = store.on_live(self.symbol, self.interval, candle, persist)
+        if closed is not None:
+            if self.indicators is not None:
+                if self._ind_ready:
+                    self._feed_indicators(closed)
+                else:
+                    self._ind_pending.append(closed)
+            self._emit_closed(closed)
+
+        ind = None
+        if self.ind_clients and self._ind_ready:
+            # Valores de la vela en formación sobre el estado ya consolidado
+            ind = self.indicators.update(candle, closed=False)
+        await self.broadcast(candle, (self.tag, candle["time"]), ind)
+
+        for cb in list(self.kline_listeners):
+            try:
+                await cb(candle)
+            except Exception as e:
+                log.exception(f"Kline listener error {self.symbol} {self.interval}: {e}")
+
+
+# ============================
+# Intervalos derivados de Min1
+# ============================
+def _merge(acc: Optional[dict], c: dict) -> dict:
+    if acc is None:
+        return {k: c[k] for k in ("time", "open", "high", "low", "close", "volume")}
+    return {"time": acc["time"], "open": acc["open"], "high": max(acc["high"], c["high"]),
+            "low": min(acc["low"], c["low"]), "close": c["close"], "volume": acc["volume"] + c["volume"]}
+
+
+class Resampler:
+    """
+    Agrega velas Min1 (en formación o cerradas) en velas de `step` segundos.
+    Guarda el agregado de los Min1 ya cerrados del bucket y la Min1 en curso,
+    así cada actualización cuesta O(1).
+    """
+    def __init__(self, step: int):
+        self.step = step
+        self.base: Optional[dict] = None   # Min1 cerrados del bucket actual
+        self.cur: Optional[dict] = None    # Min1 en formación
+        self.bar: Optional[dict] = None    # vela agregada actual
+        self.count = 0                     # Min1 distintos en el bucket actual
+
+    def complete(self) -> bool:
+        """El bucket actual tiene todos sus Min1."""
+        return self.count >= self.step // 60
+
+    def on_min1(self, c: dict) -> Optional[dict]:
+        """Aplica una actualización Min1; devuelve la vela agregada o None si llega desordenada."""
+        bucket = (c["time"] // self.step) * self.step
+        if self.bar is not None:
+            if bucket < self.bar["time"]:
+                return None
+            if bucket > self.bar["time"]:
+                self.base = self.cur = None
+                self.count = 0
+        if self.cur is not None:
+            if c["time"] < self.cur["time"]:
+                return None
+            if c["time"] > self.cur["time"]:
+                self.base = _merge(self.base, self.cur)
+        if self.cur is None or c["time"] > self.cur["time"]:
+            self.count += 1
+        self.cur = c
+        bar = _merge(self.base, c)
+        bar["time"] = bucket
+        self.bar = bar
+        return bar
+
+
+class DerivedStreamer(KlineStreamer):
+    """
+    Stream de un intervalo múltiplo de Min1 (RESAMPLE_INTERVALS) sin suscripción
+    upstream propia: escucha el KlineStreamer Min1 del símbolo y agrega cada
+    actualización. Al arrancar siembra el bucket en curso con el Min1 guardado.
+    Si un bucket cierra sin todos sus Min1, la vela nativa se pide en segundo plano
+    (_repair_task) y lo que llega mientras tanto se retiene en `_backlog` para
+    publicarlo después en orden: el listener Min1 nunca espera a la REST.
+    """
+    def __init__(self, symbol: str, interval: str, pool: "UpstreamPool", hub: "StreamHub"):
+        super().__init__(symbol, interval, pool)
+        self.hub = hub
+        self.source: Optional[KlineStreamer] = None
+        self.resampler = Resampler(interval_sec(interval))
+        self._seeded = False
+        self._pending: List[dict] = []
+        self._seed_task: Optional[asyncio.Task] = None
+        # (vela, reparar): True = bucket incompleto a sustituir por la vela nativa
+        self._backlog: deque = deque()
+        self._repair_task: Optional[asyncio.Task] = None
+        self.incomplete = 0
+
+    async def start(self):
+        if self._active:
+            return
+        # Antes de esperar: un segundo start concurrente no debe adquirir otra vez el Min1
+        self._active = True
+        try:
+            source = await self.hub.acquire(self.symbol, BASE_INTERVAL)
+        except BaseException:
+            self._active = False
+            raise
+        if not self._active:
+            # Parado mientras se esperaba el Min1
+            self.hub.release(source)
+            return
+        self.source = source
+        self._seeded = False
+        self.source.add_kline_listener(self.on_min1)
+        self._seed_task = asyncio.create_task(self._seed())
+
+    async def stop(self):
+        if not self._active:
+            return
+        self._active = False
+        for task in (self._ind_task, self._seed_task, self._repair_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self._backlog.clear()
+        if self.source is not None:
+            self.source.remove_kline_listener(self.on_min1)
+            self.hub.release(self.source)
+            self.source = None
+
+    async def rehome(self):
+        # El origen es el stream Min1 local, que ya cambia de origen por su cuenta
+        return
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        st = super().stats(now)
+        if self.source is not None:
+            st["source"] = self.source.tag
+        st["incomplete_buckets"] = self.incomplete
+        st["repair_backlog"] = len(self._backlog)
+        return st
+
+    async def _seed(self):
+        now = int(time.time())
+        bucket = (now // self.resampler.step) * self.resampler.step
+        try:
+            rows = await get_candles(self.symbol, BASE_INTERVAL, bucket, now)
+        except Exception as e:
+            log.warning(f"Resampler seed failed {self.symbol} {self.interval}: {e}")
+            rows = []
+        for c in rows:
+            self.resampler.on_min1(c)
+        self._seeded = True
+        pending, self._pending = self._pending, []
+        for c in pending:
+            await self.on_min1(c)
+
+    async def _repair(self, bar: dict):
+        """
+        El bucket `bar` cerró sin todos sus Min1: se publica la vela nativa del
+        intervalo (si MEXC la da) antes que las del bucket siguiente, así cierres,
+        alertas e indicadores no ven un OHLCV incompleto.
+        """
+        try:
+            rows = await fetch_klines(self.symbol, self.interval, bar["time"], bar["time"])
+        except Exception as e:
+            log.warning(f"Native bar for incomplete bucket failed {self.symbol} {self.interval} {bar['time']}: {e}")
+            return
+        native = next((r for r in rows if r["time"] == bar["time"]), None)
+        if native is not None:
+            await self.publish({"symbol": self.symbol, "interval": self.interval, **native}, persist=False)
+
+    async def _drain(self):
+        """Repara los buckets incompletos y publica lo retenido, en orden de llegada."""
+        try:
+            while self._backlog:
+                bar, repair = self._backlog.popleft()
+                if repair:
+                    await self._repair(bar)
+                else:
+                    await self.publish(bar, persist=False)
+        finally:
+            self._repair_task = None
+
+    async def on_min1(self, c: dict):
+        if not self._seeded:
+            self._pending.append(c)
+            return
+        prev, complete = self.resampler.bar, self.resampler.complete()
+        bar = self.resampler.on_min1(c)
+        if bar is None:
+            return
+        self.msg_count += 1
+        self.last_msg_at = time.time()
+        # Las velas derivadas no se persisten: el histórico se agrega desde Min1
+        out = {"symbol": self.symbol, "interval": self.interval, **bar}
+        if prev is not None and bar["time"] > prev["time"] and not complete:
+            self.incomplete += 1
+            self._backlog.append((prev, True))
+        if self._backlog or self._repair_task is not None:
+            # Reparación en curso: solo hace falta la última actualización de cada bucket
+            if self._backlog and not self._backlog[-1][1] and self._backlog[-1][0]["time"] == out["time"]:
+                self._backlog[-1] = (out, False)
+            else:
+                self._backlog.append((out, False))
+            if self._repair_task is None:
+                self._repair_task = asyncio.create_task(self._drain())
+            return
+        await self.publish(out, persist=False)
+
+
+# ============================
+# Libro de órdenes y operaciones (push.depth / push.deal)
+# ============================
+class DepthStreamer(UpstreamStreamer):
+    """
+    Libro de órdenes de un contrato (sub.depth) en memoria: snapshot REST y deltas
+    con version consecutiva. Si falta un delta se vuelve a pedir el snapshot; los
+    que llegan mientras tanto se retienen y se aplican encima. Los clientes reciben
+    el top-N (cada uno el suyo, un frame por N distinto) como mucho cada
+    DEPTH_PUSH_MS, y con `throttle_ms` solo el último top de cada ventana.
+    """
+    channel = DEPTH
+
+    def __init__(self, symbol: str, pool: "UpstreamPool"):
+        super().__init__(symbol, DEPTH, pool, f"depth:{symbol}")
+        self.book = OrderBook(symbol, settings.DEPTH_MAX_LEVELS)
+        self.synced = False
+        self.tops: Dict[Subscriber, int] = {}
+        # Todos los frames del libro comparten clave: se fusionan en el buffer del cliente
+        self._frame_key = (self.tag, 0)
+        self._held: deque = deque(maxlen=settings.DEPTH_BUFFER_MAX)
+        self._sync_task: Optional[asyncio.Task] = None
+        self._flush: Optional[asyncio.TimerHandle] = None
+        self.resyncs = 0
+        self.gaps = 0
+
+    def sub_param(self) -> Dict[str, Any]:
+        # Sin agregar: cada delta con su version, para poder detectar huecos
+        return {"symbol": self.symbol, "compress": False}
+
+    def subscribe(self, policy: Optional[str] = None, throttle_ms: int = 0,
+                  top: int = settings.DEPTH_DEFAULT_TOP) -> Subscriber:
+        sub = Subscriber(settings.CLIENT_QUEUE_MAX, policy or settings.SLOW_CONSUMER_POLICY, throttle_ms)
+        self.attach(sub, top)
+        return sub
+
+    def attach(self, sub: Subscriber, top: int = settings.DEPTH_DEFAULT_TOP):
+        self.clients.add(sub)
+        self.tops[sub] = top
+        if self.synced:
+            sub.put(self._frame(top), self._frame_key)
+
+    def unsubscribe(self, sub: Subscriber):
+        self.clients.discard(sub)
+        self.tops.pop(sub, None)
+
+    async def stop(self):
+        if not self._active:
+            return
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        self.synced = False
+        self._held.clear()
+        await super().stop()
+
+    async def ingest(self, delta: dict):
+        if not self.synced:
+            self._hold(delta)
+            return
+        try:
+            if not self.book.apply(delta["bids"], delta["asks"], delta["version"], delta.get("ts")):
+                return
+        except SequenceGap as e:
+            log.warning(f"Depth gap, resyncing: {e}")
+            self.gaps += 1
+            metrics.upstream_gaps.inc(self.symbol, self.interval)
+            self.synced = False
+            self._hold(delta)
+            return
+        self._schedule_flush()
+
+    def _hold(self, delta: dict):
+        self._held.append(delta)
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync())
+
+    async def _sync(self):
+        """Snapshot REST + deltas retenidos; se repite (con espera creciente) hasta que encajan."""
+        delay = 0.5
+        try:
+            while True:
+                self.resyncs += 1
+                metrics.depth_resyncs.inc(self.symbol)
+                try:
+                    snap = await fetch_depth(self.symbol, settings.DEPTH_SNAPSHOT_LIMIT)
+                except Exception as e:
+                    log.warning(f"Depth snapshot failed {self.symbol}: {e}")
+                    snap = None
+                if snap is not None:
+                    self.book.load_snapshot(snap["bids"], snap["asks"], snap["version"], snap["ts"])
+                    held = list(self._held)
+                    self._held.clear()
+                    try:
+                        for i, d in enumerate(held):
+                            self.book.apply(d["bids"], d["asks"], d["version"], d.get("ts"))
+                    except SequenceGap:
+                        # Snapshot anterior al primer delta retenido (o hueco entre ellos): otro snapshot
+                        self._held.extend(held[i:])
+                    else:
+                        self.synced = True
+                        log.info(f"Depth synced {self.symbol} at version {self.book.version}")
+                        self._schedule_flush()
+                        return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+        finally:
+            self._sync_task = None
+
+    def _schedule_flush(self):
+        if self._flush is None and self.clients:
+            self._flush = asyncio.get_running_loop().call_later(settings.DEPTH_PUSH_MS / 1000.0, self._push)
+
+    def _frame(self, top: int) -> str:
+        return self._json_prefix + dumps(self.book.snapshot(top)) + "}"
+
+    def _push(self):
+        """Top-N actual a cada cliente: un frame por N distinto, no uno por cliente."""
+        self._flush = None
+        if not self.synced:
+            return
+        t0 = time.perf_counter()
+        frames: Dict[int, str] = {}
+        for sub, top in self.tops.items():
+            frame = frames.get(top)
+            if frame is None:
+                frame = frames[top] = self._frame(top)
+            sub.put(frame, self._frame_key)
+        self._m_broadcast.observe(time.perf_counter() - t0)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            **super().stats(now),
+            "synced": self.synced,
+            "version": self.book.version,
+            "levels": [len(self.book.bids), len(self.book.asks)],
+            "book_bytes": self.book.nbytes(),
+            "resyncs": self.resyncs,
+            "gaps": self.gaps,
+        }
+
+
+class TradeStreamer(UpstreamStreamer):
+    """
+    Operaciones de un contrato (sub.deal). Cada push se reparte tal cual (sin
+    fusionar: ninguna operación se pierde por conflación) y se guardan las
+    últimas TRADES_HISTORY para quien se conecta después.
+    """
+    channel = DEAL
+
+    def __init__(self, symbol: str, pool: "UpstreamPool"):
+        super().__init__(symbol, DEAL, pool, f"trades:{symbol}")
+        self.recent: deque = deque(maxlen=settings.TRADES_HISTORY)
+        self.trades = 0
+
+    def subscribe(self, policy: Optional[str] = None) -> Subscriber:
+        sub = Subscriber(settings.CLIENT_QUEUE_MAX, policy or settings.SLOW_CONSUMER_POLICY)
+        self.attach(sub)
+        return sub
+
+    def attach(self, sub: Subscriber):
+        self.clients.add(sub)
+        if self.recent:
+            sub.put(self._frame(list(self.recent)))
+
+    async def ingest(self, payload: dict):
+        trades = payload["trades"]
+        self.trades += len(trades)
+        self.recent.extend(trades)
+        if not self.clients:
+            return
+        t0 = time.perf_counter()
+        frame = self._frame(trades)
+        for sub in self.clients:
+            sub.put(frame)
+        self._m_broadcast.observe(time.perf_counter() - t0)
+
+    def _frame(self, trades: List[dict]) -> str:
+        return self._json_prefix + dumps(trades) + "}"
+
+    def merge(self, frames: List[str]) -> str:
+        """Une varios frames del stream en uno (concatenando los arrays, sin volver a parsear)."""
+        if len(frames) == 1:
+            return frames[0]
+        n = len(self._json_prefix)
+        return self._json_prefix + "[" + ",".join(f[n + 1:-2] for f in frames) + "]}"
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {**super().stats(now), "trades": self.trades}
+
+
+class UpstreamConnection:
+    """
+    Una conexión WebSocket con MEXC Futures que transporta hasta `cap`
+    suscripciones (sub.kline, sub.depth, sub.deal). Una única tarea lectora
+    enruta cada push por (symbol, interval | canal); al reconectar se vuelven a
+    suscribir todas.
+    """
+    def __init__(self, pool: "UpstreamPool", cap: int, conn_id: int):
+        self.pool = pool
+        self.cap = cap
+        self.id = conn_id
+        self.label = str(conn_id)
+        self.subs: Dict[StreamKey, Tuple[str, Dict[str, Any]]] = {}   # key -> (canal, param)
+        self._ws = None
         self._task: Optional[asyncio.Task] = None
         self._stop = asyncio.Event()
 
-    def key(self) -> StreamKey:
-        return (self.symbol, self.interval)
+    def has_room(self) -> bool:
+        return len(self.subs) < self.cap
 
     async def start(self):
         if self._task and not self._task.done():
@@ -43,26 +841,74 @@ class KlineStreamer:
 
     async def stop(self):
         self._stop.set()
+        if self._ws is not None:
+            try:
+                await self._ws.close()
+            except Exception:
+                pass
         if self._task:
             await asyncio.wait([self._task])
+        metrics.upstream_connected.remove(self.label)
+        metrics.upstream_backoff.remove(self.label)
 
-    def subscribe(self) -> asyncio.Queue:
-        q: asyncio.Queue = asyncio.Queue(maxsize=1024)
-        self.clients.add(q)
-        return q
+    async def add(self, key: StreamKey, channel: str, param: Dict[str, Any]):
+        self.subs[key] = (channel, param)
+        await self._send_sub(f"sub.{channel}", key, param)
 
-    def unsubscribe(self, q: asyncio.Queue):
-        self.clients.discard(q)
+    async def remove(self, key: StreamKey):
+        entry = self.subs.pop(key, None)
+        if entry is not None:
+            await self._send_sub(f"unsub.{entry[0]}", key, entry[1])
 
-    async def broadcast(self, msg: dict):
-        dead = []
-        for q in self.clients:
-            try:
-                q.put_nowait(msg)
-            except asyncio.QueueFull:
-                dead.append(q)
-        for q in dead:
-            self.clients.discard(q)
+    async def _send_sub(self, method: str, key: StreamKey, param: Dict[str, Any]):
+        # Si no hay conexión, _run enviará la suscripción al (re)conectar
+        if self._ws is None:
+            return
+        try:
+            await self._ws.send(json.dumps({"method": method, "param": param}))
+            log.info(f"[conn {self.id}] {method}: {key[0]} {key[1]}")
+        except Exception as e:
+            log.warning(f"[conn {self.id}] {method} failed for {key}: {e}")
+
+    async def handle(self, raw):
+        """
+        Un frame upstream: el canal se mira en el texto antes de decodificar, así
+        pong/rs.* y canales ajenos no llegan a parsearse; push.kline se decodifica
+        directamente a la vela normalizada y se enruta a su streamer; push.depth y
+        push.deal se normalizan y van a su DepthStreamer / TradeStreamer.
+        """
+        t0 = time.perf_counter()
+        channel = sniff_channel(raw)
+        if channel is not None and channel != KLINE_CHANNEL:
+            market = MARKET_CHANNELS.get(channel)
+            if market is not None:
+                await self._handle_market(raw, market, t0)
+            return
+        try:
+            decoded = decoder.kline(raw)
+        except Exception:
+            return
+        if decoded is None:
+            return
+        key, candle, ts = decoded
+        # ts = milisegundos en que MEXC emitió el push (t es la apertura de la vela)
+        if ts:
+            metrics.upstream_lag.observe(max(0.0, time.time() - ts / 1000.0))
+        streamer = self.pool.routes.get(key)
+        if streamer is not None:
+            await streamer.on_kline(candle, t0)
+
+    async def _handle_market(self, raw, market: Tuple[str, Callable[[dict], Optional[dict]]], t0: float):
+        name, normalize = market
+        try:
+            payload = normalize(decoder.loads(raw))
+        except Exception:
+            return
+        if payload is None:
+            return
+        streamer = self.pool.routes.get((payload["symbol"], name))
+        if streamer is not None:
+            await streamer.on_message(payload, t0)
 
     async def _run(self):
         backoff = 1
@@ -70,13 +916,17 @@ class KlineStreamer:
             try:
                 # Conexión WS (sin ping automático; lo gestionamos nosotros)
                 async with websockets.connect(settings.MEXC_WS_URL, ping_interval=None) as ws:
-                    # Suscripción a kline
-                    sub = {
-                        "method": "sub.kline",
-                        "param": {"symbol": self.symbol, "interval": self.interval},
-                    }
-                    await ws.send(json.dumps(sub))
-                    log.info(f"Subscribed: {self.symbol} {self.interval}")
+                    self._ws = ws
+                    backoff = 1
+                    metrics.upstream_connected.set(self.label, value=1)
+                    metrics.upstream_backoff.set(self.label, value=0)
+                    # (Re)suscripción de todo lo que transporta esta conexión; lo que
+                    # cerró mientras estábamos desconectados se rellena por REST
+                    for key, (channel, param) in list(self.subs.items()):
+                        streamer = self.pool.routes.get(key)
+                        if streamer is not None:
+                            streamer.mark_resync()
+                        await self._send_sub(f"sub.{channel}", key, param)
 
                     last_ping = 0.0
                     while not self._stop.is_set():
@@ -94,57 +944,204 @@ class KlineStreamer:
                             # Sin datos; seguimos para enviar ping de nuevo
                             continue
 
-                        # Algunos mensajes pueden venir como string JSON
-                        try:
-                            data = json.loads(raw)
-                        except Exception:
-                            continue
-
-                        channel = data.get("channel")
-                        if channel == "pong":
-                            continue
-
-                        if channel == "push.kline":
-                            d = data.get("data", {})
-                            # Estructura típica: { t, o, h, l, c, q?, symbol, interval }
-                            try:
-                                candle = {
-                                    "symbol": d.get("symbol", self.symbol),
-                                    "interval": d.get("interval", self.interval),
-                                    "time": int(d["t"]),            # epoch seconds
-                                    "open": float(d["o"]),
-                                    "high": float(d["h"]),
-                                    "low": float(d["l"]),
-                                    "close": float(d["c"]),
-                                    "volume": float(d.get("q", 0.0)),
-                                }
-                            except Exception as e:
-                                log.debug(f"Malformed kline payload: {e} | {d}")
-                                continue
-
-                            await self.broadcast({"type": "kline", "payload": candle})
+                        await self.handle(raw)
 
                 # Si salimos del contextmanager sin excepción explícita, dormimos y reintentamos
-                log.warning("WS closed gracefully; reconnecting...")
+                if not self._stop.is_set():
+                    log.warning(f"[conn {self.id}] WS closed gracefully; reconnecting...")
             except ConnectionClosed:
-                log.warning("WS connection closed; reconnecting...")
+                if not self._stop.is_set():
+                    log.warning(f"[conn {self.id}] WS connection closed; reconnecting...")
             except Exception as e:
-                log.exception(f"WS error: {e}")
+                log.exception(f"[conn {self.id}] WS error: {e}")
+            finally:
+                self._ws = None
+                metrics.upstream_connected.set(self.label, value=0)
 
+            if self._stop.is_set():
+                break
+            metrics.upstream_reconnects.inc(self.label)
+            metrics.upstream_backoff.set(self.label, value=backoff)
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 10)
 
 
+class UpstreamPool:
+    """
+    Reparte las suscripciones (kline, depth, deal) entre un número reducido de
+    conexiones compartidas con MEXC (como mucho UPSTREAM_MAX_SUBS por conexión).
+    """
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.connections: List[UpstreamConnection] = []
+        self.routes: Dict[StreamKey, UpstreamStreamer] = {}
+        self._by_key: Dict[StreamKey, UpstreamConnection] = {}
+        self._next_id = 0
+
+    async def subscribe(self, streamer: UpstreamStreamer):
+        key = streamer.key()
+        self.routes[key] = streamer
+        if key in self._by_key:
+            return
+        conn = next((c for c in self.connections if c.has_room()), None)
+        if conn is None:
+            self._next_id += 1
+            conn = UpstreamConnection(self, self.cap, self._next_id)
+            self.connections.append(conn)
+        self._by_key[key] = conn
+        await conn.add(key, streamer.channel, streamer.sub_param())
+        await conn.start()
+
+    async def unsubscribe(self, streamer: UpstreamStreamer):
+        key = streamer.key()
+        self.routes.pop(key, None)
+        conn = self._by_key.pop(key, None)
+        if conn is None:
+            return
+        await conn.remove(key)
+        if not conn.subs:
+            self.connections.remove(conn)
+            await conn.stop()
+
+
+class StreamLimitError(Exception):
+    """No se puede abrir otro stream: se alcanzó STREAM_MAX_LIVE y todos están en uso."""
+
+
 class StreamHub:
-    """Gestiona múltiples streams (symbol, interval) y los reutiliza entre clientes."""
+    """
+    Gestiona múltiples streams (symbol, interval) y los reutiliza entre clientes;
+    con interval = DEPTH o DEAL, el libro de órdenes o las operaciones del símbolo.
+
+    Cada stream lleva un contador de referencias (acquire/release). Al quedar sin
+    referencias sigue vivo STREAM_LINGER_SEC por si vuelve a pedirse (p. ej. el
+    usuario alterna símbolos) y después se detiene y se elimina del hub. Como mucho
+    hay STREAM_MAX_LIVE streams vivos: se expulsan primero los ociosos menos usados.
+    """
     def __init__(self):
-        self.streams: Dict[StreamKey, KlineStreamer] = {}
+        self.streams: "OrderedDict[StreamKey, UpstreamStreamer]" = OrderedDict()  # orden LRU
+        self.pool = UpstreamPool(settings.UPSTREAM_MAX_SUBS)
+        self._linger: Dict[StreamKey, asyncio.TimerHandle] = {}
+        # Reaps en curso: el loop solo guarda referencias débiles a las tareas
+        self._tasks: Set[asyncio.Task] = set()
+        self.counters = {"created": 0, "reaped": 0, "evicted": 0, "rejected": 0}
 
-    def get_or_create(self, symbol: str, interval: str) -> KlineStreamer:
+    def get_or_create(self, symbol: str, interval: str) -> UpstreamStreamer:
         key = (symbol, interval)
         if key not in self.streams:
-            self.streams[key] = KlineStreamer(symbol, interval)
+            if interval == DEPTH:
+                self.streams[key] = DepthStreamer(symbol, self.pool)
+            elif interval == DEAL:
+                self.streams[key] = TradeStreamer(symbol, self.pool)
+            elif is_resampled(interval):
+                self.streams[key] = DerivedStreamer(symbol, interval, self.pool, self)
+            else:
+                self.streams[key] = KlineStreamer(symbol, interval, self.pool)
+            self.counters["created"] += 1
+        self.streams.move_to_end(key)
         return self.streams[key]
 
+    async def acquire(self, symbol: str, interval: str) -> UpstreamStreamer:
+        key = (symbol, interval)
+        if key not in self.streams and len(self.streams) >= settings.STREAM_MAX_LIVE:
+            await self._evict_idle(len(self.streams) - settings.STREAM_MAX_LIVE + 1)
+            if len(self.streams) >= settings.STREAM_MAX_LIVE:
+                self.counters["rejected"] += 1
+                raise StreamLimitError(f"max live streams reached ({settings.STREAM_MAX_LIVE})")
+        stream = self.get_or_create(symbol, interval)
+        stream.refs += 1
+        stream.idle_since = None
+        timer = self._linger.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        try:
+            await stream.start()
+        except Exception:
+            # p. ej. un derivado que no consigue su stream Min1
+            self.release(stream)
+            raise
+        return stream
+
+    def release(self, stream: UpstreamStreamer):
+        key = stream.key()
+        if self.streams.get(key) is not stream:
+            return
+        stream.refs = max(0, stream.refs - 1)
+        if stream.refs == 0 and key not in self._linger:
+            stream.idle_since = time.time()
+            loop = asyncio.get_running_loop()
+            self._linger[key] = loop.call_later(settings.STREAM_LINGER_SEC, self._schedule_reap, key)
+
+    def _schedule_reap(self, key: StreamKey):
+        task = asyncio.create_task(self._reap(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reap(self, key: StreamKey):
+        self._linger.pop(key, None)
+        stream = self.streams.get(key)
+        if stream is not None and stream.refs == 0:
+            try:
+                await self._remove(stream)
+            except Exception as e:
+                log.exception(f"Reap failed {key[0]} {key[1]}: {e}")
+                return
+            self.counters["reaped"] += 1
+
+    async def _evict_idle(self, n: int):
+        idle = [st for st in self.streams.values() if st.refs == 0][:n]  # LRU primero
+        for st in idle:
+            await self._remove(st)
+            self.counters["evicted"] += 1
+
+    async def _remove(self, stream: UpstreamStreamer):
+        key = stream.key()
+        timer = self._linger.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self.streams.pop(key, None)
+        await stream.stop()
+        store.live.pop(key, None)
+        log.info(f"Stream stopped: {key[0]} {key[1]}")
+
+    async def rehome(self):
+        for stream in list(self.streams.values()):
+            try:
+                await stream.rehome()
+            except Exception as e:
+                log.warning(f"Re-home failed {stream.symbol} {stream.interval}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        streams = [st.stats(now) for st in self.streams.values()]
+        return {
+            "live": len(self.streams),
+            "lingering": len(self._linger),
+            "max_live": settings.STREAM_MAX_LIVE,
+            "linger_sec": settings.STREAM_LINGER_SEC,
+            "upstream_connections": len(self.pool.connections),
+            **backplane.stats(),
+            **self.counters,
+            "streams": streams,
+        }
+
 
 hub = StreamHub()
+
+
+@metrics.registry.collector
+def _stream_metrics():
+    """Estado de los streams vivos y de las colas de sus clientes, leído en cada scrape."""
+    clients = metrics.Gauge("mexc_stream_clients", "Clientes WebSocket por stream", metrics.STREAM)
+    depth = metrics.Gauge("mexc_client_queue_depth", "Frames pendientes sumando los clientes del stream", metrics.STREAM)
+    worst = metrics.Gauge("mexc_client_queue_max_depth", "Cola más larga entre los clientes del stream", metrics.STREAM)
+    for st in hub.streams.values():
+        lags = [sub.lag for sub in st.clients]
+        clients.set(st.symbol, st.interval, value=len(lags))
+        depth.set(st.symbol, st.interval, value=sum(lags))
+        worst.set(st.symbol, st.interval, value=max(lags, default=0))
+    live = metrics.Gauge("mexc_streams_live", "Streams vivos en el hub")
+    live.set(value=len(hub.streams))
+    conns = metrics.Gauge("mexc_upstream_connections", "Conexiones WebSocket abiertas con MEXC")
+    conns.set(value=len(hub.pool.connections))
+    return [clients, depth, worst, live, conns]
@@ -1,12 +1,190 @@
-import os
+"""
+Notificaciones a Telegram: cola asíncrona con un cliente HTTP compartido.
+
+- Cada alerta se apunta primero en la bandeja de salida (alert_log.outbox) y se
+  encola para cada chat; lo que no se llegó a entregar se reanuda al arrancar.
+- Un worker por chat espera NOTIFY_BATCH_WINDOW_MS desde la primera alerta y
+  agrupa todas las que lleguen en un solo mensaje (hasta 4096 caracteres).
+- Límites de Telegram con token buckets: global por segundo y por chat por minuto.
+- Reintentos con backoff exponencial (con jitter) ante errores de red y 5xx; ante
+  429 se respeta `parameters.retry_after`.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
 import httpx
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TELEGRAM_CHAT_ID   = os.getenv("TELEGRAM_CHAT_ID")
+from settings import settings
+from alert_log import alert_log
+import metrics
+
+log = logging.getLogger("notify")
+
+MAX_TEXT = 4096
+SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """`rate` fichas por segundo con ráfaga máxima `burst`; take() espera hasta tener una."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def take(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TelegramNotifier:
+    def __init__(self):
+        self.token = settings.TELEGRAM_BOT_TOKEN
+        self.chats = [c.strip() for c in settings.TELEGRAM_CHAT_ID.split(",") if c.strip()]
+        self.client: Optional[httpx.AsyncClient] = None
+        self.queues: Dict[str, List[Tuple[str, str]]] = {}   # chat -> [(key, texto)]
+        self.wakeups: Dict[str, asyncio.Event] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+        self.global_bucket = TokenBucket(settings.TELEGRAM_RATE_PER_SEC, settings.TELEGRAM_RATE_PER_SEC)
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token and self.chats)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=f"{settings.TELEGRAM_API_BASE}/bot{self.token}",
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+            )
+        return self.client
+
+    # ---------- ciclo de vida ----------
+    async def start(self):
+        """Reencola lo que quedó sin entregar antes del último reinicio."""
+        if not self.enabled:
+            return
+        pending = alert_log.pending(settings.NOTIFY_RESUME_SEC)
+        for key, chat, text in pending:
+            if chat in self.chats:
+                self._push(chat, key, text)
+        if pending:
+            log.info(f"Resuming {len(pending)} undelivered Telegram notifications")
+
+    async def stop(self):
+        for task in self.workers.values():
+            task.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # ---------- encolado ----------
+    def notify(self, text: str, key: Optional[str] = None):
+        """Encola `text` para todos los chats; con `key` no se repite (ni tras reiniciar)."""
+        if not self.enabled:
+            return
+        key = key or uuid.uuid4().hex
+        for chat in self.chats:
+            if alert_log.enqueue(key, chat, text[:MAX_TEXT]):
+                self._push(chat, key, text[:MAX_TEXT])
+
+    def _push(self, chat: str, key: str, text: str):
+        self.queues.setdefault(chat, []).append((key, text))
+        metrics.notify_pending.set(chat, value=len(self.queues[chat]))
+        if chat not in self.wakeups:
+            self.wakeups[chat] = asyncio.Event()
+            self.chat_buckets[chat] = TokenBucket(settings.TELEGRAM_CHAT_PER_MIN / 60.0, 3)
+        task = self.workers.get(chat)
+        if task is None or task.done():
+            self.workers[chat] = asyncio.create_task(self._worker(chat))
+        self.wakeups[chat].set()
+
+    def _take_batch(self, chat: str) -> Tuple[List[str], str]:
+        """Saca de la cola las alertas que caben en un mensaje y devuelve (claves, texto)."""
+        queue = self.queues[chat]
+        keys, parts, size = [], [], 0
+        while queue:
+            key, text = queue[0]
+            extra = len(text) + (len(SEPARATOR) if parts else 0)
+            if parts and size + extra > MAX_TEXT:
+                break
+            queue.pop(0)
+            keys.append(key)
+            parts.append(text)
+            size += extra
+        metrics.notify_pending.set(chat, value=len(queue))
+        return keys, SEPARATOR.join(parts)
+
+    # ---------- envío ----------
+    async def _worker(self, chat: str):
+        wakeup = self.wakeups[chat]
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            # Ventana de agrupación: lo que llegue mientras tanto sale en el mismo mensaje
+            await asyncio.sleep(settings.NOTIFY_BATCH_WINDOW_MS / 1000.0)
+            while self.queues.get(chat):
+                keys, text = self._take_batch(chat)
+                await self.chat_buckets[chat].take()
+                if await self._send(chat, text):
+                    alert_log.delivered(chat, keys)
+                    metrics.notify_messages.inc("sent")
+                    metrics.notify_coalesced.inc(amount=len(keys))
+                else:
+                    # Sigue pendiente en la bandeja de salida: se reintenta al reanudar
+                    alert_log.failed(chat, keys)
+                    metrics.notify_messages.inc("failed")
+
+    async def _send(self, chat: str, text: str) -> bool:
+        attempt = 0
+        while True:
+            await self.global_bucket.take()
+            retry_after: Optional[float] = None
+            try:
+                r = await self._client().post("/sendMessage", json={"chat_id": chat, "text": text})
+                if r.status_code == 200:
+                    return True
+                if r.status_code == 429:
+                    try:
+                        retry_after = float(r.json()["parameters"]["retry_after"])
+                    except (ValueError, KeyError, TypeError):
+                        retry_after = None
+                elif r.status_code < 500:
+                    log.warning(f"Telegram rejected message for chat {chat}: {r.status_code} {r.text[:200]}")
+                    return False
+                err = f"HTTP {r.status_code}"
+            except httpx.TransportError as e:
+                err = repr(e)
+            attempt += 1
+            if attempt > settings.NOTIFY_RETRIES:
+                log.warning(f"Telegram send to chat {chat} failed after {attempt} attempts ({err})")
+                return False
+            delay = min(settings.REST_BACKOFF_MAX_SEC, settings.REST_BACKOFF_SEC * 2 ** (attempt - 1))
+            delay = retry_after if retry_after is not None else delay * (0.5 + random.random() / 2)
+            metrics.notify_messages.inc("retried")
+            log.warning(f"Telegram send failed ({err}); retry {attempt}/{settings.NOTIFY_RETRIES} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+notifier = TelegramNotifier()
+
 
-async def notify_telegram(text: str):
-    if not (TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID):
-        return
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        await client.post(url, json={"chat_id": TELEGRAM_CHAT_ID, "text": text})
+async def notify_telegram(text: str, key: Optional[str] = None):
+    """Encola una notificación (no espera a la entrega)."""
+    notifier.notify(text, key)
@@ -0,0 +1,118 @@
+"""
+Libro de órdenes en memoria por contrato (push.depth de MEXC Futures).
+
+Cada lado son dos array('d') paralelos (precio, cantidad) ordenados del mejor
+nivel al peor: 16 bytes por nivel, frente a los más de 100 de un dict de floats,
+así que caben cientos de contratos con cientos de niveles por lado. Las bids se
+guardan con el precio negado para que los dos lados sean ascendentes y la misma
+búsqueda binaria (bisect) valga para ambos.
+
+Sincronización: snapshot REST con `version` y después los deltas del WS, que
+deben llegar con version consecutiva. Cada nivel del delta trae la cantidad
+absoluta en ese precio (0 = se elimina). Un delta que se salta versiones deja
+el libro sin sincronizar (SequenceGap) y hay que pedir otro snapshot.
+"""
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Level = Tuple[float, float]
+
+
+def parse_levels(rows: Optional[Iterable[Sequence[Any]]]) -> List[Level]:
+    """[[precio, cantidad, nº órdenes], ...] de MEXC -> [(precio, cantidad)]."""
+    return [(float(r[0]), float(r[1])) for r in rows or ()]
+
+
+class SequenceGap(Exception):
+    """Delta con version no consecutiva: el libro ya no es fiable."""
+
+
+class BookSide:
+    __slots__ = ("sign", "prices", "sizes")
+
+    def __init__(self, bids: bool):
+        self.sign = -1.0 if bids else 1.0
+        self.prices = array("d")
+        self.sizes = array("d")
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def load(self, levels: Iterable[Level]):
+        rows = sorted((self.sign * p, q) for p, q in levels if q > 0)
+        self.prices = array("d", [k for k, _ in rows])
+        self.sizes = array("d", [q for _, q in rows])
+
+    def set(self, price: float, size: float):
+        key = self.sign * price
+        prices = self.prices
+        i = bisect_left(prices, key)
+        if i < len(prices) and prices[i] == key:
+            if size > 0:
+                self.sizes[i] = size
+            else:
+                del prices[i]
+                del self.sizes[i]
+        elif size > 0:
+            prices.insert(i, key)
+            self.sizes.insert(i, size)
+
+    def trim(self, n: int):
+        """Descarta los niveles más alejados a partir del n-ésimo."""
+        if len(self.prices) > n:
+            del self.prices[n:]
+            del self.sizes[n:]
+
+    def best(self) -> Optional[float]:
+        return self.sign * self.prices[0] if self.prices else None
+
+    def top(self, n: int) -> List[List[float]]:
+        s = self.sign
+        return [[s * p, q] for p, q in zip(self.prices[:n], self.sizes[:n])]
+
+
+class OrderBook:
+    __slots__ = ("symbol", "bids", "asks", "version", "ts", "max_levels")
+
+    def __init__(self, symbol: str, max_levels: int):
+        self.symbol = symbol
+        self.bids = BookSide(bids=True)
+        self.asks = BookSide(bids=False)
+        self.version = 0            # 0 = sin snapshot
+        self.ts: Optional[int] = None
+        self.max_levels = max_levels
+
+    def load_snapshot(self, bids: Iterable[Level], asks: Iterable[Level], version: int, ts: Optional[int] = None):
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.bids.trim(self.max_levels)
+        self.asks.trim(self.max_levels)
+        self.version = version
+        self.ts = ts
+
+    def apply(self, bids: Iterable[Level], asks: Iterable[Level], version: int, ts: Optional[int] = None) -> bool:
+        """Aplica un delta. False si ya estaba incluido (version antigua); SequenceGap si falta alguno."""
+        if version <= self.version:
+            return False
+        if version != self.version + 1:
+            raise SequenceGap(f"{self.symbol}: expected version {self.version + 1}, got {version}")
+        for p, q in bids:
+            self.bids.set(p, q)
+        for p, q in asks:
+            self.asks.set(p, q)
+        self.bids.trim(self.max_levels)
+        self.asks.trim(self.max_levels)
+        self.version = version
+        if ts is not None:
+            self.ts = ts
+        return True
+
+    def snapshot(self, n: int) -> Dict[str, Any]:
+        """Top-N de cada lado, del mejor precio al peor: [[precio, cantidad], ...]."""
+        return {"symbol": self.symbol, "version": self.version, "ts": self.ts,
+                "bids": self.bids.top(n), "asks": self.asks.top(n)}
+
+    def nbytes(self) -> int:
+        """Memoria de los niveles (sin la cabecera de los objetos)."""
+        return sum(a.itemsize * len(a) for a in (self.bids.prices, self.bids.sizes, self.asks.prices, self.asks.sizes))
@@ -0,0 +1,88 @@
+"""
+Profiler por muestreo, opcional y activable en caliente.
+
+Un hilo aparte lee cada `interval_ms` la pila del hilo del event loop con
+sys._current_frames() y acumula las pilas plegadas ("a;b;c" -> muestras), el
+formato que entienden flamegraph.pl / speedscope. No instrumenta nada: con el
+profiler parado el coste es cero y en marcha es una lectura de pila por muestra.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+def _stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.samples: Counter = Counter()
+        self.interval = 0.01
+        self.target: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float, target: Optional[int] = None):
+        """Empieza a muestrear `target` (por defecto, el hilo que llama: el del event loop)."""
+        if self.running:
+            return
+        self.samples.clear()
+        self.interval = max(1.0, interval_ms) / 1000.0
+        self.target = target if target is not None else threading.get_ident()
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.stopped_at = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+    def collapsed(self, top: int = 0) -> str:
+        """Pilas plegadas, una por línea: `pila muestras` (las más frecuentes primero)."""
+        rows = self.samples.most_common(top or None)
+        return "".join(f"{stack} {n}\n" for stack, n in rows)
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        total = sum(self.samples.values())
+        # Tiempo propio por función (hoja de cada pila)
+        leaves: Counter = Counter()
+        for stack, n in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 3),
+            "duration_sec": round(end - self.started_at, 1) if self.started_at else 0,
+            "samples": total,
+            "top_self": [{"frame": f, "samples": n, "pct": round(100 * n / total, 1)}
+                         for f, n in leaves.most_common(top)],
+        }
+
+
+profiler = SamplingProfiler()
@@ -6,6 +6,17 @@ class Settings(BaseModel):
     MEXC_WS_URL: str = os.getenv("MEXC_WS_URL", "wss://contract.mexc.com/edge")
     MEXC_REST_BASE: str = os.getenv("MEXC_REST_BASE", "https://contract.mexc.com/api/v1")
 
+    # Cliente REST compartido: HTTP/2 (requiere httpx[http2]), conexiones y reintentos
+    MEXC_HTTP2: bool = os.getenv("MEXC_HTTP2", "1") not in ("0", "false", "False")
+    REST_MAX_CONNECTIONS: int = int(os.getenv("REST_MAX_CONNECTIONS", "20"))
+    REST_RETRIES: int = int(os.getenv("REST_RETRIES", "3"))
+    REST_BACKOFF_SEC: float = float(os.getenv("REST_BACKOFF_SEC", "0.5"))
+    REST_BACKOFF_MAX_SEC: float = float(os.getenv("REST_BACKOFF_MAX_SEC", "8"))
+
+    # Caché de /api/contracts: vida útil y margen stale-while-revalidate
+    CONTRACTS_TTL_SEC: int = int(os.getenv("CONTRACTS_TTL_SEC", "300"))
+    CONTRACTS_STALE_SEC: int = int(os.getenv("CONTRACTS_STALE_SEC", "3600"))
+
     # Parámetros por defecto
     DEFAULT_SYMBOL: str = os.getenv("DEFAULT_SYMBOL", "DOGE_USDT")
     DEFAULT_INTERVAL: str = os.getenv("DEFAULT_INTERVAL", "Min1")
@@ -13,4 +24,88 @@ class Settings(BaseModel):
     # Keep-alive
     PING_INTERVAL_SEC: int = int(os.getenv("PING_INTERVAL_SEC", "15"))
 
+    # Decoder de frames upstream: auto | msgspec | orjson | json (auto = el más rápido instalado)
+    UPSTREAM_DECODER: str = os.getenv("UPSTREAM_DECODER", "auto")
+
+    # Suscripciones sub.kline máximas por conexión compartida con MEXC
+    UPSTREAM_MAX_SUBS: int = int(os.getenv("UPSTREAM_MAX_SUBS", "30"))
+
+    # Ciclo de vida de streams: espera antes de cerrar uno sin clientes y máximo de vivos
+    STREAM_LINGER_SEC: float = float(os.getenv("STREAM_LINGER_SEC", "30"))
+    STREAM_MAX_LIVE: int = int(os.getenv("STREAM_MAX_LIVE", "500"))
+
+    # Fan-out a clientes: tamaño del buffer, política ante cliente lento
+    # (conflate | drop_oldest | disconnect) y close code al desconectar
+    CLIENT_QUEUE_MAX: int = int(os.getenv("CLIENT_QUEUE_MAX", "1024"))
+    SLOW_CONSUMER_POLICY: str = os.getenv("SLOW_CONSUMER_POLICY", "conflate")
+    SLOW_CONSUMER_CLOSE_CODE: int = int(os.getenv("SLOW_CONSUMER_CLOSE_CODE", "4008"))
+
+    # /ws/stream: suscripciones máximas por conexión multiplexada
+    MUX_MAX_SUBSCRIPTIONS: int = int(os.getenv("MUX_MAX_SUBSCRIPTIONS", "100"))
+
+    # Almacén local de velas (SQLite)
+    CANDLE_DB_PATH: str = os.getenv("CANDLE_DB_PATH", "data/candles.sqlite3")
+
+    # Histórico por rangos: velas por petición a MEXC, descargas simultáneas y tope por consulta
+    KLINES_CHUNK_BARS: int = int(os.getenv("KLINES_CHUNK_BARS", "2000"))
+    KLINES_FETCH_CONCURRENCY: int = int(os.getenv("KLINES_FETCH_CONCURRENCY", "4"))
+    KLINES_MAX_BARS: int = int(os.getenv("KLINES_MAX_BARS", "100000"))
+
+    # Intervalos que se derivan localmente del stream/histórico Min1 (una sola
+    # suscripción upstream por símbolo). Vacío = todos nativos
+    RESAMPLE_INTERVALS: str = os.getenv("RESAMPLE_INTERVALS", "Min5,Min15,Min30,Min60,Hour4,Hour8")
+
+    # Libro de órdenes (/ws/depth): niveles del snapshot REST, niveles máximos por lado
+    # en memoria, deltas retenidos mientras se resincroniza, cadencia de envío del
+    # top-N y top por defecto / máximo por cliente
+    DEPTH_SNAPSHOT_LIMIT: int = int(os.getenv("DEPTH_SNAPSHOT_LIMIT", "500"))
+    DEPTH_MAX_LEVELS: int = int(os.getenv("DEPTH_MAX_LEVELS", "500"))
+    DEPTH_BUFFER_MAX: int = int(os.getenv("DEPTH_BUFFER_MAX", "2000"))
+    DEPTH_PUSH_MS: int = int(os.getenv("DEPTH_PUSH_MS", "100"))
+    DEPTH_DEFAULT_TOP: int = int(os.getenv("DEPTH_DEFAULT_TOP", "20"))
+    DEPTH_MAX_TOP: int = int(os.getenv("DEPTH_MAX_TOP", "200"))
+
+    # Operaciones (/ws/trades): últimas que se envían al conectar
+    TRADES_HISTORY: int = int(os.getenv("TRADES_HISTORY", "100"))
+
+    # Backplane entre workers/hosts: local | socket | redis
+    BACKPLANE: str = os.getenv("BACKPLANE", "local")
+    BACKPLANE_SOCKET: str = os.getenv("BACKPLANE_SOCKET", "data/backplane.sock")
+    BACKPLANE_REDIS_URL: str = os.getenv("BACKPLANE_REDIS_URL", "redis://localhost:6379/0")
+    # Vida del liderazgo en Redis (se renueva cada tercio) y buffer máximo por seguidor
+    BACKPLANE_LEADER_TTL_SEC: float = float(os.getenv("BACKPLANE_LEADER_TTL_SEC", "5"))
+    BACKPLANE_PEER_BUFFER: int = int(os.getenv("BACKPLANE_PEER_BUFFER", str(8 * 1024 * 1024)))
+
+    # Huecos en streams en vivo (reconexión): velas máximas a recuperar por REST
+    BACKFILL_MAX_BARS: int = int(os.getenv("BACKFILL_MAX_BARS", "1000"))
+
+    # Alertas: velas cerradas de histórico para calentar cada motor
+    ALERTS_SEED_BARS: int = int(os.getenv("ALERTS_SEED_BARS", "1000"))
+
+    # Registro persistente de alertas (histórico en /api/alerts y reanudación tras reinicio)
+    ALERT_LOG_PATH: str = os.getenv("ALERT_LOG_PATH", "data/alerts.sqlite3")
+    # Alertas registradas que se reenvían como máximo al reanudar un WS con `after`
+    ALERTS_REPLAY_MAX: int = int(os.getenv("ALERTS_REPLAY_MAX", "1000"))
+
+    # Telegram: token, chats destino (separados por comas) y API (configurable para pruebas)
+    TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
+    TELEGRAM_CHAT_ID: str = os.getenv("TELEGRAM_CHAT_ID", "")
+    TELEGRAM_API_BASE: str = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+    # Cola de envío: ventana de agrupación por chat, límites (global por segundo y por
+    # chat por minuto), reintentos y antigüedad máxima de lo pendiente al reanudar
+    NOTIFY_BATCH_WINDOW_MS: int = int(os.getenv("NOTIFY_BATCH_WINDOW_MS", "1500"))
+    TELEGRAM_RATE_PER_SEC: float = float(os.getenv("TELEGRAM_RATE_PER_SEC", "25"))
+    TELEGRAM_CHAT_PER_MIN: float = float(os.getenv("TELEGRAM_CHAT_PER_MIN", "20"))
+    NOTIFY_RETRIES: int = int(os.getenv("NOTIFY_RETRIES", "5"))
+    NOTIFY_RESUME_SEC: int = int(os.getenv("NOTIFY_RESUME_SEC", "3600"))
+
+    # Indicadores: velas previas de calentamiento (NWE usa una RMA de 499 velas)
+    INDICATORS_WARMUP_BARS: int = int(os.getenv("INDICATORS_WARMUP_BARS", "1000"))
+
+    # Observabilidad: /metrics (formato Prometheus) y profiler por muestreo en
+    # /debug/profiler (desactivado salvo PROFILER_ENABLED=1; se arranca/para en caliente)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "1") == "1"
+    PROFILER_ENABLED: bool = os.getenv("PROFILER_ENABLED", "0") == "1"
+    PROFILER_INTERVAL_MS: float = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+
 settings = Settings()
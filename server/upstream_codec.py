@@ -0,0 +1,195 @@
+"""
+Decodificación de los frames del WS de MEXC (camino caliente de UpstreamConnection).
+
+1. `sniff_channel` lee el canal sin parsear el JSON: pong, rs.* y cualquier canal
+   que no sea push.kline se descartan sin decodificar.
+2. El push.kline se decodifica con el decoder configurado (UPSTREAM_DECODER):
+   - msgspec: structs tipados (con slots, sin GC) directamente desde los bytes;
+     los números llegan ya convertidos y se ignoran los campos que no usamos
+   - orjson / json: dict genérico y conversión campo a campo
+   En los tres casos sale la vela normalizada en un único dict, el mismo que
+   recorren después store, indicadores, backplane y el fan-out.
+3. push.deal (operaciones) y push.depth (deltas del libro) se decodifican como
+   dict y se normalizan con MARKET_CHANNELS.
+"""
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple, Union
+
+from settings import settings
+from order_book import parse_levels
+
+try:
+    import orjson
+except ImportError:  # opcional
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # opcional
+    msgspec = None
+
+log = logging.getLogger("codec")
+
+Raw = Union[str, bytes]
+StreamKey = Tuple[str, str]
+# ((symbol, interval), vela normalizada, ts del push en ms o None)
+Decoded = Tuple[StreamKey, Dict[str, Any], Optional[int]]
+
+KLINE_CHANNEL = "push.kline"
+DEAL_CHANNEL = "push.deal"
+DEPTH_CHANNEL = "push.depth"
+# Canal de suscripción (sub.<canal>); ocupa el lugar del intervalo en la StreamKey
+DEAL = "deal"
+DEPTH = "depth"
+
+
+def sniff_channel(raw: Raw) -> Optional[str]:
+    """Valor de "channel" buscándolo en el texto; None si no se encuentra (se decodifica entero)."""
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode("utf-8", "replace")
+    # Forma compacta de MEXC: "channel":"push.kline"
+    i = raw.find('"channel":"')
+    if i >= 0:
+        j = i + 11
+        return raw[j:raw.find('"', j)]
+    i = raw.find('"channel"')
+    if i < 0:
+        return None
+    a = raw.find('"', raw.find(":", i + 9) + 1)
+    b = raw.find('"', a + 1)
+    return raw[a + 1:b] if a > 0 and b > a else None
+
+
+class JsonDecoder:
+    """json estándar: dict genérico y conversión campo a campo."""
+    name = "json"
+
+    def loads(self, raw: Raw) -> Any:
+        return json.loads(raw)
+
+    def kline(self, raw: Raw) -> Optional[Decoded]:
+        """push.kline -> vela normalizada; None si el frame no trae una vela válida."""
+        m = self.loads(raw)
+        if m.get("channel") != KLINE_CHANNEL:
+            return None
+        return self.from_message(m)
+
+    @staticmethod
+    def from_message(m: Dict[str, Any]) -> Optional[Decoded]:
+        d = m.get("data") or {}
+        try:
+            # Estructura típica: { t, o, h, l, c, q?, symbol, interval }
+            key = (d.get("symbol") or m.get("symbol"), d.get("interval"))
+            candle = {
+                "symbol": key[0],
+                "interval": key[1],
+                "time": int(d["t"]),            # epoch seconds
+                "open": float(d["o"]),
+                "high": float(d["h"]),
+                "low": float(d["l"]),
+                "close": float(d["c"]),
+                "volume": float(d.get("q", 0.0)),
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug(f"Malformed kline payload: {e} | {d}")
+            return None
+        return key, candle, m.get("ts")
+
+
+class OrjsonDecoder(JsonDecoder):
+    name = "orjson"
+
+    def loads(self, raw: Raw) -> Any:
+        return orjson.loads(raw)
+
+
+if msgspec is not None:
+    class _KlineData(msgspec.Struct, gc=False):
+        t: int
+        o: float
+        h: float
+        l: float  # noqa: E741
+        c: float
+        q: float = 0.0
+        symbol: Optional[str] = None
+        interval: Optional[str] = None
+
+    class _KlinePush(msgspec.Struct, gc=False):
+        data: _KlineData
+        symbol: Optional[str] = None
+        ts: Optional[int] = None
+
+
+class MsgspecDecoder(JsonDecoder):
+    """Structs tipados de msgspec para push.kline; el resto de frames, como dict."""
+    name = "msgspec"
+
+    def __init__(self):
+        self._any = msgspec.json.Decoder()
+        self._kline = msgspec.json.Decoder(_KlinePush)
+
+    def loads(self, raw: Raw) -> Any:
+        return self._any.decode(raw)
+
+    def kline(self, raw: Raw) -> Optional[Decoded]:
+        try:
+            p = self._kline.decode(raw)
+        except msgspec.ValidationError:
+            # Tipos inesperados (p. ej. números como texto): camino genérico
+            m = self.loads(raw)
+            return self.from_message(m) if m.get("channel") == KLINE_CHANNEL else None
+        d = p.data
+        key = (d.symbol or p.symbol, d.interval)
+        candle = {"symbol": key[0], "interval": key[1], "time": d.t, "open": d.o, "high": d.h,
+                  "low": d.l, "close": d.c, "volume": d.q}
+        return key, candle, p.ts
+
+
+def deals_from_message(m: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """push.deal -> {"symbol", "trades": [{time (ms), price, volume, side}]}."""
+    d = m.get("data")
+    rows = d if isinstance(d, list) else [d] if d else []
+    try:
+        trades = [{"time": int(r["t"]), "price": float(r["p"]), "volume": float(r["v"]),
+                   "side": "buy" if r.get("T") == 1 else "sell"} for r in rows]
+    except (KeyError, TypeError, ValueError) as e:
+        log.debug(f"Malformed deal payload: {e} | {d}")
+        return None
+    symbol = m.get("symbol") or (rows[0].get("symbol") if rows else None)
+    return {"symbol": symbol, "trades": trades} if trades else None
+
+
+def depth_from_message(m: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """push.depth -> {"symbol", "version", "bids", "asks", "ts"} con niveles (precio, cantidad)."""
+    d = m.get("data") or {}
+    try:
+        return {"symbol": m.get("symbol") or d.get("symbol"), "version": int(d["version"]),
+                "bids": parse_levels(d.get("bids")), "asks": parse_levels(d.get("asks")), "ts": m.get("ts")}
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        log.debug(f"Malformed depth payload: {e} | {d}")
+        return None
+
+
+# push.<canal> -> (canal de la StreamKey, normalizador)
+MARKET_CHANNELS = {DEAL_CHANNEL: (DEAL, deals_from_message), DEPTH_CHANNEL: (DEPTH, depth_from_message)}
+
+
+DECODERS = {"json": JsonDecoder, "orjson": OrjsonDecoder, "msgspec": MsgspecDecoder}
+
+
+def create_decoder(name: Optional[str] = None) -> JsonDecoder:
+    """UPSTREAM_DECODER = auto | msgspec | orjson | json (auto: el más rápido instalado)."""
+    name = (name or settings.UPSTREAM_DECODER).lower()
+    available = {"json": True, "orjson": orjson is not None, "msgspec": msgspec is not None}
+    if name == "auto":
+        name = next(n for n in ("msgspec", "orjson", "json") if available[n])
+    if name not in DECODERS:
+        raise ValueError(f"unknown UPSTREAM_DECODER {name!r} (auto | msgspec | orjson | json)")
+    if not available[name]:
+        log.warning(f"UPSTREAM_DECODER={name} not installed; falling back to json")
+        name = "json"
+    return DECODERS[name]()
+
+
+decoder = create_decoder()
@@ -0,0 +1,92 @@
+"""
+Formato binario columnar (opcional) para histórico y frames WebSocket.
+
+Se negocia con `Accept: application/vnd.mexc.columnar` o `?format=binary`.
+Todo en little-endian:
+
+    0   4s   magic b"MXCB"
+    4   u8   versión (1)
+    5   u8   flags: 1 = tiempos en delta, 2 = datos comprimidos con zlib
+    6   u16  número de columnas
+    8   u32  número de filas
+    12  u32  longitud del bloque meta
+    16  ...  meta: JSON utf-8 (p. ej. {"type": "kline", "stream": ..., "symbol": ...})
+    ...      por columna: u8 longitud del nombre, nombre ascii, u8 tipo ('d' float64 | 'q' int64)
+    ...      datos: las columnas una tras otra (filas × 8 bytes cada una), zlib si flag 2
+
+Con delta, la columna "time" lleva el primer valor absoluto y después las
+diferencias con el anterior (muy compresibles: casi siempre el paso del intervalo).
+Los NaN viajan tal cual en las columnas float64.
+"""
+import json
+import struct
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+MEDIA_TYPE = "application/vnd.mexc.columnar"
+MAGIC = b"MXCB"
+VERSION = 1
+FLAG_DELTA = 1
+FLAG_ZLIB = 2
+
+_HEADER = struct.Struct("<4sBBHII")
+_DTYPES = {"d": np.dtype("<f8"), "q": np.dtype("<i8")}
+
+
+def wants_binary(accept: Optional[str], fmt: Optional[str]) -> bool:
+    """El cliente pide el formato binario por query (`format=binary`) o por Accept."""
+    if fmt is not None:
+        return fmt == "binary"
+    return bool(accept) and MEDIA_TYPE in accept
+
+
+def encode(columns: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None,
+           delta: bool = True, compress: bool = False) -> bytes:
+    """Empaqueta columnas de igual longitud; las enteras como int64 y el resto como float64."""
+    meta_b = json.dumps(meta or {}, separators=(",", ":")).encode()
+    n = len(next(iter(columns.values()))) if columns else 0
+    flags = (FLAG_DELTA if delta and "time" in columns else 0) | (FLAG_ZLIB if compress else 0)
+    desc = bytearray()
+    chunks = []
+    for name, col in columns.items():
+        col = np.asarray(col)
+        code = "q" if col.dtype.kind in "iub" else "d"
+        arr = col.astype(_DTYPES[code], copy=False)
+        if len(arr) != n:
+            raise ValueError(f"column {name} has {len(arr)} rows, expected {n}")
+        if name == "time" and flags & FLAG_DELTA and n:
+            arr = np.concatenate((arr[:1], np.diff(arr))).astype(_DTYPES[code], copy=False)
+        name_b = name.encode("ascii")
+        desc += bytes((len(name_b),)) + name_b + code.encode()
+        chunks.append(arr.tobytes())
+    data = b"".join(chunks)
+    if compress:
+        data = zlib.compress(data, 6)
+    return _HEADER.pack(MAGIC, VERSION, flags, len(columns), n, len(meta_b)) + meta_b + bytes(desc) + data
+
+
+def decode(buf: bytes) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Inverso de encode(): devuelve (meta, columnas)."""
+    magic, version, flags, ncols, n, meta_len = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a columnar frame")
+    pos = _HEADER.size
+    meta = json.loads(buf[pos:pos + meta_len])
+    pos += meta_len
+    desc = []
+    for _ in range(ncols):
+        ln = buf[pos]
+        desc.append((buf[pos + 1:pos + 1 + ln].decode("ascii"), chr(buf[pos + 1 + ln])))
+        pos += ln + 2
+    data = buf[pos:]
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    cols: Dict[str, np.ndarray] = {}
+    for i, (name, code) in enumerate(desc):
+        arr = np.frombuffer(data, _DTYPES[code], n, i * n * 8)
+        if name == "time" and flags & FLAG_DELTA:
+            arr = np.cumsum(arr)
+        cols[name] = arr
+    return meta, cols
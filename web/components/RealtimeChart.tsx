@@ -320,7 +320,7 @@ export default function RealtimeChart({ symbol = 'DOGE_USDT', interval = 'Min1'
 
   // WS
   useEffect(() => {
-    const ws = new WebSocket(wsURL({ symbol, interval }));
+    const ws = new WebSocket(wsURL({ symbol, interval, throttleMs: 250 }));
     ws.onmessage = (ev) => {
       const msg = JSON.parse(ev.data);
       if (msg.type === 'kline') {
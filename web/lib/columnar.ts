@@ -0,0 +1,66 @@
+// Decodificador del formato binario columnar del backend (server/wire.py).
+// Se pide con ?format=binary o Accept: application/vnd.mexc.columnar.
+
+export const COLUMNAR_MEDIA_TYPE = 'application/vnd.mexc.columnar';
+
+const FLAG_DELTA = 1;
+const FLAG_ZLIB = 2;
+
+export type Columnar = {
+  meta: Record<string, unknown>;
+  columns: Record<string, Float64Array | BigInt64Array>;
+};
+
+async function inflate(data: Uint8Array): Promise<Uint8Array> {
+  // zlib (RFC 1950) = 'deflate' en DecompressionStream
+  const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+export async function decodeColumnar(buf: ArrayBuffer): Promise<Columnar> {
+  const view = new DataView(buf);
+  const magic = String.fromCharCode(...new Uint8Array(buf, 0, 4));
+  if (magic !== 'MXCB' || view.getUint8(4) !== 1) throw new Error('not a columnar frame');
+  const flags = view.getUint8(5);
+  const ncols = view.getUint16(6, true);
+  const n = view.getUint32(8, true);
+  const metaLen = view.getUint32(12, true);
+  let pos = 16;
+  const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, pos, metaLen)));
+  pos += metaLen;
+
+  const desc: { name: string; code: string }[] = [];
+  for (let i = 0; i < ncols; i++) {
+    const len = view.getUint8(pos);
+    const name = String.fromCharCode(...new Uint8Array(buf, pos + 1, len));
+    desc.push({ name, code: String.fromCharCode(view.getUint8(pos + 1 + len)) });
+    pos += len + 2;
+  }
+
+  let data = new Uint8Array(buf, pos);
+  if (flags & FLAG_ZLIB) data = await inflate(data);
+  // copia alineada a 8 bytes para las vistas tipadas
+  const body = data.slice().buffer;
+
+  const columns: Columnar['columns'] = {};
+  desc.forEach(({ name, code }, i) => {
+    if (code === 'q') {
+      const col = new BigInt64Array(body, i * n * 8, n);
+      if (name === 'time' && flags & FLAG_DELTA) for (let j = 1; j < n; j++) col[j] += col[j - 1];
+      columns[name] = col;
+    } else {
+      columns[name] = new Float64Array(body, i * n * 8, n);
+    }
+  });
+  return { meta, columns };
+}
+
+// Columnas de velas -> objetos (time en segundos como number)
+export function candlesFromColumnar({ columns }: Columnar) {
+  const t = columns.time as BigInt64Array;
+  const col = (k: string) => columns[k] as Float64Array;
+  const [o, h, l, c, v] = ['open', 'high', 'low', 'close', 'volume'].map(col);
+  return Array.from(t, (ts, i) => ({
+    time: Number(ts), open: o[i], high: h[i], low: l[i], close: c[i], volume: v?.[i] ?? 0,
+  }));
+}
@@ -41,10 +41,12 @@ function emaSeries(src: number[], L: number): number[] {
   const out = new Array<number>(n).fill(NaN);
   if (!n || L <= 0) return out;
 
-  // semilla estable = SMA de las primeras L velas
-  let sum = 0, i = 0;
-  for (; i < Math.min(L, n); i++) sum += src[i];
-  if (i < L) return out;               // datos insuficientes
+  // semilla estable = SMA de las primeras L velas (saltando NaN iniciales, como ta.ema)
+  let s0 = 0;
+  while (s0 < n && !Number.isFinite(src[s0])) s0++;
+  let sum = 0, i = s0;
+  for (; i < Math.min(s0 + L, n); i++) sum += src[i];
+  if (i < s0 + L) return out;          // datos insuficientes
   let e = sum / L;
   out[i - 1] = e;
 
@@ -298,7 +300,7 @@ export function HeikinAshiMarketBiasFull(
 
   const haclose = c1.map((_, i) => (o1[i] + h1[i] + l1[i] + c1[i]) / 4);
   const haopen = new Array<number>(n).fill(NaN);
-  for (let i = 0; i < n; i++) haopen[i] = i === 0 ? (o1[i] + c1[i]) / 2 : (haopen[i - 1] + haclose[i - 1]) / 2;
+  for (let i = 0; i < n; i++) haopen[i] = i === 0 || !Number.isFinite(haopen[i - 1]) ? (o1[i] + c1[i]) / 2 : (haopen[i - 1] + haclose[i - 1]) / 2;
   const hahigh = h1.map((hh, i) => Math.max(hh, Math.max(haopen[i], haclose[i])));
   const halow = l1.map((ll, i) => Math.min(ll, Math.min(haopen[i], haclose[i])));
 
@@ -1,8 +1,10 @@
-export function wsURL(params: { symbol?: string; interval?: string } = {}) {
+export function wsURL(params: { symbol?: string; interval?: string; throttleMs?: number } = {}) {
   const base = process.env.NEXT_PUBLIC_BACKEND_WS ?? 'ws://localhost:8000/ws/kline';
   const url = new URL(base);
   if (params.symbol) url.searchParams.set('symbol', params.symbol);
   if (params.interval) url.searchParams.set('interval', params.interval);
+  // conflación en el servidor: como mucho un frame por ventana para la vela en formación
+  if (params.throttleMs) url.searchParams.set('throttle_ms', String(params.throttleMs));
   return url.toString();
 }
 